@@ -0,0 +1,338 @@
+"""Write-behind cache for per-user economy state.
+
+Only this process writes balances / job_counts / highest_jobs / buffs, so hot accounts
+(one per guild a user plays in, keyed (guild_id, user_id)) can live in memory and be
+written back in batches. Reads and mutations are served locally;
+dirty rows go to Postgres with executemany on an interval and on shutdown.
+
+Balance changes that must commit together with other rows (a roulette payout and the
+round's settled mark) can ride in the caller's transaction instead: the caller pins the
+account, writes its balance with write_balances() before committing, and unpins it after,
+undoing the change if the transaction rolled back. Flushes leave pinned accounts alone.
+"""
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+# rough per-user footprint (dicts + floats + OrderedDict slot), used to size the cache
+APPROX_ACCOUNT_BYTES = 1024
+
+
+class Account:
+    __slots__ = ("balance", "counts", "highest", "buff", "dirty")
+
+    def __init__(self, balance: float, counts: dict, highest: dict | None, buff: dict):
+        self.balance = balance
+        self.counts = counts
+        self.highest = highest
+        self.buff = buff
+        self.dirty = set()
+
+    @property
+    def total(self) -> int:
+        return int(sum(self.counts.values()))
+
+
+class AccountCache:
+    def __init__(self, pool, columns, max_users: int = 50_000, flush_interval: float = 5.0):
+        self.pool = pool
+        self.columns = tuple(columns)
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self._accounts: "OrderedDict[tuple[int, int], Account]" = OrderedDict()
+        self._loading: dict[tuple[int, int], asyncio.Future] = {}
+        self._flushing: set[tuple[int, int]] = set()  # keys whose write-back hasn't committed yet
+        self._pinned: dict[tuple[int, int], int] = {}  # keys a caller's open transaction will write
+        self._unpinned = asyncio.Event()
+        self._unpinned.set()
+        self._flush_lock = asyncio.Lock()
+        self._open = asyncio.Event()
+        self._open.set()
+        self._task = None
+
+        cols = ", ".join(f"j.{c}" for c in self.columns)
+        self._load_sql = f"""
+            SELECT b.balance, {cols}, h.job, h.rarity, h.amount, f.uses, f.cooldown_until
+            FROM (SELECT $1::bigint AS guild_id, $2::bigint AS user_id) u
+            LEFT JOIN balances b ON b.guild_id=u.guild_id AND b.user_id=u.user_id
+            LEFT JOIN job_counts j ON j.guild_id=u.guild_id AND j.user_id=u.user_id
+            LEFT JOIN highest_jobs h ON h.guild_id=u.guild_id AND h.user_id=u.user_id
+            LEFT JOIN buffs f ON f.guild_id=u.guild_id AND f.user_id=u.user_id
+        """
+        placeholders = ",".join(f"${i}" for i in range(3, len(self.columns) + 3))
+        updates = ", ".join(f"{c}=EXCLUDED.{c}" for c in self.columns)
+        self._flush_sql = {
+            "balances": """
+                INSERT INTO balances (guild_id, user_id, balance) VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=EXCLUDED.balance
+            """,
+            "job_counts": f"""
+                INSERT INTO job_counts (guild_id, user_id, {", ".join(self.columns)}) VALUES ($1,$2,{placeholders})
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET {updates}
+            """,
+            "highest_jobs": """
+                INSERT INTO highest_jobs (guild_id, user_id, job, rarity, amount) VALUES ($1,$2,$3,$4,$5)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                  job=EXCLUDED.job, rarity=EXCLUDED.rarity, amount=EXCLUDED.amount
+            """,
+            "buffs": """
+                INSERT INTO buffs (guild_id, user_id, uses, cooldown_until) VALUES ($1,$2,$3,$4)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                  uses=EXCLUDED.uses, cooldown_until=EXCLUDED.cooldown_until
+            """,
+        }
+
+    def __len__(self):
+        return len(self._accounts)
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ account cache flush failed, will retry: {e!r}")
+
+    # ---------- loading / eviction ----------
+    async def get(self, gid: int, uid: int) -> Account:
+        key = (gid, uid)
+        while True:
+            await self._open.wait()
+            acct = self._accounts.get(key)
+            if acct is not None:
+                self._accounts.move_to_end(key)
+                return acct
+            fut = self._loading.get(key)
+            if fut is None:
+                fut = asyncio.get_running_loop().create_future()
+                self._loading[key] = fut
+                try:
+                    acct = await self._load(gid, uid)
+                except BaseException as e:
+                    fut.set_exception(e)
+                    fut.exception()  # don't warn when nobody else was waiting
+                    raise
+                finally:
+                    del self._loading[key]
+                # a bulk operation may have started while we were loading; reload after it
+                if self._open.is_set():
+                    self._accounts[key] = acct
+                    self._evict()
+                fut.set_result(None)
+            else:
+                await fut
+
+    async def _load(self, gid: int, uid: int) -> Account:
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(self._load_sql, gid, uid)
+        counts = {c: int(row[c] or 0) for c in self.columns}
+        highest = None
+        if row["job"] is not None:
+            highest = {"job": row["job"], "rarity": row["rarity"], "amount": float(row["amount"] or 0)}
+        buff = {"uses": int(row["uses"] or 0), "cooldown_until": int(row["cooldown_until"] or 0)}
+        return Account(float(row["balance"] or 0.0), counts, highest, buff)
+
+    def _evict(self):
+        # oldest clean entries go first; dirty ones, and those a flush is still writing, stay
+        # walks from the LRU end and stops once under the cap, so a miss costs O(evicted + dirty skipped)
+        accounts = self._accounts
+        skipped = []
+        # the newest entry (the one just loaded) is never a candidate
+        while len(accounts) + len(skipped) > self.max_users and len(accounts) > 1:
+            key, acct = accounts.popitem(last=False)
+            if acct.dirty or key in self._flushing or key in self._pinned:
+                skipped.append((key, acct))
+        for key, acct in reversed(skipped):
+            accounts[key] = acct
+            accounts.move_to_end(key, last=False)  # back at the front, in their old order
+
+    # ---------- write-back ----------
+    async def flush(self):
+        # the connection is taken before the lock, as write_balances() callers already hold theirs
+        async with self.pool.acquire() as conn, self._flush_lock:
+            batches = {table: [] for table in self._flush_sql}
+            snapshot = []
+            for key, acct in self._accounts.items():
+                if not acct.dirty or key in self._pinned:
+                    continue
+                snapshot.append((acct, acct.dirty))
+                self._flushing.add(key)  # pinned until the write commits, or a failure re-marks it
+                if "balances" in acct.dirty:
+                    batches["balances"].append((*key, acct.balance))
+                if "job_counts" in acct.dirty:
+                    batches["job_counts"].append((*key, *(acct.counts[c] for c in self.columns)))
+                if "highest_jobs" in acct.dirty and acct.highest:
+                    h = acct.highest
+                    batches["highest_jobs"].append((*key, h["job"], h["rarity"], h["amount"]))
+                if "buffs" in acct.dirty:
+                    batches["buffs"].append((*key, acct.buff["uses"], acct.buff["cooldown_until"]))
+                acct.dirty = set()
+            if not snapshot:
+                return 0
+            try:
+                async with conn.transaction():
+                    for table, rows in batches.items():
+                        if rows:
+                            await conn.executemany(self._flush_sql[table], rows)
+            except BaseException:
+                for acct, tables in snapshot:
+                    acct.dirty |= tables
+                raise
+            finally:
+                self._flushing.clear()
+            self._evict()
+            return len(snapshot)
+
+    @asynccontextmanager
+    async def paused(self):
+        # for bulk SQL (resets, restores): write everything back, hold new reads, then start cold.
+        # Cold even when the SQL failed, since it may have changed some rows before it did.
+        # Transactions carrying pinned balances finish first; new ones then wait in get()
+        while self._pinned:
+            await self._unpinned.wait()
+        self._open.clear()
+        try:
+            await self.flush()
+            try:
+                yield
+            finally:
+                self._accounts.clear()
+        finally:
+            self._open.set()
+
+    # ---------- write-through ----------
+    def pin(self, key: tuple[int, int]):
+        # after changing a cached balance inside a transaction that will write it (see the module docstring)
+        self._pinned[key] = self._pinned.get(key, 0) + 1
+        self._unpinned.clear()
+
+    async def write_balances(self, conn, keys):
+        # pinned balances, written with the caller's connection in its transaction. The lock
+        # waits out a flush that read them before they were pinned, so it can't land after this;
+        # dirty flags stay set, so a later flush writes the same (or newer) values again
+        async with self._flush_lock:
+            await conn.executemany(self._flush_sql["balances"], [(*key, self._accounts[key].balance) for key in keys])
+
+    def unpin(self, deltas: dict, undo: bool = False):
+        # {key: balance delta} the caller's transaction carried; undo=True takes them back out after a rollback
+        for key, delta in deltas.items():
+            if undo:
+                acct = self._accounts[key]  # pinned accounts are never evicted
+                acct.balance -= delta
+                acct.dirty.add("balances")
+            left = self._pinned[key] - 1
+            if left:
+                self._pinned[key] = left
+            else:
+                del self._pinned[key]
+        if not self._pinned:
+            self._unpinned.set()
+
+    def forget_guild(self, gid: int) -> int:
+        # another process rewrote this guild's rows: drop what we hold for it so the next read
+        # reloads. Unwritten changes stay (and win on the next flush), so bulk rewrites of a
+        # guild still belong on the process that serves it, or with the bot stopped.
+        stale = [key for key, acct in self._accounts.items()
+                 if key[0] == gid and not acct.dirty and key not in self._flushing and key not in self._pinned]
+        for key in stale:
+            del self._accounts[key]
+        return len(stale)
+
+    # ---------- mutations (mirror the bot.py helpers) ----------
+    async def set_balance(self, gid: int, uid: int, amount: float):
+        acct = await self.get(gid, uid)
+        acct.balance = float(amount)
+        acct.dirty.add("balances")
+
+    async def add_balance(self, gid: int, uid: int, delta: float) -> float:
+        acct = await self.get(gid, uid)
+        acct.balance += float(delta)
+        acct.dirty.add("balances")
+        return acct.balance
+
+    async def try_debit(self, gid: int, uid: int, amount: float, delta: float) -> float | None:
+        acct = await self.get(gid, uid)
+        if acct.balance < amount:
+            return None
+        acct.balance += float(delta)
+        acct.dirty.add("balances")
+        return acct.balance
+
+    async def debit_fraction(self, gid: int, uid: int, fraction: float):
+        acct = await self.get(gid, uid)
+        if acct.balance <= 0:
+            return None
+        taken = round(acct.balance * fraction, 2)
+        acct.balance -= taken
+        acct.dirty.add("balances")
+        return taken, acct.balance
+
+    async def transfer_balance(self, gid: int, from_uid: int, to_uid: int, amount: float):
+        while True:
+            receiver = await self.get(gid, to_uid)
+            payer = await self.get(gid, from_uid)
+            # loading the payer may have suspended long enough for the receiver to be evicted
+            if self._accounts.get((gid, to_uid)) is receiver:
+                break
+        if payer.balance < amount:
+            return None
+        payer.balance -= float(amount)
+        receiver.balance += float(amount)
+        payer.dirty.add("balances")
+        receiver.dirty.add("balances")
+        return payer.balance, receiver.balance
+
+    async def set_job_counts(self, gid: int, uid: int, counts: dict):
+        acct = await self.get(gid, uid)
+        acct.counts = {c: int(counts.get(c, 0)) for c in self.columns}
+        acct.dirty.add("job_counts")
+
+    async def update_highest_job(self, gid: int, uid: int, job: str, rarity: str, amount: float) -> bool:
+        acct = await self.get(gid, uid)
+        if acct.highest and amount <= acct.highest["amount"]:
+            return False
+        acct.highest = {"job": job, "rarity": rarity, "amount": float(amount)}
+        acct.dirty.add("highest_jobs")
+        return True
+
+    async def record_work(self, gid: int, uid: int, roll) -> dict:
+        acct = await self.get(gid, uid)
+        total_before = acct.total
+        result = roll(total_before)
+        acct.balance += float(result["amount"])
+        acct.counts[result["rarity"]] = acct.counts.get(result["rarity"], 0) + 1
+        acct.dirty.update(("balances", "job_counts"))
+        new_high = not acct.highest or result["amount"] > acct.highest["amount"]
+        if new_high:
+            acct.highest = {"job": result["job"], "rarity": result["rarity"], "amount": float(result["amount"])}
+            acct.dirty.add("highest_jobs")
+        result.update(total_before=total_before, total=acct.total, balance=acct.balance, new_high=new_high)
+        return result
+
+    async def claim_boost(self, gid: int, uid: int, uses: int, cooldown_until: int, now: int) -> dict | None:
+        acct = await self.get(gid, uid)
+        if acct.buff["cooldown_until"] > now:
+            return None
+        prev, acct.buff = acct.buff, {"uses": int(uses), "cooldown_until": int(cooldown_until)}
+        acct.dirty.add("buffs")
+        return dict(prev)
+
+    async def set_boost_record(self, gid: int, uid: int, uses: int, cooldown_until: int):
+        acct = await self.get(gid, uid)
+        acct.buff = {"uses": int(uses), "cooldown_until": int(cooldown_until)}
+        acct.dirty.add("buffs")
@@ -0,0 +1,152 @@
+"""Outbound announcement queue.
+
+Commands hand messages to post() and return at once. Each channel has one outbox whose
+worker waits a short window, then sends whatever piled up as few messages as Discord's
+limits allow: text lines are joined into digests, embeds packed ten to a message, and the
+original order is kept. discord.py already waits out each route's bucket from the
+rate-limit headers; if a send still fails with 429/5xx, the same message is retried after
+Retry-After (or a backoff) instead of being lost.
+"""
+import asyncio
+from collections import deque
+from itertools import groupby
+
+import discord
+
+from role_sync import backoff_delay, is_transient
+
+MESSAGE_CONTENT_LIMIT = 2000
+MESSAGE_EMBED_COUNT = 10
+MESSAGE_EMBED_CHARS = 6000  # all embeds on one message combined
+
+
+def pack_lines(lines, limit: int = MESSAGE_CONTENT_LIMIT) -> list[str]:
+    pages, cur = [], ""
+    for line in lines:
+        line = line[:limit]
+        if cur and len(cur) + len(line) + 1 > limit:
+            pages.append(cur)
+            cur = ""
+        cur = f"{cur}\n{line}" if cur else line
+    if cur:
+        pages.append(cur)
+    return pages
+
+
+def pack_embeds(embeds) -> list[list]:
+    batches, batch, size = [], [], 0
+    for embed in embeds:
+        n = len(embed)
+        if batch and (size + n > MESSAGE_EMBED_CHARS or len(batch) == MESSAGE_EMBED_COUNT):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(embed)
+        size += n
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _retry_after(exc: BaseException) -> float | None:
+    if isinstance(exc, discord.RateLimited):
+        return exc.retry_after
+    response = getattr(exc, "response", None)
+    if getattr(exc, "status", None) == 429 and response is not None:
+        try:
+            return float(response.headers.get("Retry-After"))
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+class _Outbox:
+    __slots__ = ("items", "wake", "task")
+
+    def __init__(self):
+        self.items = deque()  # ("text", str) | ("embed", discord.Embed)
+        self.wake = asyncio.Event()
+        self.task = None
+
+
+class Announcer:
+    def __init__(self, client: discord.Client, window: float = 1.5, max_attempts: int = 5):
+        self.client = client
+        self.window = window
+        self.max_attempts = max_attempts
+        self._outboxes: dict[int, _Outbox] = {}
+        self.posted = 0   # lines/embeds handed to post()
+        self.sent = 0     # messages that went out
+        self.dropped = 0  # messages given up on
+
+    def pending(self) -> int:
+        return sum(len(box.items) for box in self._outboxes.values())
+
+    def post(self, channel_id: int, content: str | None = None, *, embed: discord.Embed | None = None,
+             embeds=(), urgent: bool = False):
+        # queue and return; urgent skips the rest of the coalescing window (timers, results)
+        box = self._outboxes.get(channel_id)
+        if box is None:
+            box = self._outboxes[channel_id] = _Outbox()
+        added = [("text", content)] if content else []
+        added += [("embed", e) for e in ([embed] if embed is not None else []) + list(embeds)]
+        box.items.extend(added)
+        self.posted += len(added)
+        if urgent:
+            box.wake.set()
+        if box.task is None or box.task.done():
+            box.task = asyncio.create_task(self._drain(channel_id, box))
+
+    async def flush(self, timeout: float | None = None):
+        # wait for everything queued so far to go out (used on shutdown)
+        tasks = [box.task for box in self._outboxes.values() if box.task and not box.task.done()]
+        for box in self._outboxes.values():
+            box.wake.set()
+        if tasks:
+            await asyncio.wait(tasks, timeout=timeout)
+
+    async def close(self, timeout: float = 5.0):
+        await self.flush(timeout)
+        for box in self._outboxes.values():
+            if box.task and not box.task.done():
+                box.task.cancel()
+
+    async def _drain(self, channel_id: int, box: _Outbox):
+        while box.items:
+            try:
+                await asyncio.wait_for(box.wake.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+            box.wake.clear()
+            items = list(box.items)
+            box.items.clear()
+            channel = self.client.get_channel(channel_id)
+            if channel is None:
+                self.dropped += len(self._compose(items))
+                continue
+            for message in self._compose(items):
+                await self._send(channel, message)
+
+    @staticmethod
+    def _compose(items) -> list[dict]:
+        # runs of text become digests, runs of embeds get packed; order between runs is kept
+        messages = []
+        for kind, run in groupby(items, key=lambda item: item[0]):
+            payloads = [payload for _, payload in run]
+            if kind == "text":
+                messages += [{"content": page} for page in pack_lines(payloads)]
+            else:
+                messages += [{"embeds": batch} for batch in pack_embeds(payloads)]
+        return messages
+
+    async def _send(self, channel, message: dict):
+        for attempt in range(self.max_attempts):
+            try:
+                await channel.send(**message)
+                self.sent += 1
+                return
+            except Exception as e:
+                if not is_transient(e) or attempt + 1 == self.max_attempts:
+                    self.dropped += 1
+                    print(f"⚠️ announcement to {channel.id} dropped: {e!r}")
+                    return
+                await asyncio.sleep(_retry_after(e) or backoff_delay(attempt, 1.0, 30.0))
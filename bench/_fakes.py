@@ -0,0 +1,155 @@
+"""In-memory stand-ins for the asyncpg pool and for discord interactions, so benches can drive bot.py
+without Postgres or a gateway connection."""
+import os
+import sys
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+class FakeRow(dict):
+    # unknown columns read as 0 so any helper can parse the row
+    def __missing__(self, key):
+        return 0
+
+
+class CountingConnection:
+    def __init__(self, pool):
+        self._pool = pool
+
+    def _hit(self, query):
+        self._pool.queries += 1
+        self._pool.log.append(" ".join(query.split())[:60])
+
+    def transaction(self):
+        return _FakeTransaction()
+
+    async def execute(self, query, *args):
+        self._hit(query)
+        return "OK"
+
+    async def executemany(self, query, args):
+        self._hit(query)
+
+    async def fetch(self, query, *args):
+        self._hit(query)
+        return []
+
+    async def fetchrow(self, query, *args):
+        self._hit(query)
+        # reads of missing users come back empty, writes with RETURNING hand back a row, and so
+        # does the account cache's load (its LEFT JOINs hang off a one-row subquery)
+        return FakeRow() if "RETURNING" in query or "LEFT JOIN" in query else None
+
+    async def fetchval(self, query, *args):
+        self._hit(query)
+        return 0
+
+    async def copy_records_to_table(self, table, **kwargs):
+        self._hit(f"COPY {table}")
+
+    def cursor(self, query, *args, **kwargs):
+        self._hit(query)
+        return _EmptyCursor()
+
+
+class _FakeTransaction:
+    # usable both as `async with conn.transaction()` and through start()/commit()/rollback()
+    async def start(self):
+        pass
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class _EmptyCursor:
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        raise StopAsyncIteration
+
+
+class CountingPool:
+    """Counts acquires and statements; every statement is one network round trip on a real pool."""
+
+    def __init__(self):
+        self.acquires = 0
+        self.queries = 0
+        self.log = []
+
+    def reset(self):
+        self.acquires = 0
+        self.queries = 0
+        self.log = []
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquires += 1
+        yield CountingConnection(self)
+
+
+class FakeUser:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.name = self.display_name = f"user{uid}"
+        self.mention = f"<@{uid}>"
+
+
+class FakeGuild:
+    # every member is "cached", so leaderboards never fall back to fetch_user
+    def __init__(self, gid: int):
+        self.id = gid
+        self.filesize_limit = 25 * 1024 * 1024
+
+    def get_member(self, uid: int):
+        return FakeUser(uid)
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.sent.append(content if content is not None else kwargs.get("embed"))
+
+    async def defer(self, **kwargs):
+        self._done = True
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        self._interaction.sent.append(content if content is not None else kwargs.get("embed"))
+
+
+class FakeInteraction:
+    """Just what the command callbacks read; replies are kept in .sent instead of going to Discord."""
+
+    def __init__(self, interaction_id: int, guild: FakeGuild, user_id: int, channel_id: int):
+        self.id = interaction_id
+        self.guild = guild
+        self.guild_id = guild.id
+        self.user = FakeUser(user_id)
+        self.channel_id = channel_id
+        self.channel = None
+        self.extras = {}
+        self.sent = []
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
@@ -0,0 +1,46 @@
+"""Check that the account cache answers repeat reads from memory.
+
+Reads one user's balance twice through bot.py with the cache on, over a CountingPool, and
+fails unless the first read loaded the account (one query) and the second issued none.
+
+    python bench/account_cache_hits.py
+"""
+import asyncio
+from contextlib import asynccontextmanager
+
+from _fakes import CountingConnection, CountingPool, FakeRow
+
+import bot
+from account_cache import AccountCache
+
+GID, UID = 1, 1234
+
+
+class _LoadConnection(CountingConnection):
+    async def fetchrow(self, query, *args):
+        self._hit(query)
+        return FakeRow()  # the cache's load always gets a row back (LEFT JOINs off a one-row subquery)
+
+
+class LoadPool(CountingPool):
+    @asynccontextmanager
+    async def acquire(self):
+        self.acquires += 1
+        yield _LoadConnection(self)
+
+
+async def main():
+    bot.pool = LoadPool()
+    bot.account_cache = AccountCache(bot.pool, bot.JOB_COUNT_COLUMNS)
+    print(f"{'read':<8}{'acquires':>10}{'queries':>10}")
+    counts = []
+    for name in ("cold", "warm"):
+        bot.pool.reset()
+        await bot.get_balance(GID, UID)
+        counts.append(bot.pool.queries)
+        print(f"{name:<8}{bot.pool.acquires:>10}{bot.pool.queries:>10}")
+    assert counts == [1, 0], f"expected one load then a cache hit, got {counts} queries"
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+"""Load test: drive the command callbacks with fake interactions and report throughput.
+
+Runs a weighted mix of /work, /coinflip, /roulette, /pay and the leaderboards through the
+real handlers in bot.py, `--concurrency` at a time, and prints commands/sec, p50/p99 latency
+and database queries per command. The backend is either the in-memory CountingPool (Python
+and query-count cost only) or a real Postgres; use a scratch database, since the run writes
+balances, ledger rows and roulette rounds for `--guild-id`.
+
+    python bench/loadtest.py --commands 5000 --concurrency 50
+    python bench/loadtest.py --dsn postgresql://postgres@127.0.0.1:5432/scratch --account-cache
+
+In memory no query ever yields to the event loop, so a command that waits on a background
+writer (a roulette bet waits for its journal commit) also waits for the other workers; its
+latency there says little. Callbacks are called directly, so command checks (rate limits)
+don't apply. Roulette rounds
+settle in the background and are waited for at the end; their settlement queries count
+towards /roulette, the journal and ledger writers' towards "background".
+"""
+import argparse
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from _fakes import CountingPool, FakeGuild, FakeInteraction
+
+import asyncpg
+import bot
+from account_cache import AccountCache
+
+_command: ContextVar = ContextVar("command", default="background")
+
+DEFAULT_MIX = "work=6,coinflip=3,roulette=2,pay=2,leaderboard=1"
+_QUERY_METHODS = ("execute", "executemany", "fetch", "fetchrow", "fetchval", "cursor", "copy_records_to_table")
+
+
+class _TalliedConnection:
+    def __init__(self, conn, tally: dict):
+        self._conn = conn
+        self._tally = tally
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name not in _QUERY_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            cmd = _command.get()
+            self._tally[cmd] = self._tally.get(cmd, 0) + 1
+            return attr(*args, **kwargs)
+        return counted
+
+
+class TalliedPool:
+    """Pool proxy that counts statements per command (whichever one the calling task is running)."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.tally = {}
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    @asynccontextmanager
+    async def acquire(self):
+        async with self._pool.acquire() as conn:
+            yield _TalliedConnection(conn, self.tally)
+
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(COMMANDS)
+    if unknown:
+        raise SystemExit(f"unknown commands in --mix: {sorted(unknown)} (known: {sorted(COMMANDS)})")
+    return mix
+
+
+# ---------- commands ----------
+# each takes (interaction, rng, args) and awaits the real callback
+
+async def _work(i, rng, args):
+    await bot.work_cmd.callback(i)
+
+
+async def _coinflip(i, rng, args):
+    await bot.coinflip.callback(i, rng.choice(("heads", "tails")), float(rng.randint(1, 100)))
+
+
+async def _roulette(i, rng, args):
+    i.channel_id = args.channel_base + rng.randrange(args.tables)
+    await bot.roulette.callback(i, rng.choice(("red", "black", "odd", "1st12", "17")), float(rng.randint(1, 100)))
+    table = bot.roulette_tables.get(i.channel_id)
+    if table is not None:
+        args.round_tasks.add(table.task)
+
+
+async def _pay(i, rng, args):
+    other = args.user_base + rng.randrange(args.users)
+    if other == i.user.id:
+        other = args.user_base + (other - args.user_base + 1) % args.users
+    await bot.pay_cmd.callback(i, FakeGuild(i.guild_id).get_member(other), float(rng.randint(1, 50)))
+
+
+async def _leaderboard(i, rng, args):
+    cmd = bot.leaderboardmoney if rng.random() < 0.5 else bot.leaderboardjob
+    await cmd.callback(i, 1 + rng.randrange(3))
+
+
+COMMANDS = {"work": _work, "coinflip": _coinflip, "roulette": _roulette, "pay": _pay, "leaderboard": _leaderboard}
+
+
+# ---------- run ----------
+async def setup(args):
+    if args.dsn:
+        raw = await asyncpg.create_pool(args.dsn, min_size=1, max_size=args.pool_size)
+        bot.pool = TalliedPool(raw)
+        await bot.init_db()
+    else:
+        raw = None
+        bot.pool = TalliedPool(CountingPool())
+    bot.announcer.post = lambda *a, **k: None  # channel posts need a gateway; they're queued work anyway
+    bot.ROULETTE_WINDOW_SECONDS = args.roulette_window
+    await bot.guild_configs.load_all()
+    await bot.reload_buffs()
+    if args.account_cache:
+        bot.account_cache = AccountCache(bot.pool, bot.JOB_COUNT_COLUMNS)
+        bot.account_cache.start()
+    await bot.ledger_writer.flush()
+    bot.ledger_writer.start()
+    bot.round_journal.start()  # started here, so its writes aren't charged to the first roulette bet
+    # every user starts with enough money to keep betting and paying
+    await bot.credit_many(args.guild_id, {args.user_base + n: 1_000_000.0 for n in range(args.users)},
+                          reason="work", detail="loadtest")
+    await bot.load_leaderboards(args.guild_id)
+    bot.pool.tally.clear()
+    return raw
+
+
+async def run(args):
+    raw = await setup(args)
+    mix = parse_mix(args.mix)
+    names, weights = list(mix), list(mix.values())
+    guild = FakeGuild(args.guild_id)
+    latencies = {name: [] for name in names}
+    errors = {}
+    next_id = iter(range(time.time_ns() // 1000, 1 << 62))  # unique per run, like snowflakes
+    remaining = [args.commands]
+
+    async def worker(seed: int):
+        rng = random.Random(seed)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            name = rng.choices(names, weights)[0]
+            uid = args.user_base + rng.randrange(args.users)
+            interaction = FakeInteraction(next(next_id), guild, uid, args.channel_base)
+            token = _command.set(name)
+            t0 = time.perf_counter()
+            try:
+                await COMMANDS[name](interaction, rng, args)
+            except Exception as e:
+                errors[(name, type(e).__name__)] = errors.get((name, type(e).__name__), 0) + 1
+            latencies[name].append(time.perf_counter() - t0)
+            _command.reset(token)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(args.seed + n) for n in range(args.concurrency)))
+    elapsed = time.perf_counter() - t0
+    if args.round_tasks:
+        print(f"waiting for {len(args.round_tasks)} roulette round(s) to settle...")
+        for result in await asyncio.gather(*args.round_tasks, return_exceptions=True):
+            if isinstance(result, Exception):
+                key = ("roulette round", type(result).__name__)
+                errors[key] = errors.get(key, 0) + 1
+    await bot.round_journal.flush()
+    await bot.ledger_writer.flush()
+    if bot.account_cache is not None:
+        await bot.account_cache.flush()
+
+    report(latencies, bot.pool.tally, elapsed, errors)
+    await bot.round_journal.close()
+    await bot.ledger_writer.close()
+    if bot.account_cache is not None:
+        await bot.account_cache.close()
+    if raw is not None:
+        await raw.close()
+
+
+def _pct(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))] if sorted_values else 0.0
+
+
+def report(latencies: dict, tally: dict, elapsed: float, errors: dict):
+    total = sum(len(v) for v in latencies.values())
+    print(f"{total} commands in {elapsed:.2f}s = {total / elapsed:,.0f} commands/s")
+    print(f"{'command':<14}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'queries/cmd':>14}")
+    for name, values in latencies.items():
+        values.sort()
+        per = tally.get(name, 0) / len(values) if values else 0.0
+        print(f"{name:<14}{len(values):>8}{_pct(values, 0.5) * 1000:>10.2f}{_pct(values, 0.99) * 1000:>10.2f}{per:>14.2f}")
+    print(f"{'background':<14}{'':>8}{'':>10}{'':>10}{tally.get('background', 0):>14} total")
+    for (name, error), n in sorted(errors.items()):
+        print(f"  ! {name}: {n} x {error}")
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    p.add_argument("--dsn", help="Postgres to run against (default: in-memory CountingPool)")
+    p.add_argument("--commands", type=int, default=2000)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted command mix (default {DEFAULT_MIX})")
+    p.add_argument("--tables", type=int, default=4, help="roulette channels bets are spread over")
+    p.add_argument("--roulette-window", type=int, default=5, help="seconds a round stays open (5 minimum)")
+    p.add_argument("--account-cache", action="store_true", help="run with the write-behind account cache")
+    p.add_argument("--pool-size", type=int, default=10)
+    p.add_argument("--guild-id", type=int, default=1)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+    args.user_base, args.channel_base = 10_000, 500
+    args.round_tasks = set()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
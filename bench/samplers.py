@@ -0,0 +1,83 @@
+"""Micro-benchmark: compiled alias samplers vs the old linear-scan rolls.
+
+The legacy_* functions are the pre-sampler implementations from bot.py, kept here as the
+baseline. Also prints the largest per-outcome frequency gap so a broken table stands out.
+
+    python bench/samplers.py [draws]
+"""
+import random
+import sys
+import timeit
+from collections import Counter
+
+import _fakes  # noqa: F401  (puts the repo root on sys.path)
+import bot
+
+
+def legacy_pick_rarity(allowed):
+    allowed = dict(allowed)
+    total_pct = sum(allowed.values()) or 100
+    roll = random.uniform(0, total_pct)
+    cum = 0.0
+    for r, pct in allowed.items():
+        cum += pct
+        if roll <= cum:
+            return r
+    return "common"
+
+
+def legacy_roll_tip():
+    if random.random() > bot.TIP_BASE_CHANCE:
+        return None
+    total_weight = sum(t["weight"] for t in bot.tip_tiers)
+    pick = random.uniform(0, total_weight)
+    upto = 0
+    chosen = bot.tip_tiers[-1]
+    for t in bot.tip_tiers:
+        upto += t["weight"]
+        if pick <= upto:
+            chosen = t
+            break
+    mult = round(random.uniform(*chosen["range"]), 2)
+    return {"name": chosen["name"], "mult": mult}
+
+
+def legacy_pick_special_job():
+    if random.random() > bot.SPECIAL_CHANCE:
+        return None
+    job = random.choice(bot.special_jobs)
+    if job["name"] == "dev" and random.randint(1, bot.DEV_CHANCE_DENOM) != 777:
+        return None
+    if job["name"] == "glitch" and not random.random() <= 0.30:
+        return None
+    return {"name": job["name"], "payout_value": round(random.uniform(*job["payout"]), 2)}
+
+
+def max_gap(a, b, n):
+    keys = set(a) | set(b)
+    return max(abs(a[k] - b[k]) / n for k in keys)
+
+
+def main():
+    draws = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    top = bot.CAREER_PATH[-1]["allowed"]
+    top_sampler = bot._TIER_SAMPLERS[-1]
+    cases = [
+        ("tier rarity", lambda: legacy_pick_rarity(top), top_sampler.sample, lambda n: top_sampler.sample(n)),
+        ("tip", legacy_roll_tip, bot.roll_tip, None),
+        ("special", legacy_pick_special_job, bot.pick_special_job, None),
+    ]
+    print(f"{'roll':<14}{'legacy ns':>12}{'alias ns':>12}{'batch ns':>12}{'speedup':>9}{'max gap':>10}")
+    for name, legacy, new, batch in cases:
+        t_old = timeit.timeit(legacy, number=draws) / draws * 1e9
+        t_new = timeit.timeit(new, number=draws) / draws * 1e9
+        t_batch = timeit.timeit(lambda: batch(draws), number=1) / draws * 1e9 if batch else float("nan")
+        key = lambda r: r if isinstance(r, str) or r is None else r["name"]
+        old_counts = Counter(key(legacy()) for _ in range(draws))
+        new_counts = Counter(key(new()) for _ in range(draws))
+        print(f"{name:<14}{t_old:>12.0f}{t_new:>12.0f}{t_batch:>12.0f}{t_old / t_new:>8.1f}x"
+              f"{max_gap(old_counts, new_counts, draws):>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
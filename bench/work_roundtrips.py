@@ -0,0 +1,45 @@
+"""Count the database round trips behind a single /work.
+
+Compares the old helper-by-helper pipeline (pick_job -> add_balance -> increment_job ->
+get_job_counts -> update_highest_job) against record_work.
+
+    python bench/work_roundtrips.py
+"""
+import asyncio
+
+from _fakes import CountingPool
+
+import bot
+
+GID, UID = 1, 1234
+
+
+async def legacy_work():
+    rarity, job, payout, _ = await bot.pick_job(GID, UID)
+    await bot.add_balance(GID, UID, payout, reason="work")
+    await bot.increment_job(GID, UID, rarity)
+    await bot.get_job_counts(GID, UID)  # update_job_progress re-read
+    await bot.update_highest_job(GID, UID, job, rarity, payout)
+
+
+async def record_work():
+    def roll(total_jobs):
+        rarity, job, payout, _ = bot.roll_job(total_jobs)
+        return {"rarity": rarity, "job": job, "amount": payout}
+
+    await bot.record_work(GID, UID, roll)
+
+
+async def main():
+    bot.pool = CountingPool()
+    print(f"{'pipeline':<14}{'acquires':>10}{'queries':>10}")
+    for name, fn in (("legacy", legacy_work), ("record_work", record_work)):
+        bot.pool.reset()
+        await fn()
+        print(f"{name:<14}{bot.pool.acquires:>10}{bot.pool.queries:>10}")
+        for q in bot.pool.log:
+            print(f"    {q}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
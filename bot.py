@@ -1,14 +1,34 @@
 # --- imports & setup ---
 import os
+import json
+import hashlib
 import time
 import random
 import asyncio
-import json
+from bisect import bisect_right
+from datetime import timedelta
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 import asyncpg
 import discord
 from discord.ext import commands
 from discord import app_commands
 from dotenv import load_dotenv
+from account_cache import AccountCache, APPROX_ACCOUNT_BYTES
+from ranking import Ranking
+import roulette as roulette_engine
+from sampling import AliasSampler, UniformRange
+import state_io
+from role_sync import RoleReconciler, RoleSyncQueue
+from announcer import Announcer
+from metrics import InstrumentedPool, Metrics
+import ledger
+import roulette_journal
+import migrations
+from guild_config import GuildConfigCache
+from cluster import Cluster
+from buffs import BuffEngine, BuffKind
+from ratelimit import Cooldown, RateLimited, RateLimiter
 
 
 # --------------------------------
@@ -16,15 +36,113 @@ from dotenv import load_dotenv
 # --------------------------------
 BOT_VERSION = "V0.0.09"
 
+class EconomyBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        await startup()
+
+    async def close(self):
+        # write back cached accounts before the pool goes away
+        if account_cache is not None:
+            await account_cache.close()
+        await round_journal.close()
+        await ledger_writer.close()
+        await role_sync.close()
+        await role_reconciler.close()
+        await announcer.close()
+        await super().close()
+        await cluster.close()  # releases this process's roulette table locks
+        if pool is not None:
+            await pool.close()
+
+# ---------- Metrics ----------
+perf = Metrics("economy_bot")
+perf.histogram("command_seconds", "Slash command handler time, from dispatch to return")
+perf.counter("command_errors_total", "Slash commands that raised or failed a check")
+perf.counter("rate_limited_total", "Slash commands turned away by a rate limit")
+perf.histogram("db_helper_seconds", "DB helper latency, including pool wait")
+perf.counter("db_errors_total", "DB helpers that raised")
+perf.histogram("db_pool_wait_seconds", "Time spent waiting for a pooled connection")
+perf.histogram("discord_http_seconds", "Discord REST request latency (interaction replies are part of command_seconds)")
+perf.counter("discord_http_errors_total", "Discord requests that failed")
+
+class TimedTree(app_commands.CommandTree):
+    # every slash command passes through here, so no per-command decorators are needed
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["t0"] = time.perf_counter()
+        # every economy is per server, so there's nothing to do in DMs
+        if interaction.guild_id is None:
+            await interaction.response.send_message("❌ This bot only works inside a server.", ephemeral=True)
+            return False
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        t0 = interaction.extras.get("t0")
+        name = interaction.command.qualified_name if interaction.command else "unknown"
+        if isinstance(error, RateLimited):
+            # expected traffic, not an error: answer it and move on
+            perf.inc("rate_limited_total", command=name)
+            await interaction.response.send_message(
+                f"⏳ Slow down! You can use /{name} again in {error.retry_after:.1f} seconds.", ephemeral=True
+            )
+            return
+        cause = getattr(error, "original", error)
+        perf.inc("command_errors_total", command=name, error=type(cause).__name__)
+        if t0 is not None:
+            perf.observe("command_seconds", time.perf_counter() - t0, command=name, status="error")
+        await super().on_error(interaction, error)
+
+def instrumented(fn):
+    # DB helper timing, labelled by function name
+    return perf.timed("db_helper_seconds", errors="db_errors_total", helper=fn.__name__)(fn)
+
+def _timed_discord_request(request):
+    async def wrapper(route, *args, **kwargs):
+        t0 = time.perf_counter()
+        label = f"{route.method} {route.path}"
+        try:
+            return await request(route, *args, **kwargs)
+        except discord.HTTPException as e:
+            perf.inc("discord_http_errors_total", route=label, status=e.status)
+            raise
+        finally:
+            perf.observe("discord_http_seconds", time.perf_counter() - t0, route=label)
+    return wrapper
+
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+# privileged; lets /syncroles load the member list in one go instead of fetching members one by one
+intents.members = os.getenv("MEMBERS_INTENT", "0") == "1"
+# several processes can share the shards: each runs with the same SHARD_COUNT and its own SHARD_IDS
+# (e.g. "0,1" and "2,3"); unset, one process runs Discord's recommended number of shards
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+if SHARD_IDS and not SHARD_COUNT:
+    raise RuntimeError("SHARD_IDS needs SHARD_COUNT")
+# sent with IDENTIFY, so the status survives reconnects without a change_presence call
+bot = EconomyBot(
+    command_prefix="!", intents=intents, tree_cls=TimedTree, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS,
+    status=discord.Status.online, activity=discord.CustomActivity(name=f"Getting a J*B at {BOT_VERSION}"),
+)
+# REST calls made through this bot's own client; interaction replies go through discord.py's
+# shared webhook adapter, which we leave alone, so they're timed as part of command_seconds
+bot.http.request = _timed_discord_request(bot.http.request)
 pool = None  # global connection pool for Postgres
+account_cache = None  # optional write-behind cache, see ACCOUNT_CACHE below
+guild_configs = GuildConfigCache(lambda: pool)  # per-guild channels/roles/odds, loaded at startup
+cluster = Cluster(lambda: pool)  # advisory locks + LISTEN/NOTIFY shared with the other bot processes
+# every active buff, indexed in memory so "no buff" costs no query (see buffs.py)
+buff_engine = BuffEngine(lambda: pool, [BuffKind("alcohol", "buffs", "uses")])
+# per-user command limits in memory, plus long cooldowns mirrored from their tables (see ratelimit.py)
+limiter = RateLimiter(lambda: pool, [Cooldown("alcohol", "buffs", "cooldown_until")])
 
 
 # --------------------------------
-# Channel IDs (replace with yours)
+# Original server
 # --------------------------------
+# Before economies were per guild, every row belonged to one server. LEGACY_GUILD_ID names it:
+# schema v5 files existing rows under it and seeds its guild_config from the IDs below.
+# Other servers set their channels and roles with /config.
+LEGACY_GUILD_ID = int(os.getenv("LEGACY_GUILD_ID", "0"))
 ANNOUNCE_CHANNEL_ID = 1417338592359092235
 WORK_CHANNEL_ID = 1417332114453430282
 ROULETTE_CHANNEL_ID = 1417369961172697090
@@ -34,72 +152,509 @@ PATCH_NOTES_CHANNEL_ID = 1417353769037070366  # unused here but kept for parity
 # Database (Postgres via asyncpg)
 # --------------------------------
 DATABASE_URL = os.getenv("DATABASE_URL")
+# LISTEN and session advisory locks need a real session; behind PgBouncer (transaction mode) point this at Postgres
+DIRECT_DATABASE_URL = os.getenv("DIRECT_DATABASE_URL") or DATABASE_URL
+
+# write-behind account cache: ACCOUNT_CACHE=1 to serve hot users from memory
+ACCOUNT_CACHE_ENABLED = os.getenv("ACCOUNT_CACHE", "0") == "1"
+ACCOUNT_CACHE_MAX_MB = float(os.getenv("ACCOUNT_CACHE_MAX_MB", "64"))
+ACCOUNT_CACHE_FLUSH_SECONDS = float(os.getenv("ACCOUNT_CACHE_FLUSH_SECONDS", "5"))
+
+# Prometheus text endpoint at http://METRICS_HOST:METRICS_PORT/metrics (off unless a port is set)
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# per-user command rate limits: BURST uses, refilled evenly over SECONDS (see ratelimit.py)
+WORK_RATE_BURST = int(os.getenv("WORK_RATE_BURST", "3"))
+WORK_RATE_SECONDS = float(os.getenv("WORK_RATE_SECONDS", "10"))
+COINFLIP_RATE_BURST = int(os.getenv("COINFLIP_RATE_BURST", "1"))
+COINFLIP_RATE_SECONDS = float(os.getenv("COINFLIP_RATE_SECONDS", "15"))
+
+# announcements are coalesced per channel over this window before sending
+ANNOUNCE_WINDOW_SECONDS = float(os.getenv("ANNOUNCE_WINDOW_SECONDS", "1.5"))
+announcer = Announcer(bot, window=ANNOUNCE_WINDOW_SECONDS)  # every channel post that isn't an interaction reply
+
+# where /exportstate writes its snapshots (kept on disk even when uploaded)
+EXPORT_DIR = os.getenv("EXPORT_DIR", "exports")
+
+JOB_COUNT_COLUMNS = ("common", "uncommon", "rare", "epic", "legendary", "secret", "special")
+_JOB_TOTAL_SQL = "+".join(f"COALESCE({c},0)" for c in JOB_COUNT_COLUMNS)
+
+# ---------- Schema ----------
+# Every schema change is a new numbered step at the end of MIGRATIONS; never edit one that
+# has shipped. Steps 1-3 use IF NOT EXISTS so databases created before versioning adopt them.
+async def _schema_v1(conn):
+    # balances
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS balances (
+            user_id BIGINT PRIMARY KEY,
+            balance DOUBLE PRECISION DEFAULT 0
+        )
+    """)
+    # job counts
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS job_counts (
+            user_id BIGINT PRIMARY KEY,
+            common INT DEFAULT 0,
+            uncommon INT DEFAULT 0,
+            rare INT DEFAULT 0,
+            epic INT DEFAULT 0,
+            legendary INT DEFAULT 0,
+            secret INT DEFAULT 0,
+            special INT DEFAULT 0
+        )
+    """)
+    # highest jobs
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS highest_jobs (
+            user_id BIGINT PRIMARY KEY,
+            job TEXT,
+            rarity TEXT,
+            amount DOUBLE PRECISION DEFAULT 0
+        )
+    """)
+    # buffs
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS buffs (
+            user_id BIGINT PRIMARY KEY,
+            uses INT DEFAULT 0,
+            cooldown_until BIGINT DEFAULT 0
+        )
+    """)
+    # leaderboard indexes: stored job total + balance ordering
+    await conn.execute(f"""
+        ALTER TABLE job_counts
+        ADD COLUMN IF NOT EXISTS total INT GENERATED ALWAYS AS ({_JOB_TOTAL_SQL}) STORED
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS job_counts_total_idx ON job_counts (total DESC)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS balances_balance_idx ON balances (balance DESC)")
+
+async def _schema_v2(conn):
+    # /syncroles checkpoints, one row per guild
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS career_role_sync (
+            guild_id BIGINT PRIMARY KEY,
+            status TEXT NOT NULL,
+            phase TEXT NOT NULL,
+            last_user_id BIGINT DEFAULT 0,
+            checked INT DEFAULT 0,
+            changed INT DEFAULT 0,
+            missing INT DEFAULT 0,
+            failed INT DEFAULT 0,
+            channel_id BIGINT,
+            message_id BIGINT,
+            started_at BIGINT,
+            updated_at BIGINT
+        )
+    """)
+
+async def _schema_v3(conn):
+    # money ledger, partitioned by month (new months are added by the ledger writer)
+    await conn.execute(ledger.CREATE_LEDGER_SQL)
+    await ledger.ensure_partitions(conn)
+    await conn.execute(ledger.CREATE_LEDGER_INDEX_SQL)
+
+async def _schema_v4(conn):
+    # small key/value facts about this deployment (e.g. the last synced command tree)
+    await conn.execute("""
+        CREATE TABLE bot_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
 
-async def init_db():
-    async with pool.acquire() as conn:
-        # balances
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS balances (
-                user_id BIGINT PRIMARY KEY,
-                balance DOUBLE PRECISION DEFAULT 0
-            )
-        """)
-        # job counts
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS job_counts (
-                user_id BIGINT PRIMARY KEY,
-                common INT DEFAULT 0,
-                uncommon INT DEFAULT 0,
-                rare INT DEFAULT 0,
-                epic INT DEFAULT 0,
-                legendary INT DEFAULT 0,
-                secret INT DEFAULT 0,
-                special INT DEFAULT 0
-            )
-        """)
-        # highest jobs
-        await conn.execute("""
-            CREATE TABLE IF NOT EXISTS highest_jobs (
-                user_id BIGINT PRIMARY KEY,
-                job TEXT,
-                rarity TEXT,
-                amount DOUBLE PRECISION DEFAULT 0
-            )
-        """)
-        # buffs
+ECONOMY_TABLES = ("balances", "job_counts", "highest_jobs", "buffs")
+
+async def _schema_v5(conn):
+    # per-guild economies: every table keyed (guild_id, user_id), rows so far belong to LEGACY_GUILD_ID
+    in_use = await conn.fetchval(
+        "SELECT " + " OR ".join(f"EXISTS (SELECT 1 FROM {t})" for t in (*ECONOMY_TABLES, "ledger"))
+    )
+    if in_use and not LEGACY_GUILD_ID:
+        raise RuntimeError("set LEGACY_GUILD_ID to the server the existing economy belongs to, then restart")
+    for table in (*ECONOMY_TABLES, "ledger"):
+        await conn.execute(f"ALTER TABLE {table} ADD COLUMN guild_id BIGINT NOT NULL DEFAULT {LEGACY_GUILD_ID}")
+        await conn.execute(f"ALTER TABLE {table} ALTER COLUMN guild_id DROP DEFAULT")
+    for table in ECONOMY_TABLES:
+        await conn.execute(f"ALTER TABLE {table} DROP CONSTRAINT {table}_pkey, ADD PRIMARY KEY (guild_id, user_id)")
+    await conn.execute("DROP INDEX job_counts_total_idx, balances_balance_idx, ledger_user_idx")
+    await conn.execute("CREATE INDEX job_counts_total_idx ON job_counts (guild_id, total DESC)")
+    await conn.execute("CREATE INDEX balances_balance_idx ON balances (guild_id, balance DESC)")
+    await conn.execute(ledger.CREATE_LEDGER_GUILD_INDEX_SQL)
+    # channels, career roles (one per CAREER_PATH tier, 0 = none) and odds overrides per guild
+    await conn.execute("""
+        CREATE TABLE guild_config (
+            guild_id BIGINT PRIMARY KEY,
+            announce_channel_id BIGINT,
+            work_channel_id BIGINT,
+            roulette_channel_ids BIGINT[] NOT NULL DEFAULT '{}',
+            career_role_ids BIGINT[] NOT NULL DEFAULT '{}',
+            odds JSONB NOT NULL DEFAULT '{}',
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+    if LEGACY_GUILD_ID:
         await conn.execute("""
-            CREATE TABLE IF NOT EXISTS buffs (
-                user_id BIGINT PRIMARY KEY,
-                uses INT DEFAULT 0,
-                cooldown_until BIGINT DEFAULT 0
-            )
-        """)
+            INSERT INTO guild_config (guild_id, announce_channel_id, work_channel_id, roulette_channel_ids, career_role_ids)
+            VALUES ($1, $2, $3, $4, $5)
+        """, LEGACY_GUILD_ID, ANNOUNCE_CHANNEL_ID, WORK_CHANNEL_ID, [ROULETTE_CHANNEL_ID],
+            [tier["role_id"] for tier in CAREER_PATH])
+
+async def _schema_v6(conn):
+    # roulette rounds and bets, so a restart mid-round can settle or refund them
+    await conn.execute(roulette_journal.CREATE_ROUNDS_SQL)
+    await conn.execute(roulette_journal.CREATE_BETS_SQL)
+    await conn.execute(roulette_journal.CREATE_UNSETTLED_INDEX_SQL)
+
+MIGRATIONS = [
+    (1, "balances, job_counts, highest_jobs, buffs", _schema_v1),
+    (2, "career_role_sync checkpoints", _schema_v2),
+    (3, "partitioned money ledger", _schema_v3),
+    (4, "bot_meta", _schema_v4),
+    (5, "per-guild economies and guild_config", _schema_v5),
+    (6, "roulette round journal", _schema_v6),
+]
+
+@instrumented
+async def init_db() -> list[int]:
+    # a no-op (one query) when the schema is current; returns the versions it applied
+    return await migrations.migrate(pool, MIGRATIONS)
+
+# ---------- Unit of work ----------
+# A command wraps its DB calls in `async with unit_of_work():` and every helper inside shares
+# one pooled connection instead of checking one out per call. The connection is taken on first
+# use and returned when the block ends, so wrap only the DB part, not the Discord replies.
+# Only the task that opened the unit uses it; tasks spawned inside inherit the contextvar
+# but borrow their own connection, since one asyncpg connection can't run two queries at once.
+# With the account cache on, a transactional unit also writes the cached balances it changed
+# in its transaction (they'd otherwise only reach Postgres with the next flush) and undoes
+# them in memory if it rolls back, so money moves commit together with everything else.
+class UnitOfWork:
+    __slots__ = ("owner", "transaction", "conn", "after_commit", "cached", "_acquire", "_tr")
+
+    def __init__(self, transaction: bool):
+        self.owner = asyncio.current_task()
+        self.transaction = transaction
+        self.conn = None
+        self.after_commit = []  # callbacks held back until the transaction commits
+        self.cached = {} if transaction and account_cache is not None else None  # (gid, uid) -> balance delta
+        self._acquire = None
+        self._tr = None
+
+    async def connection(self):
+        if self.conn is None:
+            self._acquire = pool.acquire()
+            self.conn = await self._acquire.__aenter__()
+            if self.transaction:
+                self._tr = self.conn.transaction()
+                await self._tr.start()
+        return self.conn
+
+    async def close(self, failed: bool):
+        error = None
+        if self.cached and not failed:
+            try:
+                await account_cache.write_balances(await self.connection(), self.cached)
+            except BaseException as e:
+                failed, error = True, e
+        try:
+            if self.conn is not None:
+                try:
+                    if self._tr is not None:
+                        await (self._tr.rollback() if failed else self._tr.commit())
+                finally:
+                    await self._acquire.__aexit__(None, None, None)
+                    self.conn = None
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            if self.cached:
+                account_cache.unpin(self.cached, undo=failed)
+        if error is not None:
+            raise error
+        if not failed:
+            for fn in self.after_commit:
+                fn()
+
+_current_uow: ContextVar = ContextVar("unit_of_work", default=None)
+
+def _active_uow() -> UnitOfWork | None:
+    uow = _current_uow.get()
+    return uow if uow is not None and uow.owner is asyncio.current_task() else None
+
+@asynccontextmanager
+async def unit_of_work(transaction: bool = False):
+    # transaction=True also makes everything inside commit or roll back together
+    if _active_uow() is not None:
+        yield _active_uow()  # nested: join the outer unit
+        return
+    uow = UnitOfWork(transaction)
+    token = _current_uow.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        await uow.close(failed=True)
+        raise
+    else:
+        await uow.close(failed=False)
+    finally:
+        _current_uow.reset(token)
+
+def after_commit(fn):
+    # in-memory copies of what was written: inside a transactional unit of work `fn` waits for
+    # the commit (and is dropped on a rollback), otherwise the write is already final and it runs now
+    uow = _active_uow()
+    if uow is not None and uow.transaction:
+        uow.after_commit.append(fn)
+    else:
+        fn()
+
+@asynccontextmanager
+async def db_conn():
+    # what every helper uses: the open unit of work's connection, or a pooled one just for this call
+    uow = _active_uow()
+    if uow is not None:
+        yield await uow.connection()
+    else:
+        async with pool.acquire() as conn:
+            yield conn
 
 # ---------- DB helpers ----------
-async def get_balance(uid: int) -> float:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT balance FROM balances WHERE user_id=$1", uid)
-        return float(row["balance"]) if row else 0.0
+# Every helper takes the guild first: each server has its own economy, keyed (guild_id, user_id).
+
+# in-memory leaderboards per guild, kept current by every helper below that changes a balance or job count
+class GuildBoards:
+    __slots__ = ("money", "jobs")
+
+    def __init__(self):
+        self.money = Ranking()
+        self.jobs = Ranking()
+
+_boards: dict[int, GuildBoards] = {}
+
+def boards_for(gid: int) -> GuildBoards:
+    boards = _boards.get(gid)
+    if boards is None:
+        boards = _boards[gid] = GuildBoards()
+    return boards
+
+@instrumented
+async def load_leaderboards(gid: int | None = None):
+    # one streaming pass over both tables; rebuilds the in-memory boards (of one guild, or all)
+    balances, totals = {}, {}
+    where = "" if gid is None else "WHERE COALESCE(b.guild_id, j.guild_id) = $1"
+    async with db_conn() as conn:
+        async with conn.transaction():
+            async for r in conn.cursor(f"""
+                SELECT COALESCE(b.guild_id, j.guild_id) AS guild_id, COALESCE(b.user_id, j.user_id) AS user_id,
+                       b.balance, j.total
+                FROM balances b FULL OUTER JOIN job_counts j ON j.guild_id=b.guild_id AND j.user_id=b.user_id
+                {where}
+            """, *(() if gid is None else (gid,)), prefetch=5000):
+                g = int(r["guild_id"])
+                if r["balance"] is not None:
+                    balances.setdefault(g, []).append((int(r["user_id"]), float(r["balance"])))
+                if r["total"] is not None:
+                    totals.setdefault(g, []).append((int(r["user_id"]), int(r["total"])))
+    for g in (set(_boards) | set(balances) | set(totals)) if gid is None else (gid,):
+        boards = boards_for(g)
+        boards.money.replace(balances.get(g, ()))
+        boards.jobs.replace(totals.get(g, ()))
+
+def _cached_delta(gid: int, uid: int, delta: float):
+    # a cached balance just changed; inside a transactional unit it's written (or undone) with it
+    uow = _active_uow()
+    if uow is not None and uow.cached is not None:
+        key = (gid, uid)
+        if key not in uow.cached:
+            account_cache.pin(key)
+        uow.cached[key] = uow.cached.get(key, 0.0) + float(delta)
+
+def _ranked(gid: int, uid: int, new_bal):
+    if new_bal is not None:
+        after_commit(lambda: boards_for(gid).money.update(uid, new_bal))
+    return new_bal
 
-async def set_balance(uid: int, amount: float):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO balances (user_id, balance)
-            VALUES ($1, $2)
-            ON CONFLICT (user_id) DO UPDATE SET balance=EXCLUDED.balance
-        """, uid, amount)
-
-async def add_balance(uid: int, delta: float) -> float:
-    new_bal = await get_balance(uid) + float(delta)
-    await set_balance(uid, new_bal)
+# every balance change goes to the ledger with a reason (one of ledger.REASONS)
+ledger_writer = ledger.LedgerWriter(lambda: pool)
+
+def _logged(gid: int, uid: int, delta: float, new_bal, reason: str, detail=None):
+    after_commit(lambda: ledger_writer.record(gid, uid, delta, new_bal, reason, detail))
     return new_bal
 
-async def get_job_counts(uid: int) -> dict:
-    async with pool.acquire() as conn:
+@asynccontextmanager
+async def bulk_write(gid: int):
+    # wrap SQL that touches many of a guild's users at once so the cache doesn't keep serving
+    # stale rows and that guild's leaderboards get rebuilt afterwards (here and in the other processes)
+    if account_cache is None:
+        yield
+    else:
+        async with account_cache.paused():
+            yield
+    await load_leaderboards(gid)
+    await reload_buffs(gid)
+    cluster.publish_soon("guild_data", guild_id=gid)
+
+@instrumented
+async def get_balance(gid: int, uid: int) -> float:
+    if account_cache is not None:
+        return (await account_cache.get(gid, uid)).balance
+    async with db_conn() as conn:
+        row = await conn.fetchrow("SELECT balance FROM balances WHERE guild_id=$1 AND user_id=$2", gid, uid)
+        return float(row["balance"]) if row else 0.0
+
+@instrumented
+async def set_balance(gid: int, uid: int, amount: float, *, reason: str, detail=None):
+    if account_cache is not None:
+        old = (await account_cache.get(gid, uid)).balance
+        await account_cache.set_balance(gid, uid, amount)
+        _cached_delta(gid, uid, float(amount) - old)
+    else:
+        async with db_conn() as conn:
+            old = await conn.fetchval("""
+                WITH old AS (SELECT balance FROM balances WHERE guild_id=$1 AND user_id=$2 FOR UPDATE)
+                INSERT INTO balances (guild_id, user_id, balance)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=EXCLUDED.balance
+                RETURNING (SELECT balance FROM old)
+            """, gid, uid, float(amount))
+    _logged(gid, uid, float(amount) - float(old or 0.0), float(amount), reason, detail)
+    _ranked(gid, uid, float(amount))
+
+@instrumented
+async def add_balance(gid: int, uid: int, delta: float, *, reason: str, detail=None) -> float:
+    # single upsert, the increment happens inside Postgres so concurrent calls can't lose updates
+    if account_cache is not None:
+        new_bal = await account_cache.add_balance(gid, uid, delta)
+        _cached_delta(gid, uid, delta)
+    else:
+        async with db_conn() as conn:
+            new_bal = float(await conn.fetchval("""
+                INSERT INTO balances (guild_id, user_id, balance)
+                VALUES ($1, $2, $3)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=balances.balance + EXCLUDED.balance
+                RETURNING balance
+            """, gid, uid, float(delta)))
+    return _ranked(gid, uid, _logged(gid, uid, delta, new_bal, reason, detail))
+
+@instrumented
+async def try_debit(gid: int, uid: int, amount: float, delta: float | None = None, *,
+                    reason: str, detail=None) -> float | None:
+    # apply `delta` (default: -amount) only if the wallet holds at least `amount`.
+    # returns the new balance, or None when the user can't cover it
+    if delta is None:
+        delta = -amount
+    if account_cache is not None:
+        new_bal = await account_cache.try_debit(gid, uid, amount, delta)
+        if new_bal is not None:
+            _cached_delta(gid, uid, delta)
+    else:
+        async with db_conn() as conn:
+            new_bal = await conn.fetchval("""
+                UPDATE balances SET balance=balance + $4
+                WHERE guild_id=$1 AND user_id=$2 AND balance >= $3
+                RETURNING balance
+            """, gid, uid, float(amount), float(delta))
+    if new_bal is None:
+        return None
+    return _ranked(gid, uid, _logged(gid, uid, delta, float(new_bal), reason, detail))
+
+@instrumented
+async def debit_fraction(gid: int, uid: int, fraction: float, *, reason: str, detail=None):
+    # take a cut of a positive wallet, returns (amount_taken, new_balance) or None
+    if account_cache is not None:
+        taken = await account_cache.debit_fraction(gid, uid, fraction)
+        if taken:
+            _cached_delta(gid, uid, -taken[0])
+            _ranked(gid, uid, _logged(gid, uid, -taken[0], taken[1], reason, detail))
+        return taken
+    async with db_conn() as conn:
+        row = await conn.fetchrow("""
+            WITH cur AS (
+                SELECT guild_id, user_id, balance FROM balances
+                WHERE guild_id=$1 AND user_id=$2 AND balance > 0
+                FOR UPDATE
+            )
+            UPDATE balances b
+            SET balance=b.balance - ROUND((cur.balance * $3)::numeric, 2)::float8
+            FROM cur WHERE b.guild_id=cur.guild_id AND b.user_id=cur.user_id
+            RETURNING cur.balance - b.balance AS taken, b.balance
+        """, gid, uid, float(fraction))
+    if not row:
+        return None
+    taken = float(row["taken"])
+    return taken, _ranked(gid, uid, _logged(gid, uid, -taken, float(row["balance"]), reason, detail))
+
+@instrumented
+async def transfer_balance(gid: int, from_uid: int, to_uid: int, amount: float, *, reason: str = "pay"):
+    # debit + credit in one statement; returns (payer_balance, receiver_balance) or None if they're short
+    if account_cache is not None:
+        result = await account_cache.transfer_balance(gid, from_uid, to_uid, amount)
+        if result:
+            _cached_delta(gid, from_uid, -amount)
+            _cached_delta(gid, to_uid, amount)
+    else:
+        async with db_conn() as conn:
+            row = await conn.fetchrow("""
+                WITH debit AS (
+                    UPDATE balances SET balance=balance - $4
+                    WHERE guild_id=$1 AND user_id=$2 AND balance >= $4
+                    RETURNING balance
+                ), credit AS (
+                    INSERT INTO balances (guild_id, user_id, balance)
+                    SELECT $1, $3, $4 FROM debit
+                    ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=balances.balance + EXCLUDED.balance
+                    RETURNING balance
+                )
+                SELECT debit.balance AS payer, credit.balance AS receiver FROM debit, credit
+            """, gid, from_uid, to_uid, float(amount))
+        result = (float(row["payer"]), float(row["receiver"])) if row else None
+    if result:
+        # each side's entry names the other party
+        _ranked(gid, from_uid, _logged(gid, from_uid, -amount, result[0], reason, to_uid))
+        _ranked(gid, to_uid, _logged(gid, to_uid, amount, result[1], reason, from_uid))
+    return result
+
+@instrumented
+async def credit_many(gid: int, credits: dict, *, reason: str, detail=None) -> dict:
+    # {uid: amount} -> {uid: new_balance}, every wallet credited by one statement
+    if not credits:
+        return {}
+    if account_cache is not None:
+        new_bals = {}
+        for uid, amt in credits.items():
+            new_bals[uid] = await account_cache.add_balance(gid, uid, amt)
+            _cached_delta(gid, uid, amt)
+    else:
+        async with db_conn() as conn:
+            rows = await conn.fetch("""
+                INSERT INTO balances (guild_id, user_id, balance)
+                SELECT $1, * FROM unnest($2::bigint[], $3::float8[])
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=balances.balance + EXCLUDED.balance
+                RETURNING user_id, balance
+            """, gid, list(credits.keys()), [float(v) for v in credits.values()])
+        new_bals = {int(r["user_id"]): float(r["balance"]) for r in rows}
+    for uid, bal in new_bals.items():
+        _logged(gid, uid, credits[uid], bal, reason, detail)
+
+    def rank():
+        money = boards_for(gid).money
+        for uid, bal in new_bals.items():
+            money.update(uid, bal)
+    after_commit(rank)
+    return new_bals
+
+@instrumented
+async def get_job_counts(gid: int, uid: int) -> dict:
+    if account_cache is not None:
+        return dict((await account_cache.get(gid, uid)).counts)
+    async with db_conn() as conn:
         row = await conn.fetchrow("""
             SELECT common,uncommon,rare,epic,legendary,secret,special
-            FROM job_counts WHERE user_id=$1
-        """, uid)
+            FROM job_counts WHERE guild_id=$1 AND user_id=$2
+        """, gid, uid)
     if not row:
         return {"common":0,"uncommon":0,"rare":0,"epic":0,"legendary":0,"secret":0,"special":0}
     return {
@@ -108,78 +663,175 @@ async def get_job_counts(uid: int) -> dict:
         "special": row["special"]
     }
 
-async def set_job_counts(uid: int, counts: dict):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO job_counts (user_id, common, uncommon, rare, epic, legendary, secret, special)
-            VALUES ($1,$2,$3,$4,$5,$6,$7,$8)
-            ON CONFLICT (user_id) DO UPDATE SET
-              common=EXCLUDED.common, uncommon=EXCLUDED.uncommon, rare=EXCLUDED.rare,
-              epic=EXCLUDED.epic, legendary=EXCLUDED.legendary, secret=EXCLUDED.secret, special=EXCLUDED.special
-        """, uid, counts["common"], counts["uncommon"], counts["rare"],
-             counts["epic"], counts["legendary"], counts["secret"], counts["special"])
-
-async def increment_job(uid: int, rarity: str):
+@instrumented
+async def set_job_counts(gid: int, uid: int, counts: dict):
+    if account_cache is not None:
+        await account_cache.set_job_counts(gid, uid, counts)
+    else:
+        async with db_conn() as conn:
+            await conn.execute("""
+                INSERT INTO job_counts (guild_id, user_id, common, uncommon, rare, epic, legendary, secret, special)
+                VALUES ($1,$2,$3,$4,$5,$6,$7,$8,$9)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                  common=EXCLUDED.common, uncommon=EXCLUDED.uncommon, rare=EXCLUDED.rare,
+                  epic=EXCLUDED.epic, legendary=EXCLUDED.legendary, secret=EXCLUDED.secret, special=EXCLUDED.special
+            """, gid, uid, counts["common"], counts["uncommon"], counts["rare"],
+                 counts["epic"], counts["legendary"], counts["secret"], counts["special"])
+    total = int(sum(counts.get(c, 0) for c in JOB_COUNT_COLUMNS))
+    after_commit(lambda: boards_for(gid).jobs.update(uid, total))
+
+@instrumented
+async def increment_job(gid: int, uid: int, rarity: str):
     # fetch & bump atomic enough for our use (single instance)
-    counts = await get_job_counts(uid)
-    counts[rarity] = counts.get(rarity, 0) + 1
-    await set_job_counts(uid, counts)
-
-async def get_total_jobs(uid: int) -> int:
-    c = await get_job_counts(uid)
-    return int(sum(c.values()))
-
-async def get_highest_job(uid: int):
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT job, rarity, amount FROM highest_jobs WHERE user_id=$1", uid)
+    async with unit_of_work():
+        counts = await get_job_counts(gid, uid)
+        counts[rarity] = counts.get(rarity, 0) + 1
+        await set_job_counts(gid, uid, counts)
+
+@instrumented
+async def get_total_jobs(gid: int, uid: int) -> int:
+    if account_cache is not None:
+        return (await account_cache.get(gid, uid)).total
+    async with db_conn() as conn:
+        total = await conn.fetchval("SELECT total FROM job_counts WHERE guild_id=$1 AND user_id=$2", gid, uid)
+    return int(total or 0)
+
+@instrumented
+async def get_highest_job(gid: int, uid: int):
+    if account_cache is not None:
+        highest = (await account_cache.get(gid, uid)).highest
+        return dict(highest) if highest else None
+    async with db_conn() as conn:
+        row = await conn.fetchrow(
+            "SELECT job, rarity, amount FROM highest_jobs WHERE guild_id=$1 AND user_id=$2", gid, uid
+        )
     return {"job": row["job"], "rarity": row["rarity"], "amount": float(row["amount"])} if row else None
 
-async def update_highest_job(uid: int, job: str, rarity: str, amount: float):
-    current = await get_highest_job(uid)
+@instrumented
+async def update_highest_job(gid: int, uid: int, job: str, rarity: str, amount: float):
+    if account_cache is not None:
+        await account_cache.update_highest_job(gid, uid, job, rarity, amount)
+        return
+    current = await get_highest_job(gid, uid)
     if (not current) or amount > current["amount"]:
-        async with pool.acquire() as conn:
+        async with db_conn() as conn:
             await conn.execute("""
-                INSERT INTO highest_jobs (user_id, job, rarity, amount)
-                VALUES ($1,$2,$3,$4)
-                ON CONFLICT (user_id) DO UPDATE SET
+                INSERT INTO highest_jobs (guild_id, user_id, job, rarity, amount)
+                VALUES ($1,$2,$3,$4,$5)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
                   job=EXCLUDED.job, rarity=EXCLUDED.rarity, amount=EXCLUDED.amount
-            """, uid, job, rarity, amount)
-
-async def reset_all_balances():
-    async with pool.acquire() as conn:
-        await conn.execute("UPDATE balances SET balance=0")
-
-async def reset_user_balance(uid: int):
-    await set_balance(uid, 0.0)
-
-async def reset_all_jobs():
-    async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM job_counts")
-        await conn.execute("DELETE FROM highest_jobs")
-
-async def reset_user_jobs(uid: int):
-    async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM job_counts WHERE user_id=$1", uid)
-        await conn.execute("DELETE FROM highest_jobs WHERE user_id=$1", uid)
-
-async def export_state_to_file(path: str):
-    dump = {"balances": {}, "job_counts": {}, "highest_jobs": {}, "buffs": {}}
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id, balance FROM balances")
-        dump["balances"] = {str(r["user_id"]): float(r["balance"]) for r in rows}
-        rows = await conn.fetch("SELECT * FROM job_counts")
-        for r in rows:
-            dump["job_counts"][str(r["user_id"])] = {
-                "common": r["common"], "uncommon": r["uncommon"], "rare": r["rare"],
-                "epic": r["epic"], "legendary": r["legendary"], "secret": r["secret"], "special": r["special"]
-            }
-        rows = await conn.fetch("SELECT user_id, job, rarity, amount FROM highest_jobs")
-        dump["highest_jobs"] = {str(r["user_id"]): {"job": r["job"], "rarity": r["rarity"], "amount": float(r["amount"])} for r in rows}
-        rows = await conn.fetch("SELECT user_id, uses, cooldown_until FROM buffs")
-        dump["buffs"] = {str(r["user_id"]): {"uses": r["uses"], "cooldown_until": r["cooldown_until"]} for r in rows}
-
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(dump, f, indent=2)
+            """, gid, uid, job, rarity, amount)
+
+# one statement per rarity (column names can't be bound as parameters):
+# credit payout, bump the counter, keep the best-paying job
+_RECORD_WORK_SQL = {
+    rarity: f"""
+        WITH bal AS (
+            INSERT INTO balances (guild_id, user_id, balance)
+            VALUES ($1, $2, $4)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET balance=balances.balance + EXCLUDED.balance
+            RETURNING balance
+        ), jc AS (
+            INSERT INTO job_counts (guild_id, user_id, {rarity})
+            VALUES ($1, $2, 1)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET {rarity}=COALESCE(job_counts.{rarity},0) + 1
+            RETURNING total
+        ), hj AS (
+            INSERT INTO highest_jobs (guild_id, user_id, job, rarity, amount)
+            VALUES ($1, $2, $3, $5, $4)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET
+              job=EXCLUDED.job, rarity=EXCLUDED.rarity, amount=EXCLUDED.amount
+            WHERE COALESCE(highest_jobs.amount,0) < EXCLUDED.amount
+            RETURNING 1
+        )
+        SELECT bal.balance, jc.total, EXISTS (SELECT 1 FROM hj) AS new_high FROM bal, jc
+    """
+    for rarity in JOB_COUNT_COLUMNS
+}
+
+def _log_work(gid: int, uid: int, result: dict):
+    # the base pay and the tip on top of it are separate ledger entries
+    amount = float(result["amount"])
+    tip = round(amount - float(result.get("base_payout", amount)), 2)
+    _logged(gid, uid, amount - tip, result["balance"] - tip, "work", result["job"])
+    if tip:
+        _logged(gid, uid, tip, result["balance"], "tip", result["job"])
+
+@instrumented
+async def record_work(gid: int, uid: int, roll) -> dict:
+    # the whole /work write path on one connection, one transaction, two statements.
+    # roll(total_jobs) runs between them and must return a dict with rarity/job/amount;
+    # it comes back with total_before, total, balance and new_high filled in
+    if account_cache is not None:
+        result = await account_cache.record_work(gid, uid, roll)
+    else:
+        async with db_conn() as conn:
+            async with conn.transaction():
+                total_before = await conn.fetchval(
+                    "SELECT total FROM job_counts WHERE guild_id=$1 AND user_id=$2 FOR UPDATE", gid, uid
+                )
+                total_before = int(total_before or 0)
+                result = roll(total_before)
+                row = await conn.fetchrow(
+                    _RECORD_WORK_SQL[result["rarity"]],
+                    gid, uid, result["job"], float(result["amount"]), result["rarity"]
+                )
+        result.update(
+            total_before=total_before, total=int(row["total"]),
+            balance=float(row["balance"]), new_high=bool(row["new_high"])
+        )
+    _log_work(gid, uid, result)
+    balance, total = result["balance"], result["total"]
+
+    def rank():
+        boards = boards_for(gid)
+        boards.money.update(uid, balance)
+        boards.jobs.update(uid, total)
+    after_commit(rank)
+    return result
+
+@instrumented
+async def reset_all_balances(gid: int):
+    async with bulk_write(gid), db_conn() as conn:
+        async with conn.transaction():
+            await conn.execute(ledger.RESET_ALL_SQL, gid)
+            await conn.execute("UPDATE balances SET balance=0 WHERE guild_id=$1", gid)
+
+@instrumented
+async def reset_user_balance(gid: int, uid: int):
+    await set_balance(gid, uid, 0.0, reason="reset")
+
+@instrumented
+async def reset_all_jobs(gid: int):
+    async with bulk_write(gid), db_conn() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM job_counts WHERE guild_id=$1", gid)
+            await conn.execute("DELETE FROM highest_jobs WHERE guild_id=$1", gid)
+
+@instrumented
+async def reset_user_jobs(gid: int, uid: int):
+    async with bulk_write(gid), db_conn() as conn:
+        async with conn.transaction():
+            await conn.execute("DELETE FROM job_counts WHERE guild_id=$1 AND user_id=$2", gid, uid)
+            await conn.execute("DELETE FROM highest_jobs WHERE guild_id=$1 AND user_id=$2", gid, uid)
+
+@instrumented
+async def export_state_to_file(gid: int, path: str) -> dict:
+    # streaming gzip NDJSON snapshot of one guild's rows in all four tables; returns {table: rows}
+    if account_cache is not None:
+        await account_cache.flush()
+    return await state_io.export_state(pool, path, JOB_COUNT_COLUMNS, gid, bot_version=BOT_VERSION)
+
+@instrumented
+async def import_state_from_file(gid: int, path: str, dry_run: bool = False,
+                                 replace: bool = False) -> state_io.ImportReport:
+    # restore an export (streaming or old JSON) into a guild; a real run pauses the cache and rebuilds its boards
+    if dry_run:
+        if account_cache is not None:
+            await account_cache.flush()  # so new/updated counts match what a real run would do
+        return await state_io.import_state(pool, path, JOB_COUNT_COLUMNS, gid, dry_run=True, replace=replace)
+    async with bulk_write(gid):
+        return await state_io.import_state(pool, path, JOB_COUNT_COLUMNS, gid, replace=replace)
 
 # ---------- Alcohol / Buffs ----------
 ALCOHOL_PRICE = 5_000.0
@@ -188,42 +840,116 @@ ALCOHOL_BOOST_USES = 5
 COINFLIP_BOOST_WINPROB = 0.54
 ROULETTE_COLOR_SALVAGE = 0.025
 
-async def get_boost_record(uid: int) -> dict:
-    async with pool.acquire() as conn:
-        row = await conn.fetchrow("SELECT uses, cooldown_until FROM buffs WHERE user_id=$1", uid)
+@instrumented
+async def get_boost_record(gid: int, uid: int) -> dict:
+    if account_cache is not None:
+        return dict((await account_cache.get(gid, uid)).buff)
+    async with db_conn() as conn:
+        row = await conn.fetchrow(
+            "SELECT uses, cooldown_until FROM buffs WHERE guild_id=$1 AND user_id=$2", gid, uid
+        )
     return {"uses": row["uses"], "cooldown_until": row["cooldown_until"]} if row else {"uses": 0, "cooldown_until": 0}
 
-async def set_boost_record(uid: int, uses: int, cooldown_until: int):
-    async with pool.acquire() as conn:
-        await conn.execute("""
-            INSERT INTO buffs (user_id, uses, cooldown_until)
-            VALUES ($1,$2,$3)
-            ON CONFLICT (user_id) DO UPDATE SET
-              uses=EXCLUDED.uses, cooldown_until=EXCLUDED.cooldown_until
-        """, uid, uses, cooldown_until)
-
-async def has_active_alcohol(uid: int) -> bool:
-    return (await get_boost_record(uid)).get("uses", 0) > 0
-
-async def consume_alcohol_use(uid: int) -> int:
-    rec = await get_boost_record(uid)
-    uses = max(0, int(rec.get("uses", 0)) - 1)
-    await set_boost_record(uid, uses, int(rec.get("cooldown_until", 0)))
+@instrumented
+async def set_boost_record(gid: int, uid: int, uses: int, cooldown_until: int):
+    if account_cache is not None:
+        await account_cache.set_boost_record(gid, uid, uses, cooldown_until)
+    else:
+        async with db_conn() as conn:
+            await conn.execute("""
+                INSERT INTO buffs (guild_id, user_id, uses, cooldown_until)
+                VALUES ($1,$2,$3,$4)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                  uses=EXCLUDED.uses, cooldown_until=EXCLUDED.cooldown_until
+            """, gid, uid, uses, cooldown_until)
+    _buff_changed(gid, uid, "alcohol", uses, cooldown_until)
+
+@instrumented
+async def claim_boost(gid: int, uid: int, uses: int, cooldown_until: int) -> dict | None:
+    # start a boost only once the last cooldown has run out, as one conditional write so two
+    # purchases racing each other can't both get it. Returns the record it replaced (to put
+    # back if the purchase falls through), or None while the cooldown is still running
+    now = int(time.time())
+    if account_cache is not None:
+        prev = await account_cache.claim_boost(gid, uid, uses, cooldown_until, now)
+    else:
+        async with db_conn() as conn:
+            row = await conn.fetchrow("""
+                WITH old AS (SELECT uses, cooldown_until FROM buffs WHERE guild_id=$1 AND user_id=$2 FOR UPDATE)
+                INSERT INTO buffs (guild_id, user_id, uses, cooldown_until)
+                VALUES ($1,$2,$3,$4)
+                ON CONFLICT (guild_id, user_id) DO UPDATE SET
+                  uses=EXCLUDED.uses, cooldown_until=EXCLUDED.cooldown_until
+                WHERE COALESCE(buffs.cooldown_until, 0) <= $5
+                RETURNING (SELECT uses FROM old) AS uses, (SELECT cooldown_until FROM old) AS cooldown_until
+            """, gid, uid, uses, cooldown_until, now)
+        prev = None if row is None else {"uses": int(row["uses"] or 0),
+                                         "cooldown_until": int(row["cooldown_until"] or 0)}
+    if prev is not None:
+        _buff_changed(gid, uid, "alcohol", uses, cooldown_until)
+    return prev
+
+def _buff_changed(gid: int, uid: int, kind: str, uses: int, cooldown_until: int | None = None):
+    # the in-memory copies follow the row, so they wait for a transaction to commit
+    def apply():
+        buff_engine.set(gid, uid, kind, uses)
+        if cooldown_until is not None:
+            limiter.set_cooldown(kind, gid, uid, cooldown_until)
+    after_commit(apply)
+
+async def reload_buffs(gid: int | None = None):
+    # the index and cooldowns mirror the table, so cached buff rows are written back before they're rebuilt
+    if account_cache is not None:
+        await account_cache.flush()
+    await buff_engine.load(gid)
+    await limiter.load(gid)
+
+def has_active_alcohol(gid: int, uid: int) -> bool:
+    # answered from the in-memory index, no query
+    return buff_engine.uses(gid, uid, "alcohol") > 0
+
+@instrumented
+async def consume_alcohol_use(gid: int, uid: int) -> int:
+    if not has_active_alcohol(gid, uid):
+        return 0
+    if account_cache is not None:
+        # the row lives in the cache; it's decremented there and written back with the account
+        async with unit_of_work():
+            rec = await get_boost_record(gid, uid)
+            uses = max(0, int(rec.get("uses", 0)) - 1)
+            await set_boost_record(gid, uid, uses, int(rec.get("cooldown_until", 0)))
+        return uses
+    async with db_conn() as conn:
+        uses = await buff_engine.consume(conn, gid, uid, "alcohol") or 0
+    _buff_changed(gid, uid, "alcohol", uses)
     return uses
 
+@instrumented
+async def restore_alcohol_use(gid: int, uid: int) -> int:
+    # give back a use spent on a bet that was refunded instead of played
+    if account_cache is not None:
+        async with unit_of_work():
+            rec = await get_boost_record(gid, uid)
+            uses = int(rec.get("uses", 0)) + 1
+            await set_boost_record(gid, uid, uses, int(rec.get("cooldown_until", 0)))
+        return uses
+    async with db_conn() as conn:
+        uses = await conn.fetchval(
+            "UPDATE buffs SET uses=uses + 1 WHERE guild_id=$1 AND user_id=$2 RETURNING uses", gid, uid
+        )
+    _buff_changed(gid, uid, "alcohol", int(uses or 0))
+    return int(uses or 0)
+
 def alcohol_cooldown_left_sync(rec: dict) -> int:
     return max(0, int(rec.get("cooldown_until", 0)) - int(time.time()))
 
-# ---------- Test / Debug globals ----------
-test_mode = False
-BYPASS_CAREER = False
-
-# default odds
+# ---------- Odds ----------
+# default odds (a guild's guild_config.odds can override any of them, see Odds / odds_for)
 SPECIAL_CHANCE = 0.02
 TIP_BASE_CHANCE = 0.25
 DEV_CHANCE_DENOM = 7777
 
-# test-mode overrides
+# test-mode overrides (what /testmode on stores for a guild)
 _TEST_SPECIAL_CHANCE = 0.5
 _TEST_TIP_BASE_CHANCE = 1.0
 _TEST_DEV_CHANCE_DENOM = 5
@@ -252,15 +978,28 @@ CAREER_PATH = [
 ]
 
 
-async def get_career_tier(user_id: int) -> dict:
-    total_jobs = await get_total_jobs(user_id)
-    current = CAREER_PATH[0]
-    for tier in CAREER_PATH:
-        if total_jobs >= tier["required"]:
-            current = tier
-        else:
-            break
-    return current
+# precomputed once: tier lookups are a bisect
+# (role_id above is the original server's role; each guild's roles live in its guild_config)
+CAREER_THRESHOLDS = [tier["required"] for tier in CAREER_PATH]
+
+def career_tier_index(total_jobs: int) -> int:
+    return max(0, bisect_right(CAREER_THRESHOLDS, total_jobs) - 1)
+
+def career_role_for(gid: int, total_jobs: int) -> int | None:
+    # the one career role someone with this many jobs should hold in this guild (none before their first job)
+    return guild_configs.get(gid).career_role(career_tier_index(total_jobs)) if total_jobs > 0 else None
+
+def promotion_for(total_before: int, total_after: int) -> dict | None:
+    # the tier a user just stepped into, or None; a first-ever job counts as joining tier 0
+    old = career_tier_index(total_before) if total_before > 0 else -1
+    new = career_tier_index(total_after)
+    return CAREER_PATH[new] if new > old else None
+
+def career_tier_for(total_jobs: int) -> dict:
+    return CAREER_PATH[career_tier_index(total_jobs)]
+
+async def get_career_tier(gid: int, uid: int) -> dict:
+    return career_tier_for(await get_total_jobs(gid, uid))
 
 # ---------- Flair / Colors / Emojis ----------
 flavor_texts = {
@@ -310,20 +1049,27 @@ special_jobs = [
     {"name": "artifact",    "desc": "🗿 You found a priceless artifact.",                              "color": discord.Color.blue(),       "payout": (200_000, 400_000)}
 ]
 
-def _special_job_gate(name: str) -> bool:
+def _special_job_gate_chance(name: str, dev_chance_denom: int | None = None) -> float:
     if name == "dev":
-        return random.randint(1, DEV_CHANCE_DENOM) == 777
+        # same odds as randint(1, denom) == 777, which can't hit below 777
+        denom = DEV_CHANCE_DENOM if dev_chance_denom is None else dev_chance_denom
+        return 1 / denom if denom >= 777 else 0.0
     if name == "glitch":
-        return random.random() <= 0.30
-    return True  # others pass once special triggers
+        return 0.30
+    return 1.0  # others pass once special triggers
+
+_SPECIAL_PAYOUTS = {job["name"]: UniformRange(*job["payout"]) for job in special_jobs}
 
-def pick_special_job():
-    if random.random() > SPECIAL_CHANCE:
+def pick_special_job(odds: "Odds | None" = None):
+    # the trigger check stays a plain compare (it fails ~98% of the time);
+    # job choice and its gate are folded into one alias draw
+    odds = odds or DEFAULT_ODDS
+    if random.random() > odds.special_chance:
         return None
-    job = random.choice(special_jobs)
-    if not _special_job_gate(job["name"]):
+    job = odds.special_sampler.sample()
+    if job is None:
         return None
-    payout_value = round(random.uniform(*job["payout"]), 2)
+    payout_value = _SPECIAL_PAYOUTS[job["name"]].sample()
     return {"name": job["name"], "desc": job["desc"], "color": job["color"], "payout_value": payout_value}
 
 # ---------- Tips ----------
@@ -341,19 +1087,15 @@ tip_tiers = [
     {"name": "legend of generosity", "emoji": "🏆", "range": (10.00, 12.00), "weight": 1, "flavor": "a once-in-a-blue-moon legendary gratuity!"}
 ]
 
-def roll_tip():
-    if random.random() > TIP_BASE_CHANCE:
+_TIP_SAMPLER = AliasSampler([(i, t["weight"]) for i, t in enumerate(tip_tiers)])
+_TIP_MULTS = [UniformRange(*t["range"]) for t in tip_tiers]
+
+def roll_tip(odds: "Odds | None" = None):
+    if random.random() > (odds or DEFAULT_ODDS).tip_chance:
         return None
-    total_weight = sum(t["weight"] for t in tip_tiers)
-    pick = random.uniform(0, total_weight)
-    upto = 0
-    chosen = tip_tiers[-1]
-    for t in tip_tiers:
-        upto += t["weight"]
-        if pick <= upto:
-            chosen = t
-            break
-    mult = round(random.uniform(*chosen["range"]), 2)
+    i = _TIP_SAMPLER.sample()
+    chosen = tip_tiers[i]
+    mult = _TIP_MULTS[i].sample()
     return {"name": chosen["name"], "emoji": chosen["emoji"], "flavor": chosen["flavor"], "mult": mult}
 
 # ---------- Normal Jobs ----------
@@ -450,32 +1192,73 @@ jobs = {
 
 RARITY_ORDER = ["common","uncommon","rare","epic","legendary","secret"]
 
-async def pick_job(user_id: int):
-    if test_mode or BYPASS_CAREER:
-        allowed = _TEST_ALLOWED.copy()
+# ---------- Compiled samplers ----------
+# every weighted table above is turned into an O(1) alias sampler once, at import
+_TIER_SAMPLERS = [AliasSampler(tier["allowed"]) for tier in CAREER_PATH]
+_TEST_SAMPLER = AliasSampler(_TEST_ALLOWED)
+_PAYOUT_SAMPLERS = {r: UniformRange(*jobs[r]["payout"]) for r in jobs}
+
+_SPECIAL_SAMPLERS: dict[int, AliasSampler] = {}
+
+def special_sampler(dev_chance_denom: int) -> AliasSampler:
+    # the sampler bakes in the dev gate, so there's one per denominator in use (in practice two)
+    sampler = _SPECIAL_SAMPLERS.get(dev_chance_denom)
+    if sampler is None:
+        per_job = 1.0 / len(special_jobs)
+        weights = [(job, per_job * _special_job_gate_chance(job["name"], dev_chance_denom)) for job in special_jobs]
+        weights.append((None, 1.0 - sum(w for _, w in weights)))
+        sampler = _SPECIAL_SAMPLERS[dev_chance_denom] = AliasSampler(weights)
+    return sampler
+
+class Odds:
+    # one guild's effective odds; built from its guild_config.odds overrides
+    __slots__ = ("special_chance", "tip_chance", "dev_chance_denom", "bypass_career", "special_sampler")
+
+    def __init__(self, special_chance: float = SPECIAL_CHANCE, tip_chance: float = TIP_BASE_CHANCE,
+                 dev_chance_denom: int = DEV_CHANCE_DENOM, bypass_career: bool = False):
+        self.special_chance = float(special_chance)
+        self.tip_chance = float(tip_chance)
+        self.dev_chance_denom = int(dev_chance_denom)
+        self.bypass_career = bool(bypass_career)
+        self.special_sampler = special_sampler(self.dev_chance_denom)
+
+    @classmethod
+    def from_overrides(cls, overrides: dict) -> "Odds":
+        return cls(**{k: v for k, v in overrides.items() if k in cls.__slots__ and k != "special_sampler"})
+
+DEFAULT_ODDS = Odds()
+TEST_ODDS_OVERRIDES = {
+    "special_chance": _TEST_SPECIAL_CHANCE, "tip_chance": _TEST_TIP_BASE_CHANCE,
+    "dev_chance_denom": _TEST_DEV_CHANCE_DENOM, "bypass_career": True,
+}
+_odds_by_guild: dict[int, tuple] = {}  # gid -> (config it was built from, Odds)
+
+def odds_for(cfg) -> Odds:
+    # rebuilt only when the guild's config object is swapped (i.e. after a config change)
+    hit = _odds_by_guild.get(cfg.guild_id)
+    if hit is not None and hit[0] is cfg:
+        return hit[1]
+    odds = Odds.from_overrides(cfg.odds) if cfg.odds else DEFAULT_ODDS
+    _odds_by_guild[cfg.guild_id] = (cfg, odds)
+    return odds
+
+def roll_job(total_jobs: int, odds: Odds | None = None):
+    if (odds or DEFAULT_ODDS).bypass_career:
+        sampler = _TEST_SAMPLER
         career_name = "TEST MODE"
     else:
-        tier = await get_career_tier(user_id)
-        allowed = dict(tier.get("allowed", {}))
-        career_name = tier.get("name", "Temp Worker")
-
-    total_pct = sum(allowed.values()) or 100
-    roll = random.uniform(0, total_pct)
-    cum = 0.0
-    chosen_rarity = "common"
-    for r, pct in allowed.items():
-        cum += pct
-        if roll <= cum:
-            chosen_rarity = r
-            break
-
-    if chosen_rarity not in jobs:
-        chosen_rarity = "common"
+        i = career_tier_index(total_jobs)
+        sampler = _TIER_SAMPLERS[i]
+        career_name = CAREER_PATH[i]["name"]
 
+    chosen_rarity = sampler.sample()
     job = random.choice(jobs[chosen_rarity]["list"])
-    payout = round(random.uniform(*jobs[chosen_rarity]["payout"]), 2)
+    payout = _PAYOUT_SAMPLERS[chosen_rarity].sample()
     return chosen_rarity, job, payout, career_name
 
+async def pick_job(gid: int, uid: int):
+    return roll_job(await get_total_jobs(gid, uid), odds_for(guild_configs.get(gid)))
+
 # ---------- Discord events ----------
 import ssl
 # Create SSL context for PostgreSQL
@@ -483,30 +1266,134 @@ ssl_ctx = ssl.create_default_context()
 ssl_ctx.check_hostname = False
 ssl_ctx.verify_mode = ssl.CERT_NONE
 
-@bot.event
-async def on_ready():
-    global pool
-    if pool is None:
-        pool = await asyncpg.create_pool(
-            DATABASE_URL,
-            ssl=ssl_ctx,
-            statement_cache_size=0   # <-- fix for PgBouncer duplicate statement error
+# FORCE_COMMAND_SYNC=1 re-registers slash commands even if the tree looks unchanged
+# (e.g. after deleting them by hand in the developer portal)
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+
+def command_tree_hash(tree: app_commands.CommandTree) -> str:
+    # exactly what tree.sync() would upload, in a stable order
+    payload = sorted((cmd.to_dict(tree) for cmd in tree.get_commands()),
+                     key=lambda c: (c.get("type", 1), c["name"]))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+COMMAND_SYNC_LOCK_KEY = 0x73796E63  # "sync"
+
+async def sync_commands_if_changed() -> bool:
+    # global sync is slow and rate-limited, so only upload when the tree differs from the last upload.
+    # processes starting together queue on the lock; the first uploads, the rest then see its hash
+    key = f"command_tree:{bot.application_id}"
+    digest = command_tree_hash(bot.tree)
+    async with db_conn() as conn, conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", COMMAND_SYNC_LOCK_KEY)
+        stored = await conn.fetchval("SELECT value FROM bot_meta WHERE key=$1", key)
+        if stored == digest and not FORCE_COMMAND_SYNC:
+            return False
+        await bot.tree.sync()
+        await conn.execute("""
+            INSERT INTO bot_meta (key, value) VALUES ($1, $2)
+            ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value, updated_at=now()
+        """, key, digest)
+    return True
+
+async def startup():
+    # once per process, from setup_hook: after login, before the gateway connects
+    global pool, account_cache
+    pool = InstrumentedPool(await asyncpg.create_pool(
+        DATABASE_URL,
+        ssl=ssl_ctx,
+        statement_cache_size=0   # <-- fix for PgBouncer duplicate statement error
+    ), perf)
+    applied = await init_db()
+    if applied:
+        print(f"🗄️ Applied schema migration(s) {applied}")
+    # listen before loading, so a change made by another process in between isn't missed
+    await cluster.start(DIRECT_DATABASE_URL, ssl=ssl_ctx)
+    await guild_configs.load_all()
+    await load_leaderboards()
+    await reload_buffs()
+    if ACCOUNT_CACHE_ENABLED:
+        account_cache = AccountCache(
+            pool, JOB_COUNT_COLUMNS,
+            max_users=int(ACCOUNT_CACHE_MAX_MB * 1024 * 1024 // APPROX_ACCOUNT_BYTES),
+            flush_interval=ACCOUNT_CACHE_FLUSH_SECONDS,
         )
-        await init_db()
-
-    await bot.tree.sync()
-    print(f"✅ Logged in as {bot.user} and slash commands synced!")
-    activity = discord.CustomActivity(name=f"Getting a J*B at {BOT_VERSION}")
-    await bot.change_presence(status=discord.Status.online, activity=activity)
-
+        account_cache.start()
+    await ledger_writer.flush()  # creates this month's ledger partitions if needed
+    ledger_writer.start()
+    t0 = time.perf_counter()
+    recovered = await recover_roulette_rounds()
+    if recovered:
+        print(f"🎰 Recovered {len(recovered)} unfinished roulette round(s) in {(time.perf_counter() - t0) * 1000:.0f} ms")
+    if METRICS_PORT:
+        await perf.serve(METRICS_HOST, METRICS_PORT)
+        print(f"📈 Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if await sync_commands_if_changed():
+        print("✅ Slash commands synced")
+    asyncio.create_task(resume_role_syncs())
+    if recovered:
+        asyncio.create_task(announce_recovered_rounds(recovered))
+
+async def resume_role_syncs():
+    # sweeps need the guild cache, which only exists once the first READY has arrived
+    await bot.wait_until_ready()
+    resumed = await role_reconciler.resume_all()
+    if resumed:
+        print(f"🔄 Resumed {resumed} career role sync(s)")
 
+@bot.event
+async def on_ready():
+    # fires again after every gateway reconnect, so nothing one-time belongs here
+    print(f"✅ Logged in as {bot.user} (shards {sorted(bot.shards)} of {bot.shard_count})")
+
+# ---------- Cluster events ----------
+# other processes tell us when something we cache changed under us (see cluster.py)
+async def update_guild_config(gid: int, **changes):
+    cfg = await guild_configs.update(gid, **changes)
+    cluster.publish_soon("guild_config", guild_id=gid)
+    return cfg
+
+async def _on_guild_data(event):
+    # a guild's rows were rewritten elsewhere (/resetall, /importstate, tools/restore_state.py)
+    gid = int(event["guild_id"])
+    if account_cache is not None:
+        account_cache.forget_guild(gid)
+    await load_leaderboards(gid)
+    await reload_buffs(gid)
+
+async def _on_reconnected(_event):
+    # whatever was published while we were disconnected is lost, so reload it all
+    await guild_configs.load_all()
+    await load_leaderboards()
+    await reload_buffs()
+
+cluster.on("guild_config", lambda event: guild_configs.refresh(int(event["guild_id"])))
+cluster.on("guild_data", _on_guild_data)
+cluster.on("reconnected", _on_reconnected)
 
+@bot.event
+async def on_app_command_completion(interaction: discord.Interaction, command):
+    t0 = interaction.extras.get("t0")
+    if t0 is not None:
+        perf.observe("command_seconds", time.perf_counter() - t0, command=command.qualified_name, status="ok")
+
+perf.gauge("db_pool_connections", "Pool connections by state (max, open, in_use, waiting)",
+           lambda: {(("state", k),): v for k, v in pool.utilisation().items()} if pool is not None else {})
+perf.gauge("queue_depth", "Items waiting in background queues", lambda: {
+    (("queue", "announcements"),): announcer.pending(),
+    (("queue", "role_sync"),): len(role_sync),
+    (("queue", "ledger"),): len(ledger_writer),
+    (("queue", "roulette_journal"),): len(round_journal),
+})
+perf.gauge("ledger_entries", "Ledger entries written to Postgres, and dropped because the buffer was full",
+           lambda: {(("state", "written"),): ledger_writer.written, (("state", "dropped"),): ledger_writer.dropped})
+perf.gauge("cluster_locks_held", "Advisory locks this process holds (one per roulette table it runs)",
+           lambda: len(cluster))
+perf.gauge("buffs_active", "Users with at least one active buff (in-memory index)", lambda: len(buff_engine))
 
 # ---------- Commands ----------
 @bot.tree.command(name="balance", description="Check how much money you have")
 async def balance_cmd(interaction: discord.Interaction):
-    user_id = interaction.user.id
-    dollars = await get_balance(user_id)
+    dollars = await get_balance(interaction.guild_id, interaction.user.id)
 
     embed = discord.Embed(
         title="💰 Balance Check",
@@ -516,77 +1403,128 @@ async def balance_cmd(interaction: discord.Interaction):
     embed.set_footer(text=f"Requested by {interaction.user.name}")
     await interaction.response.send_message(embed=embed)
 
-# Test mode toggler
+# Test mode toggler (per guild: stored as this guild's odds overrides)
 @bot.tree.command(name="testmode", description="Toggle test mode (admin only)")
 async def testmode_cmd(interaction: discord.Interaction, toggle: str):
-    global test_mode, BYPASS_CAREER, SPECIAL_CHANCE, TIP_BASE_CHANCE, DEV_CHANCE_DENOM
     if not interaction.user.guild_permissions.administrator:
         await interaction.response.send_message("❌ You don’t have permission to use this.", ephemeral=True)
         return
 
     tgl = toggle.lower()
     if tgl == "on":
-        test_mode = True
-        BYPASS_CAREER = True
-        SPECIAL_CHANCE = _TEST_SPECIAL_CHANCE
-        TIP_BASE_CHANCE = _TEST_TIP_BASE_CHANCE
-        DEV_CHANCE_DENOM = _TEST_DEV_CHANCE_DENOM
+        await update_guild_config(interaction.guild_id, odds=TEST_ODDS_OVERRIDES)
         await interaction.response.send_message(
             "🧪 Test mode **ON** — career restrictions bypassed, tips forced, and special/dev odds boosted."
         )
     elif tgl == "off":
-        test_mode = False
-        BYPASS_CAREER = False
-        SPECIAL_CHANCE = 0.02
-        TIP_BASE_CHANCE = 0.25
-        DEV_CHANCE_DENOM = 7777
+        await update_guild_config(interaction.guild_id, odds={})
         await interaction.response.send_message(
             "🧪 Test mode **OFF** — odds restored to normal and career gating re-enabled."
         )
     else:
         await interaction.response.send_message("Usage: `/testmode on` or `/testmode off`", ephemeral=True)
 
-# Coinflip (cooldown)
-coinflip_cooldown = app_commands.checks.cooldown(1, 15.0, key=lambda i: i.user.id)
+# Server setup: channels, career roles (cached in guild_configs, so commands never query for them)
+config_group = app_commands.Group(
+    name="config", description="Set this server's channels and career roles (Admin only)",
+    default_permissions=discord.Permissions(administrator=True),
+)
+bot.tree.add_command(config_group)
+
+CHANNEL_KINDS = [
+    app_commands.Choice(name="announcements", value="announce"),
+    app_commands.Choice(name="work", value="work"),
+    app_commands.Choice(name="roulette (toggles; several allowed)", value="roulette"),
+]
 
+def config_embed(cfg) -> discord.Embed:
+    def chan(cid):
+        return f"<#{cid}>" if cid else "anywhere"
+    roles = [f"{tier['name']}: " + (f"<@&{rid}>" if (rid := cfg.career_role(i)) else "—")
+             for i, tier in enumerate(CAREER_PATH)]
+    embed = discord.Embed(title="⚙️ Server Config", color=discord.Color.blurple())
+    embed.add_field(name="Announcements", value=f"<#{cfg.announce_channel_id}>" if cfg.announce_channel_id else "off")
+    embed.add_field(name="Work", value=chan(cfg.work_channel_id))
+    embed.add_field(name="Roulette",
+                    value=", ".join(f"<#{c}>" for c in sorted(cfg.roulette_channel_ids)) or "anywhere")
+    embed.add_field(name="Career Roles", value="\n".join(roles), inline=False)
+    if cfg.odds:
+        embed.set_footer(text="odds overrides: " + ", ".join(f"{k}={v}" for k, v in sorted(cfg.odds.items())))
+    return embed
+
+@config_group.command(name="show", description="Show this server's config")
+async def config_show(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=config_embed(guild_configs.get(interaction.guild_id)), ephemeral=True)
+
+@config_group.command(name="channel", description="Set the announcements/work channel, or add/remove a roulette channel")
+@app_commands.choices(kind=CHANNEL_KINDS)
+async def config_channel(interaction: discord.Interaction, kind: str, channel: discord.TextChannel):
+    cfg = guild_configs.get(interaction.guild_id)
+    if kind == "roulette":
+        tables = set(cfg.roulette_channel_ids) ^ {channel.id}
+        cfg = await update_guild_config(interaction.guild_id, roulette_channel_ids=sorted(tables))
+    else:
+        cfg = await update_guild_config(interaction.guild_id, **{f"{kind}_channel_id": channel.id})
+    await interaction.response.send_message(embed=config_embed(cfg), ephemeral=True)
+
+@config_group.command(name="clearchannel", description="Unset a channel (work/roulette: allowed anywhere, announcements: off)")
+@app_commands.choices(kind=CHANNEL_KINDS)
+async def config_clear_channel(interaction: discord.Interaction, kind: str):
+    if kind == "roulette":
+        cfg = await update_guild_config(interaction.guild_id, roulette_channel_ids=[])
+    else:
+        cfg = await update_guild_config(interaction.guild_id, **{f"{kind}_channel_id": None})
+    await interaction.response.send_message(embed=config_embed(cfg), ephemeral=True)
+
+@config_group.command(name="careerrole", description="Set (or clear) the role handed out for a career tier")
+@app_commands.describe(tier="Career tier", role="Role to give at this tier (leave empty to clear)")
+@app_commands.choices(tier=[app_commands.Choice(name=t["name"], value=i) for i, t in enumerate(CAREER_PATH)])
+async def config_career_role(interaction: discord.Interaction, tier: int, role: discord.Role | None = None):
+    cfg = guild_configs.get(interaction.guild_id)
+    role_ids = list(cfg.career_role_ids) + [0] * (len(CAREER_PATH) - len(cfg.career_role_ids))
+    role_ids[tier] = role.id if role else 0
+    cfg = await update_guild_config(interaction.guild_id, career_role_ids=role_ids)
+    await interaction.response.send_message(embed=config_embed(cfg), ephemeral=True)
+
+# Coinflip (rate limited)
 @bot.tree.command(name="coinflip", description="Bet money on a coinflip (heads or tails)")
 @app_commands.describe(choice="Your guess: heads or tails", amount="How much money to bet")
-@coinflip_cooldown
+@limiter.check("coinflip", COINFLIP_RATE_BURST, COINFLIP_RATE_SECONDS)
 async def coinflip(interaction: discord.Interaction, choice: str, amount: float):
-    uid = interaction.user.id
+    gid, uid = interaction.guild_id, interaction.user.id
     choice = choice.lower()
     if choice not in ["heads", "tails"]:
         await interaction.response.send_message("❌ Please choose either 'heads' or 'tails'.", ephemeral=True)
         return
 
-    bal = await get_balance(uid)
     if amount <= 0:
         await interaction.response.send_message("❌ Bet amount must be greater than zero.", ephemeral=True); return
     if amount > 500_000:
         await interaction.response.send_message("❌ The maximum bet is $500,000.", ephemeral=True); return
-    if amount > bal:
-        await interaction.response.send_message("❌ You don’t have enough money for that bet.", ephemeral=True); return
 
-    boosted = await has_active_alcohol(uid)
-    win_prob = COINFLIP_BOOST_WINPROB if boosted else 0.5
-    win = random.random() < win_prob
-    result = choice if win else ("tails" if choice == "heads" else "heads")
+    async with unit_of_work():
+        boosted = has_active_alcohol(gid, uid)
+        win_prob = COINFLIP_BOOST_WINPROB if boosted else 0.5
+        win = random.random() < win_prob
+        result = choice if win else ("tails" if choice == "heads" else "heads")
+
+        # settle in one guarded statement: only goes through if the wallet covers the bet
+        new_bal = await try_debit(gid, uid, amount, delta=amount if win else -amount, reason="coinflip", detail=choice)
+        left = await consume_alcohol_use(gid, uid) if boosted and new_bal is not None else None
+    if new_bal is None:
+        await interaction.response.send_message("❌ You don’t have enough money for that bet.", ephemeral=True); return
 
     if win:
-        await add_balance(uid, amount)
         outcome = f"🎉 You guessed **{choice}** and it landed **{result}**! You won **${amount:,.2f}**."
         color = discord.Color.green()
     else:
-        await add_balance(uid, -amount)
         outcome = f"😢 You guessed **{choice}** but it landed **{result}**. You lost **${amount:,.2f}**."
         color = discord.Color.red()
 
     boost_line = ""
     if boosted:
-        left = await consume_alcohol_use(uid)
         boost_line = f"\n🍺 Alcohol boost used. **{left}** use(s) left."
 
-    new_bal = await get_balance(uid)
     embed = discord.Embed(
         title="🪙 Coinflip",
         description=f"{outcome}{boost_line}\n\n💼 Wallet Balance: **${new_bal:,.2f}**",
@@ -595,17 +1533,190 @@ async def coinflip(interaction: discord.Interaction, choice: str, amount: float)
     embed.set_footer(text=f"Bet: ${amount:,.2f}")
     await interaction.response.send_message(embed=embed)
 
-@coinflip.error
-async def coinflip_error(interaction: discord.Interaction, error):
-    if isinstance(error, app_commands.CommandOnCooldown):
-        await interaction.response.send_message(
-            f"⏳ You need to wait {error.retry_after:.1f} seconds before using /coinflip again.",
-            ephemeral=True
-        )
-
 # Roulette
 ROULETTE_WINDOW_SECONDS = 15
-roulette_game = {"active": False, "bets": [], "channel_id": None}
+ROULETTE_JOURNAL_TIMEOUT = 10  # seconds a bet waits for its journal write before it's confirmed anyway
+ROULETTE_SETTLE_MAX_DELAY = 60  # cap on the backoff between attempts to settle a round
+EMBED_DESC_LIMIT = 4000      # Discord caps a description at 4096
+
+def post_paginated_embeds(channel_id: int, title: str, lines: list, color, footer: str = "", urgent: bool = False):
+    # split lines across as few embeds as the description limit allows; the announcer packs them into messages
+    pages, cur = [], ""
+    for line in lines:
+        if cur and len(cur) + len(line) + 1 > EMBED_DESC_LIMIT:
+            pages.append(cur)
+            cur = ""
+        cur = f"{cur}\n{line}" if cur else line
+    if cur or not pages:
+        pages.append(cur or "No bets this round.")
+
+    embeds = []
+    for i, desc in enumerate(pages, start=1):
+        embed = discord.Embed(
+            title=title if len(pages) == 1 else f"{title} ({i}/{len(pages)})",
+            description=desc, color=color
+        )
+        if footer and i == len(pages):
+            embed.set_footer(text=footer)
+        embeds.append(embed)
+    announcer.post(channel_id, embeds=embeds, urgent=urgent)
+
+roulette_tables = roulette_engine.TableRegistry(salvage_chance=ROULETTE_COLOR_SALVAGE)
+# A channel's table runs in one process at a time: it holds the advisory lock keyed by the channel id
+# from the first bet until the round is settled. Other processes hear about the round from its
+# open/closed events and turn bets away without a lock query while it runs.
+remote_tables: dict[int, float] = {}  # channel id -> when the round elsewhere should be over (monotonic)
+
+def _on_remote_round(event):
+    ch = int(event["channel_id"])
+    if event["kind"] == "roulette_open":
+        remote_tables[ch] = time.monotonic() + float(event["seconds"]) + 5
+    else:
+        remote_tables.pop(ch, None)
+
+cluster.on("roulette_open", _on_remote_round)
+cluster.on("roulette_closed", _on_remote_round)
+
+def _on_lock_lost(event):
+    # another process claimed this channel while our cluster connection was down: stop taking
+    # bets here so only its table runs; the round we already opened still settles what it has
+    ch = int(event["key"])
+    table = roulette_tables.close(ch)
+    if table is not None:
+        table.lock_lost = True
+        print(f"⚠️ roulette table in channel {ch} lost its lock, no longer taking bets")
+
+cluster.on("lock_lost", _on_lock_lost)
+
+def _pocket_embed_color(color: str):
+    return discord.Color.green() if color == "green" else (discord.Color.red() if color == "red" else discord.Color.dark_gray())
+
+async def _settle_round(table: roulette_engine.RouletteTable, pocket: int, credits: dict, detail: str) -> bool:
+    # one attempt; False when the round was settled already, by another process that took the
+    # channel over or by an earlier attempt whose commit never got confirmed.
+    # Every bet is journaled before the spin is; the spin commits on its own so a restart
+    # mid-payout settles on this pocket, then the settled mark and the payout commit together
+    await asyncio.wait_for(round_journal.flush(), ROULETTE_JOURNAL_TIMEOUT)
+    async with db_conn() as conn:
+        await roulette_journal.record_spin(conn, table.round_id, pocket)
+    async with unit_of_work(transaction=True):
+        async with db_conn() as conn:
+            settled = await roulette_journal.mark_settled(conn, table.round_id)
+        if settled:
+            await credit_many(table.guild_id, credits, reason="roulette", detail=detail)
+    return settled
+
+async def finish_round(table: roulette_engine.RouletteTable):
+    try:
+        await asyncio.sleep(max(0, ROULETTE_WINDOW_SECONDS - 5))
+        announcer.post(table.channel_id, embed=discord.Embed(
+            title="⏳ Last Call",
+            description="5 seconds left to place your bets!",
+            color=discord.Color.orange()
+        ), urgent=True)
+        await asyncio.sleep(5)
+    finally:
+        # stop taking bets before anything is settled
+        roulette_tables.close(table.channel_id, table)
+
+    pocket = roulette_engine.spin()
+    result, color = roulette_engine.POCKETS[pocket], roulette_engine.POCKET_COLORS[pocket]
+
+    # settle bets: one lookup per bet, then pay winners in one statement
+    results, credits = table.settle(pocket)
+    # a failed attempt is retried with backoff, as the journal writer does, holding the channel
+    # until it lands; the players are told once that their results are delayed
+    delay, warned = 1.0, False
+    try:
+        while True:
+            try:
+                settled_here = await _settle_round(table, pocket, credits, result)
+                break
+            except Exception as e:
+                print(f"⚠️ settling roulette round {table.round_id} failed, retrying in {delay:.0f}s: {e!r}")
+                if not warned:
+                    warned = True
+                    announcer.post(table.channel_id, embed=discord.Embed(
+                        title="⚠️ Roulette Results Delayed",
+                        description="This round couldn’t be settled yet. Your bets are safe; the results "
+                                    "and any winnings will follow as soon as it is.",
+                        color=discord.Color.orange()
+                    ), urgent=True)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, ROULETTE_SETTLE_MAX_DELAY)
+    finally:
+        # a lost lock is someone else's now, as is announcing the channel free
+        if not table.lock_lost:
+            await cluster.release(table.channel_id)
+            cluster.publish_soon("roulette_closed", channel_id=table.channel_id)
+    if not settled_here and table.lock_lost:
+        # the process that took the channel over settled (and announced) it
+        print(f"⚠️ roulette round {table.round_id} was settled by another process")
+        return
+
+    win_lines, loss_lines = [], []
+    for r in results:
+        if r.won:
+            note = " (🍺 lucky sway!)" if r.salvaged else ""
+            win_lines.append(f"✅ <@{r.user_id}> won **${r.payout:,.2f}** betting **{r.bet}**{note}")
+        else:
+            loss_lines.append(f"❌ <@{r.user_id}> lost **${r.amount:,.2f}** betting **{r.bet}**")
+    # one results message (split only if Discord's size limits force it)
+    post_paginated_embeds(
+        table.channel_id, f"🎲 The Ball Landed: {color.capitalize()} {result}", win_lines + loss_lines,
+        _pocket_embed_color(color),
+        footer=f"{len(win_lines)} won • {len(loss_lines)} lost • ${sum(credits.values()):,.2f} paid out",
+        urgent=True
+    )
+
+# Rounds a previous run left open (crash, deploy): settled if the ball was already spun, refunded if not
+round_journal = roulette_journal.RoundJournal(lambda: pool)
+
+async def recover_roulette_rounds() -> list:
+    # runs from startup(), before the gateway connects, so no new bet can race it
+    async with db_conn() as conn:
+        rounds = await roulette_journal.unsettled_rounds(conn)
+        await roulette_journal.prune(conn)
+    recovered = []
+    for rnd in rounds:
+        ch = rnd["channel_id"]
+        if not await cluster.try_lock(ch):
+            continue  # another live process has a round running here; its round isn't ours to touch
+        try:
+            table = roulette_engine.RouletteTable(ch, ROULETTE_COLOR_SALVAGE, rnd["guild_id"], rnd["id"])
+            for _, user_id, bet, amount, boosted in rnd["bets"]:
+                table.add_bet(user_id, bet, amount, boosted)
+            pocket = rnd["pocket"]
+            if pocket is not None:
+                _, credits = table.settle(pocket)
+                detail = roulette_engine.POCKETS[pocket]
+            else:
+                credits = {}
+                for b in table.bets:
+                    credits[b.user_id] = credits.get(b.user_id, 0.0) + b.amount
+                detail = "refund"
+            async with unit_of_work(transaction=True):
+                async with db_conn() as conn:
+                    settled = await roulette_journal.mark_settled(conn, rnd["id"], refunded=pocket is None)
+                if settled:
+                    await credit_many(rnd["guild_id"], credits, reason="roulette", detail=detail)
+        finally:
+            await cluster.release(ch)
+        if settled:
+            recovered.append((ch, pocket, len(table.bets), sum(credits.values())))
+    return recovered
+
+async def announce_recovered_rounds(recovered: list):
+    # channels can only be posted to once the guild cache exists
+    await bot.wait_until_ready()
+    for ch, pocket, bets, paid in recovered:
+        if pocket is None:
+            desc = f"The bot restarted before the ball was spun. All {bets} bet(s) were refunded (${paid:,.2f})."
+        else:
+            desc = (f"The bot restarted mid-payout. The ball had landed on **{roulette_engine.POCKETS[pocket]}**; "
+                    f"{bets} bet(s) were settled (${paid:,.2f} paid out).")
+        announcer.post(ch, embed=discord.Embed(title="♻️ Roulette Round Recovered", description=desc,
+                                               color=discord.Color.orange()))
 
 @bot.tree.command(name="roulette", description="Join the roulette table and place your bet")
 @app_commands.describe(
@@ -613,181 +1724,112 @@ roulette_game = {"active": False, "bets": [], "channel_id": None}
     amount="How much money to bet"
 )
 async def roulette(interaction: discord.Interaction, bet: str, amount: float):
-    global roulette_game
     await interaction.response.defer(thinking=False, ephemeral=False)
 
-    if interaction.channel_id != ROULETTE_CHANNEL_ID:
+    gid, uid = interaction.guild_id, interaction.user.id
+    allowed = guild_configs.get(gid).roulette_channel_ids
+    if allowed and interaction.channel_id not in allowed:
         await interaction.followup.send(
-            f"❌ Roulette can only be played in <#{ROULETTE_CHANNEL_ID}>.",
+            "❌ Roulette can only be played in " + ", ".join(f"<#{c}>" for c in sorted(allowed)) + ".",
             ephemeral=True
         )
         return
 
-    uid = interaction.user.id
     bet = bet.lower()
 
-    valid_bets = ["red","black","green","odd","even","1-18","19-36","1st12","2nd12","3rd12"] + [str(n) for n in range(37)] + ["00"]
-    if bet not in valid_bets:
+    if bet not in roulette_engine.PAYOUTS:
         await interaction.followup.send(
             "❌ Invalid bet. Try red, black, green, odd, even, 1-18, 19-36, 1st12, 2nd12, 3rd12, or a number (0-36, 00).",
             ephemeral=True
         )
         return
 
-    bal = await get_balance(uid)
     if amount <= 0:
         await interaction.followup.send("❌ Bet amount must be greater than zero.", ephemeral=True); return
     if amount > 500_000:
         await interaction.followup.send("❌ The maximum bet is $500,000.", ephemeral=True); return
-    if amount > bal:
-        await interaction.followup.send("❌ You don’t have enough money to place that bet.", ephemeral=True); return
-
-    async def append_bet(first: bool):
-        boosted_now = (await has_active_alcohol(uid)) and (bet in ["red","black"])
-        await add_balance(uid, -amount)
-
-        if boosted_now:
-            left = await consume_alcohol_use(uid)
-            boost_note = f"\n🍺 Alcohol luck will apply to this **{bet}** bet. ({left} uses left)"
-        else:
-            boost_note = ""
-
-        roulette_game["bets"].append({
-            "user_id": uid, "bet": bet, "amount": amount, "boosted_color": boosted_now
-        })
 
-        embed_bet = discord.Embed(
-            title="🎲 First Bet Placed" if first else "🎲 Bet Placed",
-            description=f"{interaction.user.mention} wagered **${amount:,.2f}** on **{bet}**!{boost_note}",
-            color=discord.Color.blurple()
+    # claim the channel before any money moves: free if this process already runs its table,
+    # one lock query otherwise, and refused while another process runs it
+    ch = interaction.channel_id
+    if remote_tables.get(ch, 0) > time.monotonic() or not await cluster.try_lock(ch):
+        await interaction.followup.send(
+            "❌ A round is already running at this table on another bot instance, try again once it’s settled.",
+            ephemeral=True
         )
-        chan = bot.get_channel(roulette_game["channel_id"])
+        return
+    try:
+        # take the wager up front; a bet that can't be covered never touches the table. The
+        # debit commits (cached balance included) before the bet is journaled, so a journaled
+        # bet always has its wager taken and a refund at recovery can't pay it out twice
+        async with unit_of_work(transaction=True):
+            debited = await try_debit(gid, uid, amount, reason="roulette", detail=bet) is not None
+            boosted_now = debited and bet in roulette_engine.COLOR_BETS and has_active_alcohol(gid, uid)
+            left = await consume_alcohol_use(gid, uid) if boosted_now else None
+        if not debited:
+            await interaction.followup.send("❌ You don’t have enough money to place that bet.", ephemeral=True); return
+
+        # look the table up only after the awaits above, another bet may have opened it meanwhile
+        table = roulette_tables.get(ch)
+        if table is None and not cluster.holds(ch):
+            # the channel's lock was lost on a reconnect while we debited: its round is elsewhere now
+            async with unit_of_work(transaction=True):
+                await add_balance(gid, uid, amount, reason="roulette", detail="refund")
+                if boosted_now:
+                    await restore_alcohol_use(gid, uid)
+            await interaction.followup.send(
+                "❌ This table moved to another bot instance while your bet was placed; it was refunded.",
+                ephemeral=True
+            )
+            return
+        first = table is None
         if first:
-            await chan.send(embed=embed_bet)
-        else:
-            await interaction.followup.send(embed=embed_bet)
-
-    if not roulette_game["active"]:
-        roulette_game["active"] = True
-        roulette_game["bets"] = []
-        roulette_game["channel_id"] = interaction.channel_id
+            # the first bet's interaction id names the round in the journal
+            table = roulette_tables.open(ch, gid, round_id=interaction.id)
+            cluster.retain(ch)  # the round's own hold, released once it's settled
+            round_journal.open_round(table.round_id, gid, ch,
+                                     discord.utils.utcnow() + timedelta(seconds=ROULETTE_WINDOW_SECONDS))
+            table.task = asyncio.create_task(finish_round(table))
+            cluster.publish_soon("roulette_open", channel_id=ch, seconds=ROULETTE_WINDOW_SECONDS)
+        table.add_bet(uid, bet, amount, boosted_now)
+        journaled = round_journal.add_bet(table.round_id, interaction.id, uid, bet, amount, boosted_now)
+    finally:
+        await cluster.release(ch)
+    # confirm once the bet would survive a restart. If the database is too slow for that, the bet
+    # stays in the round (the journal keeps retrying it) and the player is told it isn't saved yet;
+    # refunding instead would pay it twice once the write lands and the round settles
+    saved_note = ""
+    try:
+        await asyncio.wait_for(journaled, ROULETTE_JOURNAL_TIMEOUT)
+    except asyncio.TimeoutError:
+        saved_note = ("\n⚠️ The bet is in this round but couldn’t be saved yet; "
+                      "if the bot restarts before the round settles, it may be lost.")
+
+    if boosted_now:
+        boost_note = f"\n🍺 Alcohol luck will apply to this **{bet}** bet. ({left} uses left)"
+    else:
+        boost_note = ""
 
+    embed_bet = discord.Embed(
+        title="🎲 First Bet Placed" if first else "🎲 Bet Placed",
+        description=f"{interaction.user.mention} wagered **${amount:,.2f}** on **{bet}**!{boost_note}{saved_note}",
+        color=discord.Color.blurple()
+    )
+    if first:
         embed_start = discord.Embed(
             title="🎰 Roulette Game Started!",
             description=f"Place your bets in the next **{ROULETTE_WINDOW_SECONDS} seconds** with `/roulette`!",
             color=discord.Color.gold()
         )
         await interaction.followup.send(embed=embed_start)
-        await append_bet(first=True)
-
-        async def finish_round():
-            chan = bot.get_channel(roulette_game["channel_id"])
-            await asyncio.sleep(max(0, ROULETTE_WINDOW_SECONDS - 5))
-            if chan:
-                await chan.send(embed=discord.Embed(
-                    title="⏳ Last Call",
-                    description="5 seconds left to place your bets!",
-                    color=discord.Color.orange()
-                ))
-            await asyncio.sleep(5)
-
-            # spin wheel
-            spin = random.randint(0, 37)
-            if spin == 37:
-                result = "00"; color = "green"
-            else:
-                result = str(spin)
-                if spin in {1,3,5,7,9,12,14,16,18,19,21,23,25,27,30,32,34,36}:
-                    color = "red"
-                elif spin in {2,4,6,8,10,11,13,15,17,20,22,24,26,28,29,31,33,35}:
-                    color = "black"
-                else:
-                    color = "green"
-
-            if chan:
-                await chan.send(embed=discord.Embed(
-                    title="🎲 The Ball Landed!",
-                    description=f"**{color.capitalize()} {result}**",
-                    color=discord.Color.green() if color == "green" else (discord.Color.red() if color == "red" else discord.Color.dark_gray())
-                ))
-
-                # settle bets
-                for bet_data in roulette_game["bets"]:
-                    uid2 = bet_data["user_id"]
-                    bet_choice = bet_data["bet"]
-                    wager = bet_data["amount"]
-                    boosted_color = bet_data.get("boosted_color", False)
-
-                    payout = 0.0
-                    win = False
-                    salvaged = False
-
-                    if bet_choice == result or (bet_choice == "00" and result == "00"):
-                        payout = wager * 35; win = True
-                    if bet_choice in ["red","black"] and bet_choice == color:
-                        payout = max(payout, wager * 2); win = True
-                    if bet_choice == "green" and color == "green":
-                        payout = max(payout, wager * 35); win = True
-                    if bet_choice == "odd" and result not in ["0","00"] and int(result) % 2 == 1:
-                        payout = max(payout, wager * 2); win = True
-                    if bet_choice == "even" and result not in ["0","00"] and int(result) % 2 == 0:
-                        payout = max(payout, wager * 2); win = True
-                    if bet_choice == "1-18" and result not in ["0","00"] and 1 <= int(result) <= 18:
-                        payout = max(payout, wager * 2); win = True
-                    if bet_choice == "19-36" and result not in ["0","00"] and 19 <= int(result) <= 36:
-                        payout = max(payout, wager * 2); win = True
-                    if bet_choice == "1st12" and result not in ["0","00"] and 1 <= int(result) <= 12:
-                        payout = max(payout, wager * 3); win = True
-                    if bet_choice == "2nd12" and result not in ["0","00"] and 13 <= int(result) <= 24:
-                        payout = max(payout, wager * 3); win = True
-                    if bet_choice == "3rd12" and result not in ["0","00"] and 25 <= int(result) <= 36:
-                        payout = max(payout, wager * 3); win = True
-
-                    # salvage if boosted color bet and lost
-                    if not win and boosted_color and bet_choice in ["red","black"]:
-                        if random.random() < ROULETTE_COLOR_SALVAGE:
-                            payout = wager * 2
-                            win = True
-                            salvaged = True
-
-                    if win:
-                        await add_balance(uid2, payout)
-                        note = " (🍺 lucky sway!)" if salvaged else ""
-                        await chan.send(embed=discord.Embed(
-                            title="✅ Winner!",
-                            description=f"<@{uid2}> won **${payout:,.2f}** betting **{bet_choice}**{note}.",
-                            color=discord.Color.green()
-                        ))
-                    else:
-                        await chan.send(embed=discord.Embed(
-                            title="❌ Lost",
-                            description=f"<@{uid2}> lost **${wager:,.2f}** betting **{bet_choice}**.",
-                            color=discord.Color.red()
-                        ))
-
-            roulette_game["active"] = False
-            roulette_game["bets"] = []
-            roulette_game["channel_id"] = None
-
-        asyncio.create_task(finish_round())
-        return
-
-    # join active game
-    if roulette_game["active"]:
-        if interaction.channel_id != roulette_game["channel_id"]:
-            chan = bot.get_channel(roulette_game["channel_id"])
-            mention = chan.mention if chan else "#unknown"
-            await interaction.followup.send(
-                f"❌ A roulette game is already running in {mention}. Please join it there!",
-                ephemeral=True
-            ); return
-        await append_bet(first=False)
+        announcer.post(interaction.channel_id, embed=embed_bet)
+    else:
+        await interaction.followup.send(embed=embed_bet)
 
 # Jobstats
 @bot.tree.command(name="jobstats", description="Check detailed job stats")
 async def jobstats(interaction: discord.Interaction):
-    uid = interaction.user.id
-    counts = await get_job_counts(uid)
+    counts = await get_job_counts(interaction.guild_id, interaction.user.id)
     total_jobs = sum(counts.values())
 
     embed = discord.Embed(
@@ -813,17 +1855,13 @@ async def jobstats(interaction: discord.Interaction):
 # Fish (punishment)
 @bot.tree.command(name="fish", description="Try to fish (but not in this bot!)")
 async def fish(interaction: discord.Interaction):
-    uid = interaction.user.id
-    balance = await get_balance(uid)
+    taken = await debit_fraction(interaction.guild_id, interaction.user.id, 0.05, reason="fish")
 
-    if balance <= 0:
+    if taken is None:
         await interaction.response.send_message("🎣 not here, wrong server dummy, Punishment time!")
         return
 
-    penalty = round(balance * 0.05, 2)
-    await add_balance(uid, -penalty)
-
-    new_balance = await get_balance(uid)
+    penalty, new_balance = round(taken[0], 2), taken[1]
     embed = discord.Embed(
         title="🎣 Not Here, Dummy!",
         description=(
@@ -835,127 +1873,319 @@ async def fish(interaction: discord.Interaction):
     )
     await interaction.response.send_message(embed=embed)
 
-# Leaderboards
-async def get_top_balances(limit=10):
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("SELECT user_id, balance FROM balances ORDER BY balance DESC LIMIT $1", limit)
-    return [(int(r["user_id"]), float(r["balance"])) for r in rows]
-
-@bot.tree.command(name="leaderboardmoney", description="Show the top users by wallet balance")
-async def leaderboardmoney(interaction: discord.Interaction):
-    guild = interaction.guild
-    if not guild:
-        await interaction.response.send_message("❌ This command can only be used in a server.")
-        return
+# ---------- Name resolution ----------
+# members in the guild cache get a mention; everyone else is looked up over REST once
+# and remembered (including "user is gone") so leaderboards don't refetch every time
+NAME_TTL = 60 * 60
+NAME_NEGATIVE_TTL = 10 * 60
+NAME_FETCH_CONCURRENCY = 5
+NAME_CACHE_MAX = 10_000
+
+class NameResolver:
+    def __init__(self):
+        self._names = {}  # uid -> (expires_at, name or None)
+        self._inflight = {}
+        self._sem = asyncio.Semaphore(NAME_FETCH_CONCURRENCY)
+
+    def _cached(self, uid: int):
+        hit = self._names.get(uid)
+        if hit and hit[0] > time.monotonic():
+            return hit
+        return None
 
-    rows = await get_top_balances(10)
-    if not rows:
-        await interaction.response.send_message("No balances to show yet!", ephemeral=True)
-        return
+    def _store(self, uid: int, name, ttl: float):
+        if len(self._names) >= NAME_CACHE_MAX:
+            now = time.monotonic()
+            self._names = {k: v for k, v in self._names.items() if v[0] > now}
+            if len(self._names) >= NAME_CACHE_MAX:
+                self._names.clear()
+        self._names[uid] = (time.monotonic() + ttl, name)
 
-    lines = []
-    for i, (uid, bal) in enumerate(rows, start=1):
-        member = guild.get_member(uid)
-        if member:
-            name = member.mention
-        else:
+    async def _fetch(self, uid: int):
+        async with self._sem:
             try:
                 user = await bot.fetch_user(uid)
-                name = user.name
-            except:
-                name = f"User {uid}"
-        medal = "🥇" if i==1 else "🥈" if i==2 else "🥉" if i==3 else f"{i}."
-        lines.append(f"{medal} {name} — **${bal:,.2f}**")
+            except discord.NotFound:
+                self._store(uid, None, NAME_NEGATIVE_TTL)
+                return None
+            except discord.HTTPException:
+                return None  # transient, don't remember it
+        self._store(uid, user.name, NAME_TTL)
+        return user.name
+
+    async def _lookup(self, uid: int):
+        hit = self._cached(uid)
+        if hit:
+            return hit[1]
+        task = self._inflight.get(uid)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(uid))
+            self._inflight[uid] = task
+            task.add_done_callback(lambda _t, uid=uid: self._inflight.pop(uid, None))
+        return await task
+
+    async def resolve(self, guild, uids) -> dict:
+        names = {}
+        misses = []
+        for uid in uids:
+            member = guild.get_member(uid) if guild else None
+            if member:
+                names[uid] = member.mention
+            else:
+                misses.append(uid)
+        fetched = await asyncio.gather(*(self._lookup(uid) for uid in misses))
+        for uid, name in zip(misses, fetched):
+            names[uid] = name or f"User {uid}"
+        return names
 
-    embed = discord.Embed(
-        title="💰 Economy Leaderboard",
-        description="**Top 10 Users by Balance**\n\n" + "\n".join(lines),
-        color=discord.Color.gold()
-    )
-    await interaction.response.send_message(embed=embed)
+name_resolver = NameResolver()
 
-async def get_top_jobs(limit=10):
-    # compute totals in SQL, defaulting NULLs to 0
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT user_id,
-                COALESCE(common,0)+COALESCE(uncommon,0)+COALESCE(rare,0)+
-                COALESCE(epic,0)+COALESCE(legendary,0)+COALESCE(secret,0)+COALESCE(special,0) AS total
-            FROM job_counts
-            ORDER BY total DESC
-            LIMIT $1
-        """, limit)
-    return [(int(r["user_id"]), int(r["total"])) for r in rows]
+# Leaderboards (served from the in-memory boards, see load_leaderboards)
+LEADERBOARD_PAGE_SIZE = 10
 
-@bot.tree.command(name="leaderboardjob", description="Show the top users by total jobs worked")
-async def leaderboardjob(interaction: discord.Interaction):
+async def get_top_balances(gid: int, limit=10):
+    return boards_for(gid).money.top(limit)
+
+async def get_top_jobs(gid: int, limit=10):
+    return boards_for(gid).jobs.top(limit)
+
+async def send_leaderboard(interaction: discord.Interaction, board: Ranking, page: int,
+                           title: str, heading: str, color, fmt):
     guild = interaction.guild
     if not guild:
         await interaction.response.send_message("❌ This command can only be used in a server.")
         return
 
-    rows = await get_top_jobs(10)
+    pages = board.page_count(LEADERBOARD_PAGE_SIZE)
+    page = min(max(1, page), pages)
+    rows = board.page(page, LEADERBOARD_PAGE_SIZE)
     if not rows:
-        await interaction.response.send_message("No job records to show yet!", ephemeral=True)
+        await interaction.response.send_message(f"No {heading} to show yet!", ephemeral=True)
         return
 
+    names = await name_resolver.resolve(guild, [uid for uid, _ in rows])
     lines = []
-    for i, (uid, total) in enumerate(rows, start=1):
-        member = guild.get_member(uid)
-        if member:
-            name = member.mention
-        else:
-            try:
-                user = await bot.fetch_user(uid)
-                name = user.name
-            except:
-                name = f"User {uid}"
+    start = (page - 1) * LEADERBOARD_PAGE_SIZE + 1
+    for i, (uid, score) in enumerate(rows, start=start):
         medal = "🥇" if i==1 else "🥈" if i==2 else "🥉" if i==3 else f"{i}."
-        lines.append(f"{medal} {name} — **{total:,} jobs**")
+        lines.append(f"{medal} {names[uid]} — {fmt(score)}")
 
-    embed = discord.Embed(
-        title="📊 Jobs Leaderboard",
-        description="**Top 10 Users by Jobs Worked**\n\n" + "\n".join(lines),
-        color=discord.Color.blurple()
+    embed = discord.Embed(title=title, description="\n".join(lines), color=color)
+    embed.set_footer(text=f"Page {page}/{pages} • {len(board):,} ranked")
+    await interaction.response.send_message(embed=embed)
+
+@bot.tree.command(name="leaderboardmoney", description="Show the top users by wallet balance")
+@app_commands.describe(page="Leaderboard page (10 users per page)")
+async def leaderboardmoney(interaction: discord.Interaction, page: int = 1):
+    await send_leaderboard(
+        interaction, boards_for(interaction.guild_id).money, page,
+        "💰 Economy Leaderboard", "balances", discord.Color.gold(),
+        lambda bal: f"**${bal:,.2f}**"
     )
+
+@bot.tree.command(name="leaderboardjob", description="Show the top users by total jobs worked")
+@app_commands.describe(page="Leaderboard page (10 users per page)")
+async def leaderboardjob(interaction: discord.Interaction, page: int = 1):
+    await send_leaderboard(
+        interaction, boards_for(interaction.guild_id).jobs, page,
+        "📊 Jobs Leaderboard", "job records", discord.Color.blurple(),
+        lambda total: f"**{total:,} jobs**"
+    )
+
+@bot.tree.command(name="rank", description="See where you (or someone else) place on the leaderboards")
+@app_commands.describe(member="Whose rank to look up (defaults to you)")
+async def rank_cmd(interaction: discord.Interaction, member: discord.Member | None = None):
+    target = member or interaction.user
+    uid = target.id
+    boards = boards_for(interaction.guild_id)
+
+    def line(board: Ranking, fmt):
+        pos = board.rank(uid)
+        if pos is None:
+            return "Unranked"
+        return f"**#{pos:,}** of {len(board):,} — {fmt(board.score(uid))}"
+
+    embed = discord.Embed(title=f"🏅 Rankings for {target.display_name}", color=discord.Color.gold())
+    embed.add_field(name="Balance", value=line(boards.money, lambda b: f"${b:,.2f}"), inline=False)
+    embed.add_field(name="Jobs Worked", value=line(boards.jobs, lambda t: f"{t:,} jobs"), inline=False)
     await interaction.response.send_message(embed=embed)
 
 #[NUCLEAR OPTION]
-@bot.tree.command(name="resetall", description="⚠️ Reset ALL data: balances, job counts, highest jobs, and buffs (Admin only)")
+@bot.tree.command(name="resetall", description="⚠️ Reset ALL of this server's data: balances, job counts, highest jobs, and buffs (Admin only)")
 @app_commands.checks.has_permissions(administrator=True)
 async def reset_all(interaction: discord.Interaction):
-    async with pool.acquire() as conn:
+    gid = interaction.guild_id
+    async with bulk_write(gid), db_conn() as conn, conn.transaction():
         # Reset balances
-        await conn.execute("UPDATE balances SET balance=0;")
+        await conn.execute(ledger.RESET_ALL_SQL, gid)
+        await conn.execute("UPDATE balances SET balance=0 WHERE guild_id=$1;", gid)
         
         # Reset job counts
         await conn.execute("""
             UPDATE job_counts
             SET common=0, uncommon=0, rare=0, epic=0,
-                legendary=0, secret=0, special=0;
-        """)
+                legendary=0, secret=0, special=0
+            WHERE guild_id=$1;
+        """, gid)
         
         # Clear highest jobs
-        await conn.execute("TRUNCATE highest_jobs;")
+        await conn.execute("DELETE FROM highest_jobs WHERE guild_id=$1;", gid)
         
         # Reset buffs
-        await conn.execute("UPDATE buffs SET uses=0, cooldown_until=0;")
+        await conn.execute("UPDATE buffs SET uses=0, cooldown_until=0 WHERE guild_id=$1;", gid)
     
     await interaction.response.send_message(
-        "⚠️ All data has been reset (balances, job counts, highest jobs, and buffs).",
+        "⚠️ All data for this server has been reset (balances, job counts, highest jobs, and buffs).",
         ephemeral=True
     )
 
 
 
+@bot.tree.command(name="exportstate", description="Export this server's economy data to a compressed file (Admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def export_state_cmd(interaction: discord.Interaction):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    name = time.strftime(f"state-{interaction.guild_id}-%Y%m%d-%H%M%S.ndjson.gz", time.gmtime())
+    path = os.path.join(EXPORT_DIR, name)
+    try:
+        counts = await export_state_to_file(interaction.guild_id, path)
+        size = os.path.getsize(path)
+    except Exception as e:
+        # don't leave a half-written snapshot behind for someone to restore later
+        if os.path.exists(path):
+            os.remove(path)
+        print(f"⚠️ /exportstate failed: {e!r}")
+        await interaction.followup.send(f"❌ Export failed, nothing was saved: `{e}`", ephemeral=True)
+        return
+
+    summary = ", ".join(f"{table}: {n:,}" for table, n in counts.items())
+    limit = interaction.guild.filesize_limit if interaction.guild else discord.utils.DEFAULT_FILE_SIZE_LIMIT_BYTES
+    if size > limit:
+        await interaction.followup.send(
+            f"📦 Export written ({summary}) but it's {size / 1_048_576:.1f} MB, too big to upload here. "
+            f"It's on the bot host at `{path}`.",
+            ephemeral=True
+        )
+        return
+    try:
+        await interaction.followup.send(
+            f"📦 Export ready ({summary}).", file=discord.File(path, filename=name), ephemeral=True
+        )
+    except discord.HTTPException as e:
+        # the snapshot itself is complete, so keep it
+        await interaction.followup.send(
+            f"📦 Export written ({summary}) but the upload failed (`{e}`). It's on the bot host at `{path}`.",
+            ephemeral=True
+        )
+
+@bot.tree.command(name="importstate", description="Restore this server's economy data from an export file (Admin only)")
+@app_commands.describe(
+    file="An /exportstate file (.ndjson.gz) or an old JSON export",
+    dry_run="Only validate and count what would change (default: on)",
+    replace="Wipe this server's existing rows first instead of merging over them",
+)
+@app_commands.checks.has_permissions(administrator=True)
+async def import_state_cmd(interaction: discord.Interaction, file: discord.Attachment,
+                           dry_run: bool = True, replace: bool = False):
+    await interaction.response.defer(ephemeral=True, thinking=True)
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    path = os.path.join(EXPORT_DIR, f"import-{int(time.time())}-{os.path.basename(file.filename)}")
+    try:
+        await file.save(path)
+        report = await import_state_from_file(interaction.guild_id, path, dry_run=dry_run, replace=replace)
+    except state_io.ExportFormatError as e:
+        await interaction.followup.send(f"❌ Couldn't read that file: `{e}`", ephemeral=True)
+        return
+    except Exception as e:
+        # the import runs in one transaction, so a failure part-way leaves the server's data as it was
+        print(f"⚠️ /importstate failed: {e!r}")
+        await interaction.followup.send(f"❌ The import failed, nothing was changed: `{e}`", ephemeral=True)
+        return
+    finally:
+        # uploads are only needed for the duration of the import
+        if os.path.exists(path):
+            os.remove(path)
+
+    lines = [f"**{table}** — {report.rows[table]:,} rows" + (
+        f" ({report.inserted[table]:,} new, {report.updated[table]:,} updated,"
+        f" {report.unchanged(table):,} unchanged)" if report.ok else ""
+    ) for table in state_io.TABLES]
+    if not report.ok:
+        title, color = f"❌ {report.error_count:,} problems found, nothing was changed", discord.Color.red()
+        lines += ["", *(f"• {err}" for err in report.errors)]
+    elif dry_run:
+        title, color = "🧪 Dry run OK, nothing was changed", discord.Color.blurple()
+    else:
+        title, color = "📥 Import complete", discord.Color.green()
+    embed = discord.Embed(title=title, description="\n".join(lines)[:4000], color=color)
+    mode = "replace" if replace else "merge"
+    embed.set_footer(text=f"{report.format} · {mode} · {report.seconds:.1f}s")
+    await interaction.followup.send(embed=embed, ephemeral=True)
+
+def _perf_rows(metric: str, label: str, limit: int = 10) -> str:
+    # "name  count  p50  p95  p99" in ms, slowest p95 first, as a code block
+    rows = []
+    for key, h in perf.series(metric).items():
+        labels = dict(key)
+        if labels.get("status") == "error":
+            continue
+        p50, p95, p99 = h.quantiles(0.5, 0.95, 0.99)
+        rows.append((labels.get(label, "?"), h.count, p50, p95, p99))
+    if not rows:
+        return "no data yet"
+    rows.sort(key=lambda r: r[3], reverse=True)
+    width = min(28, max(len(r[0]) for r in rows[:limit]))
+    lines = [f"{'':<{width}} {'n':>6} {'p50':>7} {'p95':>7} {'p99':>7}"]
+    for name, n, p50, p95, p99 in rows[:limit]:
+        lines.append(f"{name[:width]:<{width}} {n:>6} {p50 * 1000:>7.1f} {p95 * 1000:>7.1f} {p99 * 1000:>7.1f}")
+    return "```\n" + "\n".join(lines) + "\n```"
+
+@bot.tree.command(name="perf", description="Latency percentiles for commands, DB helpers and Discord calls (Admin only)")
+@app_commands.checks.has_permissions(administrator=True)
+async def perf_cmd(interaction: discord.Interaction):
+    embed = discord.Embed(title="📈 Performance (ms, last 1024 samples each)", color=discord.Color.blurple())
+    embed.add_field(name="Commands", value=_perf_rows("command_seconds", "command"), inline=False)
+    embed.add_field(name="DB helpers", value=_perf_rows("db_helper_seconds", "helper"), inline=False)
+    embed.add_field(name="Discord API", value=_perf_rows("discord_http_seconds", "route", limit=6), inline=False)
+
+    wait = perf.series("db_pool_wait_seconds").get(())
+    p50, p95, p99 = wait.quantiles(0.5, 0.95, 0.99) if wait else (0.0, 0.0, 0.0)
+    util = pool.utilisation() if pool is not None else {}
+    embed.add_field(
+        name="Pool",
+        value=(f"{util.get('in_use', 0)}/{util.get('open', 0)} in use (max {util.get('max', 0)}), "
+               f"{util.get('waiting', 0)} waiting · wait p50 {p50 * 1000:.1f} / p95 {p95 * 1000:.1f} / "
+               f"p99 {p99 * 1000:.1f} ms"),
+        inline=False
+    )
+    embed.set_footer(text=f"errors: {perf.total('command_errors_total'):.0f} command, "
+                          f"{perf.total('db_errors_total'):.0f} db · "
+                          f"queues: {announcer.pending()} announcements, {len(role_sync)} role changes · "
+                          f"ledger: {ledger_writer.written:,} written, {ledger_writer.dropped:,} dropped")
+    await interaction.response.send_message(embed=embed, ephemeral=True)
+
 # Alcohol
 @bot.tree.command(name="alcohol", description="Buy a temporary luck boost for gambling (5 uses). Costs $5,000. 6h cooldown.")
 async def alcohol_cmd(interaction: discord.Interaction):
-    uid = interaction.user.id
-    bal = await get_balance(uid)
+    gid, uid = interaction.guild_id, interaction.user.id
+
+    # a running cooldown is answered from memory; otherwise one transaction claims it with a
+    # conditional write and charges for it, so the charge and the new boost land together or not at all
+    cd_left = limiter.cooldown_left("alcohol", gid, uid)
+    paid = False
+    if cd_left == 0:
+        async with unit_of_work(transaction=True):
+            prev = await claim_boost(gid, uid, ALCOHOL_BOOST_USES, int(time.time()) + ALCOHOL_COOLDOWN)
+            if prev is None:
+                # another purchase got there first (at least a second left, so it's reported as a cooldown)
+                cd_left = max(1, alcohol_cooldown_left_sync(await get_boost_record(gid, uid)))
+            else:
+                paid = await try_debit(gid, uid, ALCOHOL_PRICE, reason="alcohol") is not None
+                if not paid:
+                    # can't afford it: put back the record the claim replaced
+                    await set_boost_record(gid, uid, prev["uses"], prev["cooldown_until"])
 
-    rec = await get_boost_record(uid)
-    cd_left = alcohol_cooldown_left_sync(rec)
     if cd_left > 0:
         hours = cd_left // 3600
         mins = (cd_left % 3600) // 60
@@ -966,14 +2196,10 @@ async def alcohol_cmd(interaction: discord.Interaction):
         )
         return
 
-    if bal < ALCOHOL_PRICE:
+    if not paid:
         await interaction.response.send_message("❌ You don’t have $5,000 for this.", ephemeral=True)
         return
 
-    await add_balance(uid, -ALCOHOL_PRICE)
-    until = int(time.time()) + ALCOHOL_COOLDOWN
-    await set_boost_record(uid, ALCOHOL_BOOST_USES, until)
-
     embed = discord.Embed(
         title="🍺 Liquid Courage Purchased!",
         description=(
@@ -990,9 +2216,8 @@ async def alcohol_cmd(interaction: discord.Interaction):
 
 @bot.tree.command(name="buffs", description="Check your active buffs")
 async def show_buffs(interaction: discord.Interaction):
-    uid = interaction.user.id
-    rec = await get_boost_record(uid)
-    uses = rec.get("uses", 0)
+    gid, uid = interaction.guild_id, interaction.user.id
+    uses = buff_engine.uses(gid, uid, "alcohol")
     if uses <= 0:
         await interaction.response.send_message(
             embed=discord.Embed(
@@ -1004,7 +2229,7 @@ async def show_buffs(interaction: discord.Interaction):
         )
         return
 
-    left_cd = alcohol_cooldown_left_sync(rec)
+    left_cd = limiter.cooldown_left("alcohol", gid, uid)
     cd_str = f"{left_cd//3600}h {(left_cd%3600)//60}m {left_cd%60}s" if left_cd>0 else "ready to rebuy when uses are 0"
     desc = f"🍺 **Alcohol Luck** — {uses} uses left (cooldown {cd_str})"
     embed = discord.Embed(title="🍹 Active Buffs", description=desc, color=discord.Color.green())
@@ -1020,38 +2245,113 @@ async def pay_cmd(interaction: discord.Interaction, member: discord.Member, amou
         await interaction.response.send_message("❌ You cannot pay yourself.", ephemeral=True); return
     if amount <= 0:
         await interaction.response.send_message("❌ Payment amount must be greater than 0.", ephemeral=True); return
-    if await get_balance(payer_id) < amount:
+    balances = await transfer_balance(interaction.guild_id, payer_id, receiver_id, amount)
+    if balances is None:
         await interaction.response.send_message("❌ You don’t have enough money to complete this payment.", ephemeral=True); return
-
-    await add_balance(payer_id, -amount)
-    await add_balance(receiver_id, +amount)
+    new_bal = balances[0]
 
     embed = discord.Embed(
         title="💸 Payment Successful!",
         description=(
             f"{interaction.user.mention} paid {member.mention} **${amount:,.2f}**.\n\n"
-            f"Your new balance: **${await get_balance(payer_id):,.2f}**"
+            f"Your new balance: **${new_bal:,.2f}**"
         ),
         color=discord.Color.gold()
     )
     await interaction.response.send_message(embed=embed)
 
+# History
+HISTORY_PAGE_SIZE = 10
+LEDGER_EMOJIS = {"work": "💼", "tip": "💵", "coinflip": "🪙", "roulette": "🎰", "pay": "💸",
+                 "fish": "🎣", "alcohol": "🍺", "reset": "♻️", "import": "📥"}
+
+def history_line(row) -> str:
+    detail = row["detail"]
+    if row["reason"] == "pay" and detail:
+        detail = f"<@{detail}>"
+    detail = f" · {detail}" if detail else ""
+    sign = "+" if row["delta"] >= 0 else "-"
+    bal = f" → ${row['balance']:,.2f}" if row["balance"] is not None else ""
+    return (f"<t:{int(row['created_at'].timestamp())}:R> {LEDGER_EMOJIS.get(row['reason'], '•')} "
+            f"**{sign}${abs(row['delta']):,.2f}** {row['reason']}{detail}{bal}")
+
+class HistoryView(discord.ui.View):
+    # keyset paging: each page starts after the (created_at, id) of the row above it,
+    # so going further back costs the same as the first page
+    def __init__(self, interaction: discord.Interaction, uid: int, reason: str | None, title: str):
+        super().__init__(timeout=180)
+        self.interaction = interaction
+        self.uid = uid
+        self.reason = reason
+        self.title = title
+        self.cursors = [None]  # where each page seen so far started
+        self.next_cursor = None
+
+    async def render(self) -> discord.Embed:
+        async with db_conn() as conn:
+            rows = await ledger.fetch_page(conn, self.interaction.guild_id, self.uid, HISTORY_PAGE_SIZE + 1,
+                                           self.cursors[-1], self.reason)
+        more = len(rows) > HISTORY_PAGE_SIZE
+        rows = rows[:HISTORY_PAGE_SIZE]
+        self.next_cursor = (rows[-1]["created_at"], rows[-1]["id"]) if more else None
+        self.older.disabled = not more
+        self.newer.disabled = len(self.cursors) == 1
+        embed = discord.Embed(
+            title=self.title,
+            description="\n".join(map(history_line, rows)) or "No transactions yet.",
+            color=discord.Color.blurple()
+        )
+        embed.set_footer(text=f"Page {len(self.cursors)}" + (f" • {self.reason} only" if self.reason else ""))
+        return embed
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.interaction.user.id
+
+    async def on_timeout(self):
+        try:
+            await self.interaction.edit_original_response(view=None)
+        except discord.HTTPException:
+            pass
+
+    @discord.ui.button(label="◀ Newer", style=discord.ButtonStyle.secondary)
+    async def newer(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.pop()
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+    @discord.ui.button(label="Older ▶", style=discord.ButtonStyle.secondary)
+    async def older(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.cursors.append(self.next_cursor)
+        await interaction.response.edit_message(embed=await self.render(), view=self)
+
+@bot.tree.command(name="history", description="Page through your balance history")
+@app_commands.describe(reason="Only show one kind of transaction", member="Whose history to show (Admin only)")
+@app_commands.choices(reason=[app_commands.Choice(name=r, value=r) for r in ledger.REASONS])
+async def history_cmd(interaction: discord.Interaction, reason: str | None = None,
+                      member: discord.Member | None = None):
+    target = member or interaction.user
+    if target.id != interaction.user.id and not interaction.user.guild_permissions.administrator:
+        await interaction.response.send_message("❌ You can only view your own history.", ephemeral=True)
+        return
+    await ledger_writer.flush()  # include whatever the last few commands just logged
+    view = HistoryView(interaction, target.id, reason, f"📒 History for {target.display_name}")
+    await interaction.response.send_message(embed=await view.render(), view=view, ephemeral=True)
+
 
 # Resume
 @bot.tree.command(name="resume", description="Check your career ladder progress and highest-paying job")
 async def resume(interaction: discord.Interaction):
-    uid = interaction.user.id
-    counts = await get_job_counts(uid)
+    gid, uid = interaction.guild_id, interaction.user.id
+    async with unit_of_work():
+        counts = await get_job_counts(gid, uid)
+        record = await get_highest_job(gid, uid)
     total_jobs = sum(counts.values())
 
     # next unlock
     next_unlock = None
-    for tier in CAREER_PATH:
-        if total_jobs < tier["required"]:
-            next_unlock = (tier["name"], tier["required"] - total_jobs)
-            break
+    nxt = bisect_right(CAREER_THRESHOLDS, total_jobs)
+    if nxt < len(CAREER_PATH):
+        next_unlock = (CAREER_PATH[nxt]["name"], CAREER_PATH[nxt]["required"] - total_jobs)
 
-    record = await get_highest_job(uid)
     embed = discord.Embed(title=f"📄 Resume for {interaction.user.display_name}", color=discord.Color.green())
 
     if record:
@@ -1070,52 +2370,72 @@ async def resume(interaction: discord.Interaction):
 
     await interaction.response.send_message(embed=embed)
 
-# Update job progress (roles + counts)
-async def update_job_progress(interaction: discord.Interaction, rarity: str):
-    user_id = interaction.user.id
-    await increment_job(user_id, rarity)
-    counts = await get_job_counts(user_id)
-    total_jobs = sum(counts.values())
+# Career promotions: role changes run on the background queue, never inside /work
+def managed_roles_for(gid: int) -> frozenset:
+    return guild_configs.get(gid).managed_role_ids
 
-    member = interaction.user
+role_sync = RoleSyncQueue(bot, managed_roles_for)
+role_reconciler = RoleReconciler(bot, lambda: pool, career_role_for, managed_roles_for)
+
+async def promote_if_crossed(interaction: discord.Interaction, work: dict):
+    # call after the /work response is out; only does anything when a tier threshold was crossed
+    stage = promotion_for(work["total_before"], work["total"])
+    if stage is None or not interaction.guild:
+        return
+    role_id = guild_configs.get(interaction.guild_id).career_role(CAREER_PATH.index(stage))
+    if role_id:
+        role_sync.request(interaction.guild_id, interaction.user.id, role_id, reason=f"career: {stage['name']}")
+    announcer.post(
+        interaction.channel_id,
+        f"🎉 {interaction.user.mention} has been promoted to **{stage['name']}** "
+        f"for working {work['total']} total jobs!"
+    )
+
+@bot.tree.command(name="syncroles", description="Fix everyone's career role to match their job count (Admin only)")
+@app_commands.describe(action="start a sweep, check on it, or cancel it")
+@app_commands.choices(action=[
+    app_commands.Choice(name="start", value="start"),
+    app_commands.Choice(name="status", value="status"),
+    app_commands.Choice(name="cancel", value="cancel"),
+])
+@app_commands.checks.has_permissions(administrator=True)
+async def sync_roles_cmd(interaction: discord.Interaction, action: str = "start"):
     guild = interaction.guild
     if not guild:
+        await interaction.response.send_message("❌ Use this in a server.", ephemeral=True)
         return
-
-    unlocked_stage = None
-    for stage in CAREER_PATH:
-        if total_jobs >= stage["required"]:
-            unlocked_stage = stage
-        else:
-            break
-
-    if unlocked_stage:
-        new_role = guild.get_role(unlocked_stage["role_id"])
-        if new_role and new_role not in member.roles:
-            # remove any older career roles
-            career_role_ids = [s["role_id"] for s in CAREER_PATH]
-            roles_to_remove = [r for r in member.roles if r.id in career_role_ids]
-            if roles_to_remove:
-                await member.remove_roles(*roles_to_remove)
-            await member.add_roles(new_role)
-            # announce in channel
-            await interaction.channel.send(
-                f"🎉 {interaction.user.mention} has been promoted to **{unlocked_stage['name']}** "
-                f"for working {total_jobs} total jobs!"
-            )
+    if action == "cancel":
+        ok = await role_reconciler.cancel(guild.id)
+        await interaction.response.send_message("🛑 Sync cancelled." if ok else "Nothing is running.", ephemeral=True)
+        return
+    if action == "status" or role_reconciler.running(guild.id):
+        st = await role_reconciler.status(guild.id)
+        if not st:
+            await interaction.response.send_message("No career role sync has run here yet.", ephemeral=True)
+            return
+        await interaction.response.send_message(
+            f"Career role sync **{st['status']}** ({st['phase']}): checked {st['checked']:,}, "
+            f"changed {st['changed']:,}, not in server {st['missing']:,}, failed {st['failed']:,}.",
+            ephemeral=True
+        )
+        return
+    await interaction.response.send_message("🔄 Starting career role sync, progress will be posted here.", ephemeral=True)
+    await role_reconciler.start(guild, interaction.channel)
 
 # Work command
 @bot.tree.command(name="work", description="Do an odd job to earn some money")
+@limiter.check("work", WORK_RATE_BURST, WORK_RATE_SECONDS)
 async def work_cmd(interaction: discord.Interaction):
-    # channel check
-    if interaction.channel_id != WORK_CHANNEL_ID:
+    # channel check (no work channel configured = anywhere)
+    gid, uid = interaction.guild_id, interaction.user.id
+    cfg = guild_configs.get(gid)
+    if cfg.work_channel_id and interaction.channel_id != cfg.work_channel_id:
         await interaction.response.send_message(
-            f"❌ You can only use this command in <#{WORK_CHANNEL_ID}>.",
+            f"❌ You can only use this command in <#{cfg.work_channel_id}>.",
             ephemeral=True
         )
         return
-
-    uid = interaction.user.id
+    odds = odds_for(cfg)
 
     # 1) small chance to waste a turn
     if random.random() < 0.05:
@@ -1136,15 +2456,16 @@ async def work_cmd(interaction: discord.Interaction):
         return
 
     # 2) special job check
-    special = pick_special_job()
+    special = pick_special_job(odds)
     if special is not None:
         base_payout = special["payout_value"]
-        tip = roll_tip()
+        tip = roll_tip(odds)
         final_payout = round(base_payout * tip["mult"], 2) if tip else base_payout
 
-        new_balance = await add_balance(uid, final_payout)
-        await update_job_progress(interaction, "special")
-        await update_highest_job(uid, special["name"], "special", final_payout)
+        work = await record_work(gid, uid, lambda _total: {
+            "rarity": "special", "job": special["name"], "amount": final_payout, "base_payout": base_payout
+        })
+        new_balance = work["balance"]
 
         desc_lines = [f"{special['desc']}", "", f"you earned **${base_payout:,.2f}**."]
         if tip:
@@ -1160,24 +2481,27 @@ async def work_cmd(interaction: discord.Interaction):
         )
         embed.set_footer(text=f"special job: {special['name'].upper()}")
         await interaction.response.send_message(embed=embed)
+        await promote_if_crossed(interaction, work)
 
         # announce
-        announce_channel = bot.get_channel(ANNOUNCE_CHANNEL_ID)
-        if announce_channel:
-            emoji = rarity_emojis.get(special["name"], "✨")
-            msg = f"{emoji} {interaction.user.mention} hit a **Special Job: {special['name'].upper()}** and earned ${final_payout:,.2f}"
-            msg += f" (tipped ×{tip['mult']})!" if tip else "!"
-            await announce_channel.send(msg)
+        emoji = rarity_emojis.get(special["name"], "✨")
+        msg = f"{emoji} {interaction.user.mention} hit a **Special Job: {special['name'].upper()}** and earned ${final_payout:,.2f}"
+        msg += f" (tipped ×{tip['mult']})!" if tip else "!"
+        if cfg.announce_channel_id:
+            announcer.post(cfg.announce_channel_id, msg)
         return
 
     # 3) normal roll
-    rarity, job, base_payout, career_name = await pick_job(uid)
-    tip = roll_tip()
-    final_payout = round(base_payout * tip["mult"], 2) if tip else base_payout
+    def roll(total_jobs: int) -> dict:
+        rarity, job, base_payout, career_name = roll_job(total_jobs, odds)
+        tip = roll_tip(odds)
+        final_payout = round(base_payout * tip["mult"], 2) if tip else base_payout
+        return {"rarity": rarity, "job": job, "amount": final_payout,
+                "base_payout": base_payout, "tip": tip, "career_name": career_name}
 
-    new_balance = await add_balance(uid, final_payout)
-    await update_job_progress(interaction, rarity)
-    await update_highest_job(uid, job, rarity, final_payout)
+    work = await record_work(gid, uid, roll)
+    rarity, job, base_payout, career_name = work["rarity"], work["job"], work["base_payout"], work["career_name"]
+    tip, final_payout, new_balance = work["tip"], work["amount"], work["balance"]
 
     desc_lines = [f"{flavor_texts[rarity]}", "", f"you {job} and earned **${base_payout:,.2f}**."]
     if tip:
@@ -1194,21 +2518,21 @@ async def work_cmd(interaction: discord.Interaction):
     )
     embed.set_footer(text=f"career tier: {career_name}")
     await interaction.response.send_message(embed=embed)
+    await promote_if_crossed(interaction, work)
 
     # announce big hits
-    if rarity in ["legendary", "secret"]:
-        announce_channel = bot.get_channel(ANNOUNCE_CHANNEL_ID)
-        if announce_channel:
-            emoji = rarity_emojis.get(rarity, "✨")
-            msg = f"{emoji} {interaction.user.mention} just worked a **{rarity.upper()} job** and made ${final_payout:,.2f}"
-            msg += f" (tipped ×{tip['mult']})!" if tip else "!"
-            await announce_channel.send(msg)
+    if rarity in ["legendary", "secret"] and cfg.announce_channel_id:
+        emoji = rarity_emojis.get(rarity, "✨")
+        msg = f"{emoji} {interaction.user.mention} just worked a **{rarity.upper()} job** and made ${final_payout:,.2f}"
+        msg += f" (tipped ×{tip['mult']})!" if tip else "!"
+        announcer.post(cfg.announce_channel_id, msg)
 
 # --- run ---
-load_dotenv()
-TOKEN = os.getenv("DISCORD_TOKEN")
-if not TOKEN:
-    raise RuntimeError("DISCORD_TOKEN is not set")
-if not DATABASE_URL:
-    raise RuntimeError("DATABASE_URL is not set")
-bot.run(TOKEN)
+if __name__ == "__main__":
+    load_dotenv()
+    TOKEN = os.getenv("DISCORD_TOKEN")
+    if not TOKEN:
+        raise RuntimeError("DISCORD_TOKEN is not set")
+    if not DATABASE_URL:
+        raise RuntimeError("DATABASE_URL is not set")
+    bot.run(TOKEN)
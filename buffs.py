@@ -0,0 +1,112 @@
+"""In-memory index of active buffs.
+
+At any moment almost nobody has a buff running, yet every gamble has to ask. BuffEngine keeps
+every active buff in memory, (guild, user) -> {kind: (uses left, expires at)}, plus a heap of
+expiry times for kinds that also run out on the clock, so the question is a dict lookup and
+the usual answer, "none", never reaches the database. Only when a buff is really there does
+consume() go to SQL: one conditional UPDATE ... RETURNING, so two uses racing each other
+can't spend the same charge.
+
+Each kind is a BuffKind naming the table and columns its rows live in (alcohol: buffs.uses).
+The index is loaded at startup and kept in step by whoever writes those rows: set() after
+a write commits, consume(), and load() after a guild's rows were rewritten in bulk.
+"""
+import heapq
+import time
+
+
+class BuffKind:
+    __slots__ = ("name", "table", "uses_column", "expires_column")
+
+    def __init__(self, name: str, table: str, uses_column: str = "uses", expires_column: str | None = None):
+        self.name = name
+        self.table = table              # keyed by (guild_id, user_id)
+        self.uses_column = uses_column
+        self.expires_column = expires_column  # unix seconds, or None for buffs that only run out of uses
+
+
+class BuffEngine:
+    def __init__(self, pool_getter, kinds):
+        self._pool = pool_getter  # the bot creates its pool late, so look it up per use
+        self.kinds = {k.name: k for k in kinds}
+        self._active: dict[tuple[int, int], dict[str, tuple[int, int | None]]] = {}
+        self._expiry: list[tuple[int, int, int, str]] = []  # (expires_at, gid, uid, kind), may hold stale entries
+        self.skipped = 0   # lookups answered "no buff" without a query
+        self.consumed = 0
+
+    def __len__(self):
+        return len(self._active)
+
+    def uses(self, gid: int, uid: int, kind: str) -> int:
+        self._expire()
+        entry = self._active.get((gid, uid), {}).get(kind)
+        if entry is None:
+            self.skipped += 1
+            return 0
+        return entry[0]
+
+    def set(self, gid: int, uid: int, kind: str, uses: int, expires_at: int | None = None):
+        # mirror a committed write of the buff's row
+        key = (gid, uid)
+        if uses > 0 and (expires_at is None or expires_at > time.time()):
+            self._active.setdefault(key, {})[kind] = (int(uses), expires_at)
+            if expires_at is not None:
+                heapq.heappush(self._expiry, (expires_at, gid, uid, kind))
+            return
+        held = self._active.get(key)
+        if held is not None:
+            held.pop(kind, None)
+            if not held:
+                del self._active[key]
+
+    def _expire(self):
+        heap = self._expiry
+        now = time.time()
+        while heap and heap[0][0] <= now:
+            expires_at, gid, uid, kind = heapq.heappop(heap)
+            entry = self._active.get((gid, uid), {}).get(kind)
+            if entry is not None and entry[1] == expires_at:  # not renewed since this entry was pushed
+                self.set(gid, uid, kind, 0)
+
+    async def consume(self, conn, gid: int, uid: int, kind: str) -> int | None:
+        """Spend one use: None without a query if there's no active buff, else the uses left in SQL."""
+        if not self.uses(gid, uid, kind):
+            return None
+        k = self.kinds[kind]
+        live = f" AND {k.expires_column} > $3" if k.expires_column else ""
+        args = (gid, uid, int(time.time())) if k.expires_column else (gid, uid)
+        left = await conn.fetchval(f"""
+            UPDATE {k.table} SET {k.uses_column}={k.uses_column} - 1
+            WHERE guild_id=$1 AND user_id=$2 AND {k.uses_column} > 0{live}
+            RETURNING {k.uses_column}
+        """, *args)
+        self.consumed += 1
+        return 0 if left is None else int(left)  # None: the row ran out under us
+
+    # ---------- loading ----------
+    async def load(self, gid: int | None = None) -> int:
+        """(Re)build the index from the tables, for one guild or all of them."""
+        rows = []
+        async with self._pool().acquire() as conn:
+            for k in self.kinds.values():
+                expires = k.expires_column or "NULL::bigint"
+                where = f"{k.uses_column} > 0"
+                args = []
+                if k.expires_column:
+                    args.append(int(time.time()))
+                    where += f" AND {k.expires_column} > ${len(args)}"
+                if gid is not None:
+                    args.append(gid)
+                    where += f" AND guild_id=${len(args)}"
+                rows += [(k.name, r) for r in await conn.fetch(
+                    f"SELECT guild_id, user_id, {k.uses_column} AS uses, {expires} AS expires_at "
+                    f"FROM {k.table} WHERE {where}", *args
+                )]
+        if gid is None:
+            self._active, self._expiry = {}, []
+        else:
+            for key in [key for key in self._active if key[0] == gid]:
+                del self._active[key]
+        for kind, r in rows:
+            self.set(r["guild_id"], r["user_id"], kind, r["uses"], r["expires_at"])
+        return len(rows)
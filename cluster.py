@@ -0,0 +1,201 @@
+"""Coordination between bot processes that share one database.
+
+The bot can run as several processes (each owning a range of shards) against one Postgres,
+and they coordinate through it rather than through each other:
+
+- session advisory locks, taken on one dedicated connection, claim things only one process
+  may run at a time (a roulette table per channel). If a process dies its session ends and
+  Postgres releases them, so nothing needs cleaning up.
+- LISTEN/NOTIFY on one channel carries small JSON events (a guild's config changed, its data
+  was rewritten, a round opened or closed) so the other processes can drop stale caches.
+
+Until start() is called everything is process-local: locks only count holders and publish()
+does nothing, which is what a single process (or a bench without Postgres) wants. Once
+started, losing the connection makes try_lock() refuse until it's back, since Postgres has
+already let go of our locks. Reconnecting re-takes the locks we still hold; one another
+process claimed in the meantime is dropped and a local "lock_lost" event ({"key": ...}) is
+dispatched, so its owner can stop using it. Events sent meanwhile are missed, so after
+reconnecting the "reconnected" handlers run and should reload whatever they cache.
+
+The dedicated connection needs a real session: behind PgBouncer in transaction mode, give it
+a direct DSN.
+"""
+import asyncio
+import json
+import uuid
+
+import asyncpg
+
+CHANNEL = "economy_events"
+RECONNECT_MAX_DELAY = 30.0
+
+
+async def notify(conn, kind: str, sender: str = "", **data):
+    # also usable without a Cluster, e.g. from tools that rewrite a guild's rows
+    payload = json.dumps({"kind": kind, "from": sender, **data}, separators=(",", ":"))
+    await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+
+class Cluster:
+    def __init__(self, pool_getter):
+        self._pool = pool_getter  # the bot creates its pool late, so look it up per use
+        self.connect_kwargs = {}
+        self.instance = uuid.uuid4().hex[:12]  # tags our own events so we can skip them
+        self.dsn = None
+        self._conn = None
+        self._conn_lock = asyncio.Lock()  # one asyncpg connection runs one query at a time
+        self._held: dict[int, int] = {}   # lock key -> local holders
+        self._handlers: dict[str, list] = {}
+        self._tasks = set()
+        self._started = False
+        self._closing = False
+        self.published = 0
+        self.received = 0
+
+    def __len__(self):
+        return len(self._held)
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    def on(self, kind: str, handler):
+        """Run handler(event) (plain or async) for every `kind` event another process publishes."""
+        self._handlers.setdefault(kind, []).append(handler)
+
+    # ---------- lifecycle ----------
+    async def start(self, dsn: str, **connect_kwargs):
+        self.dsn = dsn
+        self.connect_kwargs = connect_kwargs
+        self._started = True
+        async with self._conn_lock:
+            await self._connect()
+
+    async def close(self):
+        self._closing = True
+        for task in list(self._tasks):
+            task.cancel()
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            await conn.close()  # ends the session, which releases every lock we hold
+
+    async def _connect(self) -> list[int]:
+        # returns the held keys another process claimed while we were away
+        conn = await asyncpg.connect(self.dsn, **self.connect_kwargs)
+        await conn.add_listener(CHANNEL, self._on_notify)
+        conn.add_termination_listener(self._on_lost)
+        lost = []
+        for key in list(self._held):
+            # tables that kept running while we were away; someone may have claimed them meanwhile
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1::bigint)", key):
+                print(f"⚠️ advisory lock {key} was taken by another process while we were disconnected")
+                del self._held[key]  # not ours any more; later release() calls for it are no-ops
+                lost.append(key)
+        self._conn = conn
+        return lost
+
+    def _on_lost(self, conn):
+        if self._closing or conn is not self._conn:
+            return
+        self._conn = None
+        print("⚠️ cluster connection lost, reconnecting")
+        self._spawn(self._reconnect())
+
+    async def _reconnect(self):
+        delay = 1.0
+        while not self._closing:
+            try:
+                async with self._conn_lock:
+                    lost = await self._connect()
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                print(f"⚠️ cluster reconnect failed, retrying in {delay:.0f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+                continue
+            print("🔌 cluster connection restored")
+            for key in lost:
+                self._dispatch({"kind": "lock_lost", "key": key})
+            self._dispatch({"kind": "reconnected"})
+            return
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"⚠️ cluster task failed: {task.exception()!r}")
+
+    # ---------- locks ----------
+    async def try_lock(self, key: int) -> bool:
+        # re-entrant within this process: every True must be paired with one release()
+        async with self._conn_lock:
+            if key in self._held:
+                self._held[key] += 1
+                return True
+            if self._started:
+                if not self.connected:
+                    return False  # can't tell who else holds it, so don't claim it
+                if not await self._conn.fetchval("SELECT pg_try_advisory_lock($1::bigint)", key):
+                    return False
+            self._held[key] = 1
+            return True
+
+    async def release(self, key: int):
+        async with self._conn_lock:
+            left = self._held.get(key, 0) - 1
+            if left > 0:
+                self._held[key] = left
+                return
+            if self._held.pop(key, None) is None or not self.connected:
+                return  # not ours, or the session (and with it the lock) is already gone
+            try:
+                await self._conn.fetchval("SELECT pg_advisory_unlock($1::bigint)", key)
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print(f"⚠️ couldn't release advisory lock {key}: {e!r}")
+
+    def retain(self, key: int):
+        # one more local holder of a lock this process already has (no query)
+        self._held[key] += 1
+
+    def holds(self, key: int) -> bool:
+        return key in self._held
+
+    # ---------- events ----------
+    async def publish(self, kind: str, conn=None, **data):
+        """NOTIFY the other processes. Pass `conn` to send it with that connection's transaction."""
+        if not self._started:
+            return
+        if conn is not None:
+            await notify(conn, kind, self.instance, **data)
+        else:
+            async with self._pool().acquire() as conn:
+                await notify(conn, kind, self.instance, **data)
+        self.published += 1
+
+    def publish_soon(self, kind: str, **data):
+        # fire-and-forget, for events nobody should wait on
+        if self._started:
+            self._spawn(self.publish(kind, **data))
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get("from") == self.instance:
+            return
+        self.received += 1
+        self._dispatch(event)
+
+    def _dispatch(self, event: dict):
+        for handler in self._handlers.get(event.get("kind"), ()):
+            try:
+                result = handler(event)
+            except Exception as e:
+                print(f"⚠️ cluster event handler failed: {e!r}")
+                continue
+            if asyncio.iscoroutine(result):
+                self._spawn(result)
@@ -0,0 +1,98 @@
+"""Per-guild settings, cached in memory.
+
+Each server the bot plays in can have a guild_config row: its announce / work / roulette
+channels, one career role per CAREER_PATH tier, and odds overrides. Every row is loaded at
+startup and served from a dict, so commands never query for their config. Changes go
+through update(), which writes the row and swaps the cached object in one step; refresh()
+re-reads a row that was changed somewhere else. Guilds without a row get an empty config
+(commands work in any channel, nothing is announced, no career roles are handed out).
+"""
+import json
+
+_COLUMNS = "guild_id, announce_channel_id, work_channel_id, roulette_channel_ids, career_role_ids, odds"
+
+
+class GuildConfig:
+    __slots__ = ("guild_id", "announce_channel_id", "work_channel_id", "roulette_channel_ids",
+                 "career_role_ids", "managed_role_ids", "odds")
+
+    def __init__(self, guild_id: int, announce_channel_id: int | None = None, work_channel_id: int | None = None,
+                 roulette_channel_ids=(), career_role_ids=(), odds: dict | None = None):
+        self.guild_id = guild_id
+        self.announce_channel_id = announce_channel_id
+        self.work_channel_id = work_channel_id
+        self.roulette_channel_ids = frozenset(roulette_channel_ids)
+        # tier index -> role id (0 = not set), in CAREER_PATH order
+        self.career_role_ids = tuple(career_role_ids)
+        self.managed_role_ids = frozenset(r for r in self.career_role_ids if r)
+        self.odds = dict(odds or {})
+
+    @classmethod
+    def from_row(cls, row) -> "GuildConfig":
+        odds = row["odds"]
+        return cls(
+            row["guild_id"], row["announce_channel_id"], row["work_channel_id"],
+            row["roulette_channel_ids"] or (), row["career_role_ids"] or (),
+            json.loads(odds) if isinstance(odds, str) else odds,
+        )
+
+    def career_role(self, tier: int) -> int | None:
+        if 0 <= tier < len(self.career_role_ids):
+            return self.career_role_ids[tier] or None
+        return None
+
+
+class GuildConfigCache:
+    def __init__(self, pool_getter):
+        self._pool = pool_getter  # the bot creates its pool late, so look it up per use
+        self._configs: dict[int, GuildConfig] = {}
+
+    def __len__(self):
+        return len(self._configs)
+
+    def get(self, guild_id: int) -> GuildConfig:
+        cfg = self._configs.get(guild_id)
+        if cfg is None:
+            cfg = self._configs[guild_id] = GuildConfig(guild_id)
+        return cfg
+
+    async def load_all(self) -> int:
+        async with self._pool().acquire() as conn:
+            rows = await conn.fetch(f"SELECT {_COLUMNS} FROM guild_config")
+        self._configs = {r["guild_id"]: GuildConfig.from_row(r) for r in rows}
+        return len(rows)
+
+    async def refresh(self, guild_id: int) -> GuildConfig:
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow(f"SELECT {_COLUMNS} FROM guild_config WHERE guild_id=$1", guild_id)
+        cfg = self._configs[guild_id] = GuildConfig.from_row(row) if row else GuildConfig(guild_id)
+        return cfg
+
+    async def update(self, guild_id: int, **changes) -> GuildConfig:
+        """Write `changes` (column=value; odds is a full dict) and return the new cached config."""
+        cur = self.get(guild_id)
+        values = {
+            "announce_channel_id": cur.announce_channel_id,
+            "work_channel_id": cur.work_channel_id,
+            "roulette_channel_ids": sorted(cur.roulette_channel_ids),
+            "career_role_ids": list(cur.career_role_ids),
+            "odds": cur.odds,
+        }
+        unknown = set(changes) - set(values)
+        if unknown:
+            raise TypeError(f"unknown guild config fields: {sorted(unknown)}")
+        values.update(changes)
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow(f"""
+                INSERT INTO guild_config
+                  (guild_id, announce_channel_id, work_channel_id, roulette_channel_ids, career_role_ids, odds)
+                VALUES ($1, $2, $3, $4, $5, $6::jsonb)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                  announce_channel_id=EXCLUDED.announce_channel_id, work_channel_id=EXCLUDED.work_channel_id,
+                  roulette_channel_ids=EXCLUDED.roulette_channel_ids, career_role_ids=EXCLUDED.career_role_ids,
+                  odds=EXCLUDED.odds, updated_at=now()
+                RETURNING {_COLUMNS}
+            """, guild_id, values["announce_channel_id"], values["work_channel_id"],
+                list(values["roulette_channel_ids"]), list(values["career_role_ids"]), json.dumps(values["odds"]))
+        cfg = self._configs[guild_id] = GuildConfig.from_row(row)
+        return cfg
@@ -0,0 +1,170 @@
+"""Append-only money ledger.
+
+Every balance change is recorded as (when, guild, user, delta, balance after, reason,
+detail) in `ledger`, a table range-partitioned by month so old months can be detached or
+dropped whole and reads for a recent window only touch recent partitions. Commands don't
+write it themselves: record() appends to an in-memory buffer and a background task COPYs
+the buffer in batches, so /work pays no extra round trip.
+"""
+import asyncio
+from datetime import datetime, timezone
+
+REASONS = ("work", "tip", "coinflip", "roulette", "pay", "fish", "alcohol", "reset", "import")
+LEDGER_COLUMNS = ("created_at", "guild_id", "user_id", "delta", "balance", "reason", "detail")
+PARTITIONS_AHEAD = 2  # months created past the current one, so a rollover never lands nowhere
+
+# schema v3 (guild_id and its index came in v5, see bot.py MIGRATIONS)
+CREATE_LEDGER_SQL = """
+    CREATE TABLE IF NOT EXISTS ledger (
+        id BIGINT GENERATED ALWAYS AS IDENTITY,
+        created_at TIMESTAMPTZ NOT NULL,
+        user_id BIGINT NOT NULL,
+        delta DOUBLE PRECISION NOT NULL,
+        balance DOUBLE PRECISION,
+        reason TEXT NOT NULL,
+        detail TEXT,
+        PRIMARY KEY (created_at, id)
+    ) PARTITION BY RANGE (created_at)
+"""
+CREATE_LEDGER_INDEX_SQL = "CREATE INDEX IF NOT EXISTS ledger_user_idx ON ledger (user_id, created_at DESC, id DESC)"
+# /history walks this backwards: (guild, user, newest first), resuming from the last row shown
+CREATE_LEDGER_GUILD_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS ledger_guild_user_idx ON ledger (guild_id, user_id, created_at DESC, id DESC)"
+)
+
+# bulk resets log one row per non-zero wallet straight from SQL, in the caller's transaction
+RESET_ALL_SQL = """
+    INSERT INTO ledger (created_at, guild_id, user_id, delta, balance, reason, detail)
+    SELECT now(), guild_id, user_id, -balance, 0, 'reset', 'all' FROM balances
+    WHERE guild_id=$1 AND balance <> 0
+"""
+# so do imports (state_io.import_state), from the rows staged in _stage_balances before they're
+# merged: one row per wallet the import changes. $2 is True for --replace, which zeroes the rest
+IMPORT_SQL = """
+    INSERT INTO ledger (created_at, guild_id, user_id, delta, balance, reason, detail)
+    SELECT now(), $1, user_id, new - old, new, 'import', CASE WHEN $2 THEN 'replace' ELSE 'merge' END
+    FROM (
+        SELECT user_id, COALESCE(b.balance, 0) AS old,
+               COALESCE(s.balance, CASE WHEN $2 THEN 0 ELSE b.balance END) AS new
+        FROM _stage_balances s
+        FULL JOIN (SELECT user_id, balance FROM balances WHERE guild_id=$1) b USING (user_id)
+    ) d
+    WHERE new <> old
+"""
+
+
+def _month_start(year: int, month: int) -> datetime:
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def partition_ddl(year: int, month: int) -> str:
+    lo, hi = _month_start(year, month), _month_start(year, month + 1)
+    return (
+        f"CREATE TABLE IF NOT EXISTS ledger_{lo:%Y_%m} PARTITION OF ledger "
+        f"FOR VALUES FROM ('{lo.isoformat()}') TO ('{hi.isoformat()}')"
+    )
+
+
+async def ensure_partitions(conn, now: datetime | None = None, ahead: int = PARTITIONS_AHEAD):
+    now = now or datetime.now(timezone.utc)
+    for i in range(ahead + 1):
+        await conn.execute(partition_ddl(now.year, now.month + i))
+
+
+async def fetch_page(conn, gid: int, uid: int, limit: int, before: tuple | None = None,
+                     reason: str | None = None):
+    # keyset page, newest first; `before` is (created_at, id) of the last row already shown
+    args = [gid, uid, limit]
+    where = "guild_id=$1 AND user_id=$2"
+    if reason:
+        args.append(reason)
+        where += f" AND reason=${len(args)}"
+    if before:
+        args += list(before)
+        where += f" AND (created_at, id) < (${len(args) - 1}, ${len(args)})"
+    return await conn.fetch(f"""
+        SELECT id, created_at, delta, balance, reason, detail FROM ledger
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT $3
+    """, *args)
+
+
+class LedgerWriter:
+    def __init__(self, pool_fn, batch_rows: int = 1000, flush_interval: float = 1.0,
+                 max_buffer: int = 200_000):
+        self.pool_fn = pool_fn  # the pool is created after the bot module loads
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: list[tuple] = []
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._month = None  # (year, month) partitions were last ensured for
+        self._task = None
+        self.written = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, gid: int, uid: int, delta: float, balance: float | None, reason: str, detail=None):
+        if not delta:
+            return
+        if len(self._buffer) >= self.max_buffer:
+            # the DB has been unreachable for a long while; keep memory bounded
+            if not self.dropped:
+                print(f"⚠️ ledger buffer full ({self.max_buffer:,} entries), dropping new entries until it drains")
+            self.dropped += 1
+            return
+        self._buffer.append((
+            datetime.now(timezone.utc), int(gid), int(uid), float(delta),
+            None if balance is None else float(balance), reason,
+            None if detail is None else str(detail),
+        ))
+        if len(self._buffer) >= self.batch_rows:
+            self._wake.set()
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"⚠️ ledger flush failed, will retry: {e!r}")
+                await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> int:
+        async with self._lock:
+            if not self._buffer and self._month is not None:
+                return 0
+            rows, self._buffer = self._buffer, []
+            now = datetime.now(timezone.utc)
+            try:
+                async with self.pool_fn().acquire() as conn:
+                    if self._month != (now.year, now.month):
+                        await ensure_partitions(conn, now)
+                        self._month = (now.year, now.month)
+                    if rows:
+                        await conn.copy_records_to_table("ledger", records=rows, columns=LEDGER_COLUMNS)
+            except BaseException:
+                self._buffer[:0] = rows  # keep order; retried on the next tick
+                raise
+            self.written += len(rows)
+            return len(rows)
@@ -0,0 +1,187 @@
+"""In-process latency histograms, counters and gauges, with a Prometheus text endpoint.
+
+Everything is plain Python on the event loop (no locks, no client library). Histograms use
+fixed geometric buckets for the Prometheus export (observing is a bisect), and also keep
+the most recent samples so /perf can show exact p50/p95/p99 over recent traffic.
+"""
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from aiohttp import web
+
+# 0.5 ms .. ~65 s, each bucket 1.5x the last
+LATENCY_BUCKETS = tuple(round(0.0005 * 1.5 ** i, 6) for i in range(30))
+RECENT_SAMPLES = 1024
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "count", "sum", "recent")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def quantiles(self, *qs: float) -> list[float]:
+        # exact, over the last RECENT_SAMPLES observations
+        if not self.recent:
+            return [0.0 for _ in qs]
+        data = sorted(self.recent)
+        return [data[min(len(data) - 1, int(q * len(data)))] for q in qs]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict, le: str | None = None) -> str:
+    parts = [f'{k}="{_escape(v)}"' for k, v in labels.items()]
+    if le is not None:
+        parts.append(f'le="{le}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Metrics:
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self._help: dict[str, tuple[str, str]] = {}   # name -> (type, help)
+        self._hist: dict[str, dict[tuple, Histogram]] = {}
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, object] = {}         # name -> fn() -> {labels tuple: value} | float
+
+    # ---------- declaring ----------
+    def histogram(self, name: str, help: str):
+        self._help[name] = ("histogram", help)
+        self._hist.setdefault(name, {})
+
+    def counter(self, name: str, help: str):
+        self._help[name] = ("counter", help)
+        self._counters.setdefault(name, {})
+
+    def gauge(self, name: str, help: str, fn):
+        self._help[name] = ("gauge", help)
+        self._gauges[name] = fn
+
+    # ---------- recording ----------
+    def observe(self, name: str, value: float, **labels):
+        key = tuple(labels.items())
+        series = self._hist[name]
+        hist = series.get(key)
+        if hist is None:
+            hist = series[key] = Histogram()
+        hist.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        series = self._counters[name]
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + amount
+
+    def timed(self, name: str, errors: str | None = None, **labels):
+        """Decorator for coroutines: observe their duration, count exceptions in `errors`."""
+        def deco(fn):
+            @wraps(fn)
+            async def wrapper(*args, **kwargs):
+                t0 = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                except Exception:
+                    if errors:
+                        self.inc(errors, **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - t0, **labels)
+            return wrapper
+        return deco
+
+    # ---------- reading ----------
+    def series(self, name: str) -> dict[tuple, Histogram]:
+        return self._hist.get(name, {})
+
+    def count(self, name: str, **labels) -> float:
+        return self._counters.get(name, {}).get(tuple(labels.items()), 0)
+
+    def total(self, name: str) -> float:
+        # a counter summed over all its labels
+        return sum(self._counters.get(name, {}).values())
+
+    def render(self) -> str:
+        out = []
+        for name, (kind, help) in self._help.items():
+            full = f"{self.namespace}_{name}"
+            out.append(f"# HELP {full} {help}")
+            out.append(f"# TYPE {full} {kind}")
+            if kind == "histogram":
+                for key, h in self._hist[name].items():
+                    labels = dict(key)
+                    cum = 0
+                    for bound, n in zip(h.bounds, h.counts):
+                        cum += n
+                        out.append(f"{full}_bucket{_labels(labels, bound)} {cum}")
+                    out.append(f"{full}_bucket{_labels(labels, '+Inf')} {h.count}")
+                    out.append(f"{full}_sum{_labels(labels)} {h.sum}")
+                    out.append(f"{full}_count{_labels(labels)} {h.count}")
+            elif kind == "counter":
+                for key, v in self._counters[name].items():
+                    out.append(f"{full}{_labels(dict(key))} {v}")
+            else:
+                value = self._gauges[name]()
+                if isinstance(value, dict):
+                    for key, v in value.items():
+                        out.append(f"{full}{_labels(dict(key))} {v}")
+                else:
+                    out.append(f"{full} {value}")
+        return "\n".join(out) + "\n"
+
+    # ---------- HTTP ----------
+    async def serve(self, host: str, port: int) -> web.AppRunner:
+        async def handle(_request):
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8",
+                                headers={"X-Prometheus-Format": "0.0.4"})
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+class InstrumentedPool:
+    """asyncpg pool proxy that records how long acquire() waited and how many callers are queued."""
+
+    def __init__(self, pool, metrics: Metrics):
+        self._pool = pool
+        self._metrics = metrics
+        self.waiting = 0
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    @asynccontextmanager
+    async def acquire(self, *, timeout=None):
+        t0 = time.perf_counter()
+        self.waiting += 1
+        try:
+            conn = await self._pool.acquire(timeout=timeout)
+        finally:
+            self.waiting -= 1
+            self._metrics.observe("db_pool_wait_seconds", time.perf_counter() - t0)
+        try:
+            yield conn
+        finally:
+            await self._pool.release(conn)
+
+    def utilisation(self) -> dict:
+        size, idle = self._pool.get_size(), self._pool.get_idle_size()
+        return {"max": self._pool.get_max_size(), "open": size, "in_use": size - idle, "waiting": self.waiting}
@@ -0,0 +1,56 @@
+"""Versioned schema migrations.
+
+The bot lists its schema as ordered (version, description, fn(conn)) steps. migrate()
+reads the highest applied version from `schema_version` and, when that's already the
+latest, returns after that single query. Otherwise it opens one transaction, takes a
+transaction-level advisory lock (two processes starting together won't both migrate),
+re-checks, and applies every missing step, recording each as it goes; they all commit
+or roll back together. A transaction-level lock is released by the commit on the same
+server session that took it, so this is safe behind PgBouncer in transaction mode too.
+"""
+import asyncpg
+
+# pg_advisory_xact_lock key for "someone is migrating"; any constant unique to this app
+MIGRATION_LOCK_KEY = 0x65636F6E  # "econ"
+
+CREATE_SCHEMA_VERSION_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+"""
+
+
+async def current_version(conn) -> int:
+    try:
+        return int(await conn.fetchval("SELECT max(version) FROM schema_version") or 0)
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def migrate(pool, steps) -> list[int]:
+    """Bring the schema up to the last of `steps`; returns the versions applied (usually none)."""
+    versions = [v for v, _, _ in steps]
+    if versions != sorted(set(versions)):
+        raise ValueError(f"migration versions must be unique and increasing: {versions}")
+    target = versions[-1] if versions else 0
+
+    async with pool.acquire() as conn:
+        if await current_version(conn) >= target:
+            return []
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_KEY)
+            await conn.execute(CREATE_SCHEMA_VERSION_SQL)
+            done = await current_version(conn)  # another process may have just finished
+            applied = []
+            for version, description, fn in steps:
+                if version <= done:
+                    continue
+                await fn(conn)
+                await conn.execute(
+                    "INSERT INTO schema_version (version, description) VALUES ($1, $2)",
+                    version, description,
+                )
+                applied.append(version)
+        return applied
@@ -0,0 +1,55 @@
+"""In-memory order-statistics board for the leaderboards.
+
+Scores live in a dict for O(1) lookups and in a SortedList keyed (-score, user_id), so
+updates and rank lookups are O(log n) and a page is a slice.
+"""
+from sortedcontainers import SortedList
+
+
+class Ranking:
+    def __init__(self):
+        self._scores = {}
+        self._order = SortedList()
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, uid: int):
+        return uid in self._scores
+
+    def update(self, uid: int, score):
+        old = self._scores.get(uid)
+        if old == score:
+            return
+        if old is not None:
+            self._order.remove((-old, uid))
+        self._scores[uid] = score
+        self._order.add((-score, uid))
+
+    def remove(self, uid: int):
+        old = self._scores.pop(uid, None)
+        if old is not None:
+            self._order.remove((-old, uid))
+
+    def replace(self, items):
+        # bulk (re)build from (uid, score) pairs
+        self._scores = dict(items)
+        self._order = SortedList((-score, uid) for uid, score in self._scores.items())
+
+    def score(self, uid: int):
+        return self._scores.get(uid)
+
+    def rank(self, uid: int) -> int | None:
+        score = self._scores.get(uid)
+        if score is None:
+            return None
+        return self._order.index((-score, uid)) + 1
+
+    def top(self, limit: int, offset: int = 0) -> list:
+        return [(uid, -neg) for neg, uid in self._order[offset:offset + limit]]
+
+    def page(self, page: int, per_page: int = 10) -> list:
+        return self.top(per_page, (page - 1) * per_page)
+
+    def page_count(self, per_page: int = 10) -> int:
+        return max(1, -(-len(self._scores) // per_page))
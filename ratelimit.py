@@ -0,0 +1,133 @@
+"""Per-user rate limits for commands.
+
+Every limited command gets a token bucket per (command, guild, user): `burst` tokens that
+refill evenly over `per` seconds, one spent per use. Checking one is a dict lookup and some
+arithmetic, so abusive traffic is turned away before a handler (and its queries) ever runs.
+Buckets live in memory only: short limits are meant to soak up bursts and losing them on a
+restart costs nothing. Full buckets are swept out every so often to keep memory bounded.
+
+Long cooldowns (the 6h alcohol one) must survive restarts, so they are Cooldowns instead: the
+deadline is kept in a table column (unix seconds) that the bot already writes, and mirrored in
+memory here so that asking about it needs no query either.
+"""
+import time
+
+from discord import app_commands
+
+SWEEP_EVERY = 10_000  # hits between sweeps of buckets that have refilled completely
+
+
+class Limit:
+    __slots__ = ("burst", "per", "rate")
+
+    def __init__(self, burst: int, per: float):
+        self.burst = burst
+        self.per = per
+        self.rate = burst / per  # tokens regained per second
+
+
+class Cooldown:
+    __slots__ = ("name", "table", "column")
+
+    def __init__(self, name: str, table: str, column: str):
+        self.name = name
+        self.table = table    # keyed by (guild_id, user_id)
+        self.column = column  # unix seconds the cooldown runs until
+
+
+class RateLimited(app_commands.CheckFailure):
+    def __init__(self, command: str, retry_after: float):
+        self.command = command
+        self.retry_after = retry_after
+        super().__init__(f"/{command} is rate limited for another {retry_after:.1f}s")
+
+
+class RateLimiter:
+    def __init__(self, pool_getter, cooldowns=()):
+        self._pool = pool_getter  # the bot creates its pool late, so look it up per use
+        self.cooldowns = {c.name: c for c in cooldowns}
+        self._buckets: dict[tuple, list] = {}  # (name, gid, uid) -> [tokens, monotonic stamp, limit]
+        self._until: dict[tuple, int] = {}     # (name, gid, uid) -> unix deadline, only while it's in the future
+        self._hits = 0
+        self.rejected = 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    # ---------- token buckets ----------
+    def hit(self, name: str, gid: int, uid: int, limit: Limit) -> float:
+        """Spend a token: 0.0 if allowed, otherwise seconds until one is available."""
+        now = time.monotonic()
+        key = (name, gid, uid)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.burst), now, limit]
+        else:
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        self._hits += 1
+        if self._hits >= SWEEP_EVERY:
+            self._sweep(now)
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return 0.0
+        self.rejected += 1
+        return (1.0 - bucket[0]) / limit.rate
+
+    def _sweep(self, now: float):
+        self._hits = 0
+        full = [key for key, (tokens, stamp, limit) in self._buckets.items()
+                if tokens + (now - stamp) * limit.rate >= limit.burst]
+        for key in full:
+            del self._buckets[key]
+
+    def check(self, name: str, burst: int, per: float):
+        """Decorator for any bot.tree.command: /name allows `burst` uses per `per` seconds per user."""
+        limit = Limit(burst, per)
+
+        def predicate(interaction) -> bool:
+            retry_after = self.hit(name, interaction.guild_id, interaction.user.id, limit)
+            if retry_after:
+                raise RateLimited(name, retry_after)
+            return True
+        return app_commands.check(predicate)
+
+    # ---------- persisted cooldowns ----------
+    def cooldown_left(self, name: str, gid: int, uid: int) -> int:
+        key = (name, gid, uid)
+        until = self._until.get(key)
+        if until is None:
+            return 0
+        left = until - int(time.time())
+        if left <= 0:
+            del self._until[key]
+            return 0
+        return left
+
+    def set_cooldown(self, name: str, gid: int, uid: int, until: int):
+        # mirror a committed write of the cooldown's column
+        if until > time.time():
+            self._until[(name, gid, uid)] = int(until)
+        else:
+            self._until.pop((name, gid, uid), None)
+
+    async def load(self, gid: int | None = None) -> int:
+        """(Re)read running cooldowns from their tables, for one guild or all of them."""
+        now = int(time.time())
+        loaded = {}
+        async with self._pool().acquire() as conn:
+            for c in self.cooldowns.values():
+                where, args = f"{c.column} > $1", [now]
+                if gid is not None:
+                    args.append(gid)
+                    where += " AND guild_id=$2"
+                for r in await conn.fetch(
+                    f"SELECT guild_id, user_id, {c.column} AS until FROM {c.table} WHERE {where}", *args
+                ):
+                    loaded[(c.name, r["guild_id"], r["user_id"])] = int(r["until"])
+        if gid is None:
+            self._until = loaded
+        else:
+            self._until = {k: v for k, v in self._until.items() if k[1] != gid}
+            self._until.update(loaded)
+        return len(loaded)
@@ -0,0 +1,336 @@
+"""Background career-role updates.
+
+/work only decides *that* a member should now hold a role; the Discord calls happen here,
+after the response has gone out. Requests are coalesced per member (the newest target
+wins), applied as a diff (remove stale career roles, add the new one), and retried with
+backoff on transient failures. One worker keeps us to a steady trickle of role calls, and
+discord.py's HTTP client waits out each route's rate-limit bucket before it would 429.
+
+RoleReconciler is the bulk version for /syncroles: it walks a guild's job_counts in user_id
+order, fixes whoever is off, and checkpoints to Postgres so a restart picks up where it
+stopped. Each guild has its own career roles, so both take a managed_roles(guild_id)
+lookup instead of a fixed set.
+"""
+import asyncio
+import random
+import time
+from collections import OrderedDict
+
+import aiohttp
+import discord
+
+
+def role_diff(member: discord.Member, target_role_id: int | None, managed_role_ids) -> tuple[list, list]:
+    # (roles to remove, roles to add) so the member holds exactly target_role_id out of managed_role_ids
+    remove = [r for r in member.roles if r.id in managed_role_ids and r.id != target_role_id]
+    add = []
+    if target_role_id is not None and member.get_role(target_role_id) is None:
+        role = member.guild.get_role(target_role_id)
+        if role is not None:
+            add.append(role)
+    return remove, add
+
+
+def is_transient(exc: BaseException) -> bool:
+    if isinstance(exc, discord.RateLimited):
+        return True
+    if isinstance(exc, (discord.Forbidden, discord.NotFound)):
+        return False
+    if isinstance(exc, discord.HTTPException):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(exc, (aiohttp.ClientError, asyncio.TimeoutError, OSError))
+
+
+def backoff_delay(attempt: int, base: float = 2.0, cap: float = 120.0) -> float:
+    return min(cap, base * 2 ** attempt) * random.uniform(0.8, 1.2)
+
+
+async def resolve_member(guild: discord.Guild, user_id: int) -> discord.Member | None:
+    # cache first; only hit REST when the member list isn't fully cached
+    member = guild.get_member(user_id)
+    if member is not None or guild.chunked:
+        return member
+    try:
+        return await guild.fetch_member(user_id)
+    except discord.NotFound:
+        return None
+
+
+async def apply_diff(member: discord.Member, target_role_id: int | None, managed_role_ids,
+                     reason: str | None = None) -> bool:
+    remove, add = role_diff(member, target_role_id, managed_role_ids)
+    if remove:
+        await member.remove_roles(*remove, reason=reason)
+    if add:
+        await member.add_roles(*add, reason=reason)
+    return bool(remove or add)
+
+
+async def apply_role(guild: discord.Guild, user_id: int, target_role_id: int | None, managed_role_ids,
+                     reason: str | None = None) -> bool:
+    # one member's diff; False when there was nothing to do or they've left the guild
+    member = await resolve_member(guild, user_id)
+    if member is None:
+        return False
+    return await apply_diff(member, target_role_id, managed_role_ids, reason)
+
+
+class RoleSyncQueue:
+    def __init__(self, client: discord.Client, managed_roles, spacing: float = 0.25,
+                 max_attempts: int = 5, backoff: float = 2.0, max_backoff: float = 120.0):
+        self.client = client
+        self.managed_roles = managed_roles  # guild_id -> frozenset of career role ids
+        self.spacing = spacing
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # (guild_id, user_id) -> (target_role_id, reason, attempt)
+        self._pending: "OrderedDict[tuple[int, int], tuple]" = OrderedDict()
+        self._wake = asyncio.Event()
+        self._task = None
+        self.applied = 0
+        self.failed = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def request(self, guild_id: int, user_id: int, target_role_id: int | None, reason: str | None = None):
+        self._push((guild_id, user_id), (target_role_id, reason, 0))
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def _push(self, key, item):
+        self._pending.pop(key, None)
+        self._pending[key] = item
+        self._wake.set()
+
+    def _retry(self, key, item):
+        # a newer request for the same member supersedes the retry
+        if key not in self._pending:
+            self._push(key, item)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            if not self._pending:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            key, item = self._pending.popitem(last=False)
+            await self._apply(key, item)
+            await asyncio.sleep(self.spacing)
+
+    async def _apply(self, key, item):
+        guild_id, user_id = key
+        target, reason, attempt = item
+        guild = self.client.get_guild(guild_id)
+        if guild is None:
+            return
+        try:
+            if await apply_role(guild, user_id, target, self.managed_roles(guild_id), reason):
+                self.applied += 1
+        except Exception as e:
+            if is_transient(e) and attempt + 1 < self.max_attempts:
+                delay = backoff_delay(attempt, self.backoff, self.max_backoff)
+                asyncio.get_running_loop().call_later(delay, self._retry, key, (target, reason, attempt + 1))
+            else:
+                self.failed += 1
+                print(f"⚠️ career role sync gave up on {user_id} in {guild_id}: {e!r}")
+
+
+# ---------- bulk reconciliation ----------
+RECONCILE_PAGE = 1000  # job_counts rows per keyset page (and per checkpoint)
+
+
+class RoleReconciler:
+    """Resumable per-guild sweeps that put every member on the career role their total earns.
+
+    Progress lives in the career_role_sync table (created by init_db). Phase "jobs" walks
+    job_counts by user_id and checkpoints after each page; phase "holders" then clears
+    career roles from cached members who have no jobs on record (e.g. after /resetall).
+    """
+
+    def __init__(self, client: discord.Client, pool_getter, target_for_total, managed_roles,
+                 spacing: float = 0.2, max_attempts: int = 5, report_every: float = 15.0):
+        self.client = client
+        self._pool = pool_getter  # the bot creates its pool late, so look it up per use
+        self.target_for_total = target_for_total  # (guild_id, total_jobs) -> role id | None
+        self.managed_roles = managed_roles        # guild_id -> frozenset of career role ids
+        self.spacing = spacing
+        self.max_attempts = max_attempts
+        self.report_every = report_every
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def running(self, guild_id: int) -> bool:
+        task = self._tasks.get(guild_id)
+        return task is not None and not task.done()
+
+    async def status(self, guild_id: int) -> dict | None:
+        async with self._pool().acquire() as conn:
+            row = await conn.fetchrow("SELECT * FROM career_role_sync WHERE guild_id=$1", guild_id)
+        return dict(row) if row else None
+
+    async def start(self, guild: discord.Guild, channel: discord.abc.Messageable) -> bool:
+        # False if a sweep is already running for this guild
+        if self.running(guild.id):
+            return False
+        now = int(time.time())
+        message = await channel.send(f"🔄 Career role sync starting for **{guild.name}**…")
+        async with self._pool().acquire() as conn:
+            await conn.execute("""
+                INSERT INTO career_role_sync
+                  (guild_id, status, phase, last_user_id, checked, changed, missing, failed,
+                   channel_id, message_id, started_at, updated_at)
+                VALUES ($1, 'running', 'jobs', 0, 0, 0, 0, 0, $2, $3, $4, $4)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                  status='running', phase='jobs', last_user_id=0, checked=0, changed=0, missing=0, failed=0,
+                  channel_id=EXCLUDED.channel_id, message_id=EXCLUDED.message_id,
+                  started_at=EXCLUDED.started_at, updated_at=EXCLUDED.updated_at
+            """, guild.id, message.channel.id, message.id, now)
+        self._spawn(guild.id)
+        return True
+
+    async def cancel(self, guild_id: int) -> bool:
+        task = self._tasks.pop(guild_id, None)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        async with self._pool().acquire() as conn:
+            await conn.execute(
+                "UPDATE career_role_sync SET status='cancelled', updated_at=$2 WHERE guild_id=$1",
+                guild_id, int(time.time())
+            )
+        return True
+
+    async def resume_all(self) -> int:
+        # after a restart: carry on with every sweep that was still running in one of our guilds
+        # (with several processes, the others resume theirs)
+        async with self._pool().acquire() as conn:
+            rows = await conn.fetch("SELECT guild_id FROM career_role_sync WHERE status='running'")
+        resumed = 0
+        for r in rows:
+            if self.client.get_guild(r["guild_id"]) is not None and not self.running(r["guild_id"]):
+                self._spawn(r["guild_id"])
+                resumed += 1
+        return resumed
+
+    async def close(self):
+        # leave status='running' so the next start resumes from the last checkpoint
+        tasks = [t for t in self._tasks.values() if not t.done()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, guild_id: int):
+        self._tasks[guild_id] = asyncio.create_task(self._run(guild_id))
+
+    async def _save(self, st: dict, **changes):
+        st.update(changes, updated_at=int(time.time()))
+        async with self._pool().acquire() as conn:
+            await conn.execute("""
+                UPDATE career_role_sync SET status=$2, phase=$3, last_user_id=$4, checked=$5, changed=$6,
+                  missing=$7, failed=$8, updated_at=$9
+                WHERE guild_id=$1
+            """, st["guild_id"], st["status"], st["phase"], st["last_user_id"], st["checked"], st["changed"],
+                st["missing"], st["failed"], st["updated_at"])
+
+    async def _report(self, st: dict):
+        channel = self.client.get_channel(st["channel_id"])
+        if channel is None or not st["message_id"]:
+            return
+        icon = {"running": "🔄", "done": "✅", "cancelled": "🛑", "failed": "❌"}.get(st["status"], "🔄")
+        where = "members with jobs" if st["phase"] == "jobs" else "leftover role holders"
+        text = (
+            f"{icon} Career role sync **{st['status']}** ({where})\n"
+            f"checked {st['checked']:,} · changed {st['changed']:,} · not in server {st['missing']:,}"
+            f" · failed {st['failed']:,} · {int(st['updated_at'] - st['started_at'])}s"
+        )
+        try:
+            await channel.get_partial_message(st["message_id"]).edit(content=text)
+        except discord.HTTPException:
+            pass  # progress is best effort; the table has the real numbers
+
+    async def _fix(self, guild: discord.Guild, user_id: int, target_role_id: int | None) -> str:
+        # "same" / "changed" / "missing" / "failed"; retries transient errors in place
+        member = await resolve_member(guild, user_id)
+        if member is None:
+            return "missing"
+        for attempt in range(self.max_attempts):
+            try:
+                if not await apply_diff(member, target_role_id, self.managed_roles(guild.id),
+                                        reason="career role sync"):
+                    return "same"
+                await asyncio.sleep(self.spacing)
+                return "changed"
+            except Exception as e:
+                if not is_transient(e) or attempt + 1 == self.max_attempts:
+                    print(f"⚠️ career role sync failed for {user_id} in {guild.id}: {e!r}")
+                    return "failed"
+                await asyncio.sleep(backoff_delay(attempt))
+        return "failed"
+
+    def _count(self, st: dict, outcome: str):
+        st["checked"] += 1
+        if outcome != "same":
+            st[outcome] += 1
+
+    async def _run(self, guild_id: int):
+        st = await self.status(guild_id)
+        guild = self.client.get_guild(guild_id)
+        if st is None or guild is None:
+            if st is not None:
+                await self._save(st, status="failed")
+            return
+        try:
+            if self.client.intents.members and not guild.chunked:
+                await guild.chunk()  # one gateway request instead of a REST call per member
+            last_report = time.monotonic()
+
+            if st["phase"] == "jobs":
+                while True:
+                    async with self._pool().acquire() as conn:
+                        rows = await conn.fetch("""
+                            SELECT user_id, total FROM job_counts
+                            WHERE guild_id=$1 AND user_id > $2 ORDER BY user_id LIMIT $3
+                        """, guild_id, st["last_user_id"], RECONCILE_PAGE)
+                    if not rows:
+                        break
+                    for r in rows:
+                        target = self.target_for_total(guild_id, r["total"] or 0)
+                        self._count(st, await self._fix(guild, r["user_id"], target))
+                    await self._save(st, last_user_id=rows[-1]["user_id"])
+                    if time.monotonic() - last_report >= self.report_every:
+                        await self._report(st)
+                        last_report = time.monotonic()
+                await self._save(st, phase="holders")
+
+            # members still wearing a career role with nothing on record
+            managed = self.managed_roles(guild_id)
+            holders = {m.id for rid in managed if (role := guild.get_role(rid)) for m in role.members}
+            if holders:
+                async with self._pool().acquire() as conn:
+                    rows = await conn.fetch("""
+                        SELECT user_id FROM job_counts
+                        WHERE guild_id=$1 AND user_id = ANY($2::bigint[]) AND total > 0
+                    """, guild_id, list(holders))
+                for uid in sorted(holders - {r["user_id"] for r in rows}):
+                    self._count(st, await self._fix(guild, uid, None))
+            await self._save(st, status="done")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️ career role sync for guild {guild_id} stopped: {e!r}")
+            await self._save(st, status="failed")
+        finally:
+            if self._tasks.get(guild_id) is asyncio.current_task():
+                del self._tasks[guild_id]
+        await self._report(st)
@@ -0,0 +1,140 @@
+"""Table-driven roulette engine.
+
+Every bet string is resolved once, at placement, to a row of 38 payout multipliers (one per
+pocket, 0-36 then 00). Settling a bet is then a single list lookup, and a round is O(bets).
+Tables are independent and keyed by channel, so several rounds can run at once.
+"""
+import random
+
+POCKETS = [str(n) for n in range(37)] + ["00"]
+DOUBLE_ZERO = 37
+
+RED_NUMBERS = frozenset({1, 3, 5, 7, 9, 12, 14, 16, 18, 19, 21, 23, 25, 27, 30, 32, 34, 36})
+BLACK_NUMBERS = frozenset({2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35})
+
+VALID_BETS = ["red", "black", "green", "odd", "even", "1-18", "19-36", "1st12", "2nd12", "3rd12"] + POCKETS
+COLOR_BETS = frozenset({"red", "black"})
+
+
+def pocket_color(pocket: int) -> str:
+    if pocket in RED_NUMBERS:
+        return "red"
+    if pocket in BLACK_NUMBERS:
+        return "black"
+    return "green"
+
+
+POCKET_COLORS = [pocket_color(p) for p in range(len(POCKETS))]
+
+
+def _multiplier(bet: str, pocket: int) -> float:
+    # best payout a bet earns on a pocket, 0 for a loss (the wager was already taken)
+    n = pocket if pocket != DOUBLE_ZERO else None
+    color = POCKET_COLORS[pocket]
+    best = 0.0
+    if bet == POCKETS[pocket]:
+        best = 35.0
+    if bet in COLOR_BETS and bet == color:
+        best = max(best, 2.0)
+    if bet == "green" and color == "green":
+        best = max(best, 35.0)
+    if n:  # 0 and 00 lose every outside bet
+        outside = {
+            "odd": n % 2 == 1, "even": n % 2 == 0,
+            "1-18": n <= 18, "19-36": n >= 19,
+            "1st12": n <= 12, "2nd12": 13 <= n <= 24, "3rd12": n >= 25,
+        }
+        if outside.get(bet):
+            best = max(best, 3.0 if bet.endswith("12") else 2.0)
+    return best
+
+
+PAYOUTS = {bet: tuple(_multiplier(bet, p) for p in range(len(POCKETS))) for bet in VALID_BETS}
+
+
+def spin(rng=random) -> int:
+    return rng.randrange(len(POCKETS))
+
+
+class Bet:
+    __slots__ = ("user_id", "bet", "amount", "boosted", "row")
+
+    def __init__(self, user_id: int, bet: str, amount: float, boosted: bool = False):
+        self.user_id = user_id
+        self.bet = bet
+        self.amount = amount
+        self.boosted = boosted and bet in COLOR_BETS
+        self.row = PAYOUTS[bet]
+
+
+class BetResult:
+    __slots__ = ("user_id", "bet", "amount", "payout", "salvaged")
+
+    def __init__(self, user_id: int, bet: str, amount: float, payout: float, salvaged: bool):
+        self.user_id = user_id
+        self.bet = bet
+        self.amount = amount
+        self.payout = payout
+        self.salvaged = salvaged
+
+    @property
+    def won(self) -> bool:
+        return self.payout > 0
+
+
+class RouletteTable:
+    def __init__(self, channel_id: int, salvage_chance: float = 0.0, guild_id: int = 0, round_id: int | None = None):
+        self.channel_id = channel_id
+        self.guild_id = guild_id  # whose economy the bets are paid from
+        self.round_id = round_id  # journal key (see roulette_journal), None when not journaled
+        self.salvage_chance = salvage_chance
+        self.bets: list[Bet] = []
+        self.task = None  # the round timer, owned by whoever opened the table
+        self.lock_lost = False  # another process claimed the channel mid-round; see bot.py _on_lock_lost
+
+    def add_bet(self, user_id: int, bet: str, amount: float, boosted: bool = False) -> Bet:
+        placed = Bet(user_id, bet, amount, boosted)
+        self.bets.append(placed)
+        return placed
+
+    def settle(self, pocket: int, rng=random):
+        # returns ([BetResult], {user_id: total_payout}) for the given pocket
+        results = []
+        credits = {}
+        salvage = self.salvage_chance
+        for b in self.bets:
+            payout = b.amount * b.row[pocket]
+            salvaged = False
+            # boosted color bets that lost get a small second chance
+            if not payout and b.boosted and rng.random() < salvage:
+                payout = b.amount * 2
+                salvaged = True
+            if payout:
+                credits[b.user_id] = credits.get(b.user_id, 0.0) + payout
+            results.append(BetResult(b.user_id, b.bet, b.amount, payout, salvaged))
+        return results, credits
+
+
+class TableRegistry:
+    """One open table per channel."""
+
+    def __init__(self, salvage_chance: float = 0.0):
+        self.salvage_chance = salvage_chance
+        self._tables: dict[int, RouletteTable] = {}
+
+    def get(self, channel_id: int) -> RouletteTable | None:
+        return self._tables.get(channel_id)
+
+    def open(self, channel_id: int, guild_id: int = 0, round_id: int | None = None) -> RouletteTable:
+        table = RouletteTable(channel_id, self.salvage_chance, guild_id, round_id)
+        self._tables[channel_id] = table
+        return table
+
+    def close(self, channel_id: int, table: RouletteTable | None = None) -> RouletteTable | None:
+        # with `table`, only close the channel if that's still the table open there
+        if table is not None and self._tables.get(channel_id) is not table:
+            return None
+        return self._tables.pop(channel_id, None)
+
+    def __len__(self):
+        return len(self._tables)
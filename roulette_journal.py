@@ -0,0 +1,186 @@
+"""Durable journal of roulette rounds and their bets.
+
+A wager leaves the wallet as soon as the bet is placed, but the round only settles when its
+timer fires, so an open table has to survive a restart. Each round is a roulette_rounds row
+(keyed by the first bet's interaction id) and each bet a roulette_bets row. Writes are
+group-committed: whatever is queued while a write is in flight goes out together in the next
+one (new rounds, then all their bets in one statement, one transaction), and the bot only
+confirms a bet once the write holding it has committed. A failed write is retried; rows are
+idempotent, so a retry after an unclear commit can't duplicate them.
+
+Settling records the pocket first, then stamps settled_at and pays out in one transaction.
+At startup, unsettled_rounds() finds every round that never settled with one query on a
+partial index; the bot settles those whose pocket was already recorded and refunds the rest.
+"""
+import asyncio
+
+ROUND_RETENTION_DAYS = 7  # settled rounds older than this are pruned at startup (the ledger keeps the money trail)
+
+# schema v6 (see bot.py MIGRATIONS)
+CREATE_ROUNDS_SQL = """
+    CREATE TABLE IF NOT EXISTS roulette_rounds (
+        id BIGINT PRIMARY KEY,
+        guild_id BIGINT NOT NULL,
+        channel_id BIGINT NOT NULL,
+        opened_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        closes_at TIMESTAMPTZ NOT NULL,
+        pocket SMALLINT,
+        settled_at TIMESTAMPTZ,
+        refunded BOOLEAN NOT NULL DEFAULT false
+    )
+"""
+CREATE_BETS_SQL = """
+    CREATE TABLE IF NOT EXISTS roulette_bets (
+        round_id BIGINT NOT NULL REFERENCES roulette_rounds (id) ON DELETE CASCADE,
+        bet_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        bet TEXT NOT NULL,
+        amount DOUBLE PRECISION NOT NULL,
+        boosted BOOLEAN NOT NULL,
+        PRIMARY KEY (round_id, bet_id)
+    )
+"""
+# only unsettled rounds are indexed, so recovery reads a handful of entries however long the history is
+CREATE_UNSETTLED_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS roulette_rounds_unsettled_idx ON roulette_rounds (id) WHERE settled_at IS NULL"
+)
+
+_INSERT_ROUNDS_SQL = """
+    INSERT INTO roulette_rounds (id, guild_id, channel_id, closes_at) VALUES ($1, $2, $3, $4)
+    ON CONFLICT (id) DO NOTHING
+"""
+_INSERT_BETS_SQL = """
+    INSERT INTO roulette_bets (round_id, bet_id, user_id, bet, amount, boosted)
+    SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::bigint[], $4::text[], $5::float8[], $6::bool[])
+    ON CONFLICT (round_id, bet_id) DO NOTHING
+"""
+
+
+async def record_spin(conn, round_id: int, pocket: int):
+    await conn.execute("UPDATE roulette_rounds SET pocket=$2 WHERE id=$1 AND settled_at IS NULL", round_id, pocket)
+
+
+async def mark_settled(conn, round_id: int, refunded: bool = False) -> bool:
+    # False if the round was already settled: pay out in the same transaction only on True,
+    # so retrying a settlement whose commit went unconfirmed can't pay it twice
+    return await conn.fetchval(
+        "UPDATE roulette_rounds SET settled_at=now(), refunded=$2 WHERE id=$1 AND settled_at IS NULL RETURNING true",
+        round_id, refunded,
+    ) is not None
+
+
+async def unsettled_rounds(conn) -> list[dict]:
+    # [{id, guild_id, channel_id, pocket, bets: [(bet_id, user_id, bet, amount, boosted)]}], oldest first
+    rows = await conn.fetch("""
+        SELECT r.id, r.guild_id, r.channel_id, r.pocket, b.bet_id, b.user_id, b.bet, b.amount, b.boosted
+        FROM roulette_rounds r LEFT JOIN roulette_bets b ON b.round_id = r.id
+        WHERE r.settled_at IS NULL
+        ORDER BY r.id, b.bet_id
+    """)
+    rounds = {}
+    for r in rows:
+        rnd = rounds.get(r["id"])
+        if rnd is None:
+            rnd = rounds[r["id"]] = {
+                "id": r["id"], "guild_id": r["guild_id"], "channel_id": r["channel_id"],
+                "pocket": r["pocket"], "bets": [],
+            }
+        if r["bet_id"] is not None:
+            rnd["bets"].append((r["bet_id"], r["user_id"], r["bet"], r["amount"], r["boosted"]))
+    return list(rounds.values())
+
+
+async def prune(conn, days: int = ROUND_RETENTION_DAYS) -> int:
+    status = await conn.execute(
+        "DELETE FROM roulette_rounds WHERE settled_at < now() - make_interval(days => $1)", days
+    )
+    return int(status.split()[-1])
+
+
+class RoundJournal:
+    def __init__(self, pool_fn, retry_delay: float = 1.0):
+        self.pool_fn = pool_fn  # the pool is created after the bot module loads
+        self.retry_delay = retry_delay
+        self._queue: list[tuple] = []  # (kind, row, future | None)
+        self._wake = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        self.rounds_written = 0
+        self.bets_written = 0
+        self.batches = 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def open_round(self, round_id: int, guild_id: int, channel_id: int, closes_at):
+        # queued ahead of the round's first bet, so they always land in the same (or an earlier) write
+        self._push(("round", (round_id, guild_id, channel_id, closes_at), None))
+
+    def add_bet(self, round_id: int, bet_id: int, user_id: int, bet: str, amount: float,
+                boosted: bool) -> asyncio.Future:
+        """Queue a bet; the returned future resolves once it's committed."""
+        fut = asyncio.get_running_loop().create_future()
+        self._push(("bet", (round_id, bet_id, user_id, bet, float(amount), bool(boosted)), fut))
+        return fut
+
+    async def flush(self):
+        # wait until everything queued so far is on disk
+        if self._queue or not self._idle.is_set():
+            fut = asyncio.get_running_loop().create_future()
+            self._push(("barrier", None, fut))
+            await fut
+
+    def _push(self, item):
+        self._queue.append(item)
+        self._idle.clear()
+        self._wake.set()
+        if self._task is None:
+            self.start()
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self.flush(), 5.0)
+            except asyncio.TimeoutError:
+                print(f"⚠️ roulette journal closed with {len(self._queue)} unwritten entries")
+            self._task.cancel()
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            while self._queue:
+                batch, self._queue = self._queue, []
+                try:
+                    await self._write(batch)
+                except Exception as e:
+                    print(f"⚠️ roulette journal write failed, will retry: {e!r}")
+                    self._queue[:0] = batch  # keep order; bets wait for their round row
+                    await asyncio.sleep(self.retry_delay)
+                    continue
+                for _, _, fut in batch:
+                    if fut is not None and not fut.done():
+                        fut.set_result(None)
+            self._idle.set()
+
+    async def _write(self, batch):
+        rounds = [row for kind, row, _ in batch if kind == "round"]
+        bets = [row for kind, row, _ in batch if kind == "bet"]
+        if not rounds and not bets:
+            return
+        async with self.pool_fn().acquire() as conn:
+            async with conn.transaction():
+                if rounds:
+                    await conn.executemany(_INSERT_ROUNDS_SQL, rounds)
+                if bets:
+                    await conn.execute(_INSERT_BETS_SQL, *(list(col) for col in zip(*bets)))
+        self.batches += 1
+        self.rounds_written += len(rounds)
+        self.bets_written += len(bets)
@@ -0,0 +1,70 @@
+"""O(1) weighted sampling (Walker/Vose alias method) for the job, tip and special tables.
+
+Tables are compiled once; each draw is one uniform index plus one coin flip, no matter how
+many outcomes there are.
+"""
+import random
+
+
+class AliasSampler:
+    __slots__ = ("outcomes", "_prob", "_alias", "_n", "_rng")
+
+    def __init__(self, weights, rng=random):
+        # weights: {outcome: weight} or [(outcome, weight), ...]; zero weights never come up
+        items = [(o, float(w)) for o, w in (weights.items() if isinstance(weights, dict) else weights) if w > 0]
+        if not items:
+            raise ValueError("AliasSampler needs at least one positive weight")
+        self.outcomes = [o for o, _ in items]
+        self._n = n = len(items)
+        self._rng = rng
+
+        total = sum(w for _, w in items)
+        scaled = [w * n / total for _, w in items]
+        prob = [0.0] * n
+        alias = list(range(n))
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            prob[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:  # leftovers are 1.0 up to float error
+            prob[i] = 1.0
+        self._prob = prob
+        self._alias = alias
+
+    def sample(self, n: int | None = None):
+        if n is None:
+            r = self._rng.random() * self._n
+            i = int(r)
+            return self.outcomes[i if r - i < self._prob[i] else self._alias[i]]
+        outcomes, prob, alias, size, rnd = self.outcomes, self._prob, self._alias, self._n, self._rng.random
+        out = []
+        for _ in range(n):
+            r = rnd() * size
+            i = int(r)
+            out.append(outcomes[i if r - i < prob[i] else alias[i]])
+        return out
+
+    def probabilities(self) -> dict:
+        # effective probability of each outcome, handy for tests and the simulator
+        out = dict.fromkeys(self.outcomes, 0.0)
+        for i, o in enumerate(self.outcomes):
+            out[o] += self._prob[i] / self._n
+            out[self.outcomes[self._alias[i]]] += (1.0 - self._prob[i]) / self._n
+        return out
+
+
+class UniformRange:
+    __slots__ = ("lo", "hi", "ndigits", "_rng")
+
+    def __init__(self, lo: float, hi: float, ndigits: int = 2, rng=random):
+        self.lo, self.hi, self.ndigits, self._rng = lo, hi, ndigits, rng
+
+    def sample(self, n: int | None = None):
+        lo, span, nd, rnd = self.lo, self.hi - self.lo, self.ndigits, self._rng.random
+        if n is None:
+            return round(lo + span * rnd(), nd)
+        return [round(lo + span * rnd(), nd) for _ in range(n)]
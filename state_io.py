@@ -0,0 +1,433 @@
+"""Streaming export / import of the economy tables.
+
+Both work on one guild's economy at a time. The export is gzip-compressed NDJSON: a header
+line naming each table's columns (and the guild it came from), then lines of
+{"table": ..., "rows": [[...], ...]} holding up to EXPORT_BATCH_ROWS rows each.
+Rows come off server-side cursors inside one read-only snapshot, and a worker thread does
+the JSON encoding and compression, so memory stays flat however many users there are and
+the event loop never blocks on disk.
+
+The importer reads that format or the older single-document JSON export, validates every
+row, COPYs it into temp staging tables and merges each table into the target guild with
+one upsert, logging every wallet it changes to the ledger. Dry runs do all of that and roll back.
+"""
+import asyncio
+import gzip
+import json
+import math
+import queue
+import threading
+import time
+import zlib
+
+import ledger
+
+FORMAT_NAME = "economy-state"
+FORMAT_VERSION = 1
+TABLES = ("balances", "job_counts", "highest_jobs", "buffs")
+
+EXPORT_BATCH_ROWS = 5000  # rows per cursor fetch and per output line
+_WRITER_QUEUE_SIZE = 8    # batches buffered ahead of the writer before we wait on it
+
+
+def table_columns(job_columns) -> dict:
+    # column order for every table in the export (user_id always first; guild_id is implied)
+    return {
+        "balances": ("user_id", "balance"),
+        "job_counts": ("user_id", *job_columns),
+        "highest_jobs": ("user_id", "job", "rarity", "amount"),
+        "buffs": ("user_id", "uses", "cooldown_until"),
+    }
+
+
+class _GzipLineWriter(threading.Thread):
+    """Encodes NDJSON lines and gzips them on its own thread."""
+
+    def __init__(self, path: str, compresslevel: int = 6):
+        super().__init__(name="state-export-writer", daemon=True)
+        self.path = path
+        self.compresslevel = compresslevel
+        self.queue = queue.Queue(maxsize=_WRITER_QUEUE_SIZE)
+        self.error = None
+
+    def run(self):
+        try:
+            with gzip.open(self.path, "wb", compresslevel=self.compresslevel) as f:
+                while True:
+                    item = self.queue.get()
+                    if item is None:
+                        break
+                    f.write(_encode(item))
+        except BaseException as e:
+            self.error = e
+            # keep draining so the producer never blocks on a dead writer
+            while self.queue.get() is not None:
+                pass
+
+    async def put(self, item):
+        if self.error is not None:
+            raise self.error
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            await asyncio.to_thread(self.queue.put, item)
+
+
+_encode_json = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def _encode(obj) -> bytes:
+    # one C-level encode per batch; per-row dumps was ~8x slower
+    return (_encode_json(obj) + "\n").encode()
+
+
+async def export_state(pool, path: str, job_columns, guild_id: int, **header) -> dict:
+    """Write one guild's rows of every table to `path`; returns {table: row_count}."""
+    columns = table_columns(job_columns)
+    writer = _GzipLineWriter(path)
+    writer.start()
+    counts = dict.fromkeys(TABLES, 0)
+    try:
+        await writer.put({
+            "format": FORMAT_NAME, "version": FORMAT_VERSION,
+            "exported_at": int(time.time()), "guild_id": guild_id, "columns": columns, **header,
+        })
+        async with pool.acquire() as conn:
+            # one snapshot for all four tables so the export is self-consistent
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                for table in TABLES:
+                    cur = await conn.cursor(
+                        f"SELECT {', '.join(columns[table])} FROM {table} WHERE guild_id=$1 ORDER BY user_id",
+                        guild_id,
+                    )
+                    while rows := await cur.fetch(EXPORT_BATCH_ROWS):
+                        await writer.put({"table": table, "rows": [tuple(r) for r in rows]})
+                        counts[table] += len(rows)
+    finally:
+        await asyncio.to_thread(writer.queue.put, None)
+        await asyncio.to_thread(writer.join)
+    if writer.error is not None:
+        raise writer.error
+    return counts
+
+
+# ---------- import ----------
+IMPORT_MAX_ERRORS = 20  # validation errors kept for the report; the rest are only counted
+# what decoding a file that isn't an export raises; the reader turns these into ExportFormatError
+_DECODE_ERRORS = (EOFError, gzip.BadGzipFile, zlib.error, UnicodeDecodeError, json.JSONDecodeError)
+
+
+class ExportFormatError(Exception):
+    """The file isn't an export at all (bad gzip, UTF-8 or JSON, wrong shape).
+
+    Bad rows in a readable file are collected in the ImportReport instead.
+    """
+
+
+class ImportReport:
+    def __init__(self, path: str, fmt: str, dry_run: bool, guild_id: int):
+        self.path = path
+        self.format = fmt
+        self.dry_run = dry_run
+        self.guild_id = guild_id      # where the rows went
+        self.source_guild_id = None   # where they came from, if the file says
+        self.rows = dict.fromkeys(TABLES, 0)
+        self.inserted = dict.fromkeys(TABLES, 0)
+        self.updated = dict.fromkeys(TABLES, 0)
+        self.errors = []
+        self.error_count = 0
+        self.seconds = 0.0
+
+    def unchanged(self, table: str) -> int:
+        return self.rows[table] - self.inserted[table] - self.updated[table]
+
+    @property
+    def ok(self) -> bool:
+        return self.error_count == 0
+
+    def error(self, where: str, msg: str):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(f"{where}: {msg}")
+
+
+def _whole(v) -> int:
+    # ints, digit strings (old exports keyed by str(user_id)) or integral floats; never bools
+    if isinstance(v, bool) or (isinstance(v, float) and not v.is_integer()):
+        raise ValueError(f"expected a whole number, got {v!r}")
+    return int(v)
+
+
+def _user_id(v) -> int:
+    n = _whole(v)
+    if n <= 0:
+        raise ValueError(f"bad user id {v!r}")
+    return n
+
+
+def _finite(v) -> float:
+    f = float(v)
+    if not math.isfinite(f):
+        raise ValueError(f"not a finite number: {v!r}")
+    return f
+
+
+def _count(v) -> int:
+    n = _whole(v)
+    if n < 0:
+        raise ValueError(f"negative value {v!r}")
+    return n
+
+
+def _text(v):
+    if v is not None and not isinstance(v, str):
+        raise ValueError(f"expected text, got {v!r}")
+    return v
+
+
+_CONVERT = {"id": _user_id, "count": _count, "float": _finite, "text": _text}
+_INT_TYPES, _NUM_TYPES, _TEXT_TYPES = {int}, {int, float}, {str, type(None)}
+
+
+def _column_kinds(job_columns) -> dict:
+    return {
+        "balances": ("id", "float"),
+        "job_counts": ("id", *("count" for _ in job_columns)),
+        "highest_jobs": ("id", "text", "text", "float"),
+        "buffs": ("id", "count", "count"),
+    }
+
+
+def _fast_batch(rows, kinds):
+    # whole-batch check with C-level builtins; None sends the batch down the row-by-row path
+    try:
+        if any(len(r) != len(kinds) for r in rows):
+            return None
+    except TypeError:
+        return None
+    cols = list(zip(*rows))
+    for kind, col in zip(kinds, cols):
+        types = set(map(type, col))
+        if kind == "id" or kind == "count":
+            if not types <= _INT_TYPES or min(col) < (1 if kind == "id" else 0):
+                return None
+        elif kind == "float":
+            if not types <= _NUM_TYPES or not all(map(math.isfinite, col)):
+                return None
+        elif not types <= _TEXT_TYPES:
+            return None
+    return list(zip(*cols))
+
+
+def _defaults(job_columns) -> dict:
+    # columns an older file may lack; anything not listed here is required
+    return {"job_counts": dict.fromkeys(job_columns, 0)}
+
+
+def read_header(path: str) -> dict | None:
+    # the NDJSON header line, or None for old JSON exports
+    with _open(path) as f:
+        try:
+            line = f.readline()
+        except _DECODE_ERRORS as e:
+            raise ExportFormatError(f"not a readable export: {e}") from e
+        try:
+            header = json.loads(line)
+        except ValueError:
+            return None
+    return header if isinstance(header, dict) and header.get("format") == FORMAT_NAME else None
+
+
+def _open(path: str):
+    with open(path, "rb") as f:
+        gz = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rt", encoding="utf-8") if gz else open(path, encoding="utf-8")
+
+
+def _read_batches(path: str, report, job_columns):
+    # sync generator run on a worker thread: (table, [validated tuples]) for either format
+    try:
+        yield from _parse_batches(path, report, job_columns)
+    except _DECODE_ERRORS as e:
+        raise ExportFormatError(f"not a readable export: {e}") from e
+
+
+def _parse_batches(path: str, report, job_columns):
+    columns = table_columns(job_columns)
+    kinds = _column_kinds(job_columns)
+    defaults = _defaults(job_columns)
+    with _open(path) as f:
+        first = f.readline()
+        try:
+            header = json.loads(first)
+        except ValueError:
+            header = None
+        if isinstance(header, dict) and header.get("format") == FORMAT_NAME:
+            report.format = f"ndjson v{header.get('version')}"
+            report.source_guild_id = header.get("guild_id")
+            if header.get("version") != FORMAT_VERSION:
+                report.error("header", f"unsupported version {header.get('version')!r}")
+                return
+            source = _ndjson_batches(f, report, header.get("columns", {}), columns, defaults)
+        else:
+            report.format = "json"
+            f.seek(0)
+            source = _legacy_batches(json.load(f), columns, defaults)
+
+        for table, rows, where in source:
+            out = _fast_batch(rows, kinds[table])
+            if out is not None:
+                report.rows[table] += len(out)
+                yield table, out
+                continue
+            conv = [_CONVERT[k] for k in kinds[table]]
+            out = []
+            for i, row in enumerate(rows):
+                try:
+                    if len(row) != len(conv):
+                        raise ValueError(f"expected {len(conv)} values, got {len(row)}")
+                    out.append(tuple(c(v) for c, v in zip(conv, row)))
+                except (TypeError, ValueError) as e:
+                    report.error(f"{table} {where(i)}", str(e))
+            report.rows[table] += len(out)
+            yield table, out
+
+
+def _ndjson_batches(f, report, file_columns, columns, defaults):
+    # map each table's file column order onto ours, filling defaults for missing columns
+    if not isinstance(file_columns, dict):
+        raise ExportFormatError("the header's columns aren't an object")
+    plans = {}
+    for table, cols in columns.items():
+        have = list(file_columns.get(table, ()))
+        extra = [c for c in have if c not in cols]
+        missing = [c for c in cols if c not in have and c not in defaults.get(table, {})]
+        if extra or missing:
+            report.error("header", f"{table} columns don't match (extra {extra}, missing {missing})")
+            return
+        if have == list(cols):
+            plans[table] = None  # same layout, rows pass through untouched
+        else:
+            idx = {c: i for i, c in enumerate(have)}
+            plans[table] = [(idx[c], None) if c in idx else (None, defaults[table][c]) for c in cols]
+
+    for lineno, line in enumerate(f, start=2):
+        if not line.strip():
+            continue
+        try:
+            rec = json.loads(line)
+            table, rows = rec["table"], rec["rows"]
+        except (ValueError, KeyError, TypeError) as e:
+            report.error(f"line {lineno}", f"unreadable batch ({e})")
+            continue
+        if table not in plans:
+            report.error(f"line {lineno}", f"unknown table {table!r}")
+            continue
+        if not isinstance(rows, list):
+            report.error(f"line {lineno}", "rows aren't a list")
+            continue
+        plan = plans[table]
+        if plan is not None:
+            try:
+                rows = [[row[i] if i is not None else d for i, d in plan] for row in rows]
+            except (TypeError, IndexError, KeyError) as e:
+                report.error(f"line {lineno}", f"rows don't match the header's columns ({e!r})")
+                continue
+        yield table, rows, lambda i, n=lineno: f"line {n} row {i + 1}"
+
+
+def _legacy_batches(doc, columns, defaults):
+    # the old export: {"balances": {uid: bal}, "job_counts": {uid: {...}}, ...}
+    if not isinstance(doc, dict):
+        raise ExportFormatError("expected a JSON object")
+    for table in TABLES:
+        entries = doc.get(table) or {}
+        if not isinstance(entries, dict):
+            raise ExportFormatError(f"{table} isn't an object")
+        cols = columns[table][1:]
+        fill = defaults.get(table, {})
+        uids = list(entries)
+        for start in range(0, len(uids), EXPORT_BATCH_ROWS):
+            chunk = uids[start:start + EXPORT_BATCH_ROWS]
+            rows = []
+            for uid in chunk:
+                v = entries[uid]
+                uid = int(uid) if isinstance(uid, str) and uid.isdigit() else uid
+                if table == "balances":
+                    rows.append((uid, v))
+                else:
+                    v = v if isinstance(v, dict) else {}
+                    rows.append((uid, *(v.get(c, fill.get(c)) for c in cols)))
+            yield table, rows, lambda i, c=chunk: f"user {c[i]}"
+
+
+async def import_state(pool, path: str, job_columns, guild_id: int, dry_run: bool = False,
+                       replace: bool = False) -> ImportReport:
+    """Load an export into one guild's rows. replace=True empties that guild first; dry_run rolls back."""
+    started = time.perf_counter()
+    columns = table_columns(job_columns)
+    report = ImportReport(path, "?", dry_run, guild_id)
+    batches = _read_batches(path, report, job_columns)
+
+    async with pool.acquire() as conn:
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            for table in TABLES:
+                await conn.execute(
+                    f"CREATE TEMP TABLE _stage_{table} ON COMMIT DROP AS "
+                    f"SELECT {', '.join(columns[table])} FROM {table} WITH NO DATA"
+                )
+            # parsing runs on a worker thread, one batch ahead of the COPY into staging
+            pending = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+            try:
+                while (item := await pending) is not None:
+                    pending = asyncio.ensure_future(asyncio.to_thread(next, batches, None))
+                    table, rows = item
+                    if rows:
+                        await conn.copy_records_to_table(f"_stage_{table}", records=rows, columns=columns[table])
+            finally:
+                if not pending.done():
+                    await asyncio.gather(pending, return_exceptions=True)
+
+            for table in TABLES:
+                dupes = await conn.fetch(
+                    f"SELECT user_id FROM _stage_{table} GROUP BY user_id HAVING count(*) > 1 LIMIT {IMPORT_MAX_ERRORS}"
+                )
+                for r in dupes:
+                    report.error(table, f"user {r['user_id']} appears more than once")
+
+            if report.ok:
+                # balance changes go to the ledger like any other, in the same transaction
+                await conn.execute(ledger.IMPORT_SQL, guild_id, replace)
+                if replace:
+                    for table in TABLES:
+                        await conn.execute(f"DELETE FROM {table} WHERE guild_id=$1", guild_id)
+                for table in TABLES:
+                    cols = columns[table]
+                    rest = cols[1:]
+                    updates = ", ".join(f"{c}=EXCLUDED.{c}" for c in rest)
+                    # rows that already match are left alone: no dead tuples, no index churn
+                    row = await conn.fetchrow(f"""
+                        WITH merged AS (
+                            INSERT INTO {table} AS t (guild_id, {', '.join(cols)})
+                            SELECT $1, {', '.join(cols)} FROM _stage_{table}
+                            ON CONFLICT (guild_id, user_id) DO UPDATE SET {updates}
+                            WHERE ({', '.join(f"t.{c}" for c in rest)})
+                                  IS DISTINCT FROM ({', '.join(f"EXCLUDED.{c}" for c in rest)})
+                            RETURNING (xmax = 0) AS inserted
+                        )
+                        SELECT count(*) FILTER (WHERE inserted) AS inserted, count(*) AS total FROM merged
+                    """, guild_id)
+                    report.inserted[table] = row["inserted"]
+                    report.updated[table] = row["total"] - row["inserted"]
+        except BaseException:
+            await tr.rollback()
+            raise
+        if dry_run or not report.ok:
+            await tr.rollback()
+        else:
+            await tr.commit()
+
+    report.seconds = time.perf_counter() - started
+    return report
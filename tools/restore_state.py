@@ -0,0 +1,72 @@
+"""Load an /exportstate snapshot (or an old JSON export) into a Postgres database.
+
+For moving hosts or undoing a bad /resetall without the bot running. Creates the tables
+if they don't exist yet, then merges the file over one guild's rows (or replaces them with
+--replace). The guild defaults to the one named in the export; old JSON exports need
+--guild-id. Stop the bot first when ACCOUNT_CACHE=1, or its next flush will write cached
+rows back.
+
+    DATABASE_URL=postgres://... python tools/restore_state.py exports/state-....ndjson.gz [--dry-run] [--replace] [--guild-id N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+import asyncpg
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import bot  # noqa: E402
+import cluster  # noqa: E402
+import state_io  # noqa: E402
+
+
+async def run(args) -> int:
+    bot.pool = await asyncpg.create_pool(args.database_url, min_size=1, max_size=1, statement_cache_size=0)
+    try:
+        await bot.init_db()
+        report = await state_io.import_state(
+            bot.pool, args.path, bot.JOB_COUNT_COLUMNS, args.guild_id, dry_run=args.dry_run, replace=args.replace
+        )
+        if report.ok and not args.dry_run:
+            # running bot processes reload this guild's leaderboards and drop its cached accounts
+            async with bot.pool.acquire() as conn:
+                await cluster.notify(conn, "guild_data", guild_id=args.guild_id)
+    finally:
+        await bot.pool.close()
+
+    print(f"{report.path} ({report.format}) into guild {report.guild_id} in {report.seconds:.1f}s")
+    for table in state_io.TABLES:
+        line = f"  {table:<13} {report.rows[table]:>10,} rows"
+        if report.ok:
+            line += (f"  {report.inserted[table]:>10,} new  {report.updated[table]:>10,} updated"
+                     f"  {report.unchanged(table):>10,} unchanged")
+        print(line)
+    if not report.ok:
+        print(f"{report.error_count:,} problems, nothing was changed:")
+        for err in report.errors:
+            print(f"  {err}")
+        return 1
+    print("dry run, rolled back" if args.dry_run else ("replaced" if args.replace else "merged"))
+    return 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("path", help="export file (.ndjson.gz, .ndjson or old .json)")
+    ap.add_argument("--dry-run", action="store_true", help="validate and count, then roll back")
+    ap.add_argument("--replace", action="store_true", help="empty the tables before loading")
+    ap.add_argument("--database-url", default=os.getenv("DATABASE_URL"), help="defaults to $DATABASE_URL")
+    ap.add_argument("--guild-id", type=int, help="guild to load into; defaults to the guild in the export header")
+    args = ap.parse_args()
+    if not args.database_url:
+        ap.error("set DATABASE_URL or pass --database-url")
+    if args.guild_id is None:
+        args.guild_id = (state_io.read_header(args.path) or {}).get("guild_id")
+        if args.guild_id is None:
+            ap.error("this export doesn't name its guild; pass --guild-id")
+    sys.exit(asyncio.run(run(args)))
+
+
+if __name__ == "__main__":
+    main()
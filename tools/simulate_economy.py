@@ -0,0 +1,149 @@
+"""Monte Carlo model of the economy, driven by the live tables in bot.py.
+
+Simulates millions of /work calls per career tier with NumPy (fail roll, specials with
+their dev/glitch gates, tips), plus coinflip and roulette expected value with and
+without the alcohol buff. Nothing here touches Discord or Postgres.
+
+    pip install numpy
+    python tools/simulate_economy.py [--draws 2000000] [--seed 1] [--test-mode] [--works-per-hour 120]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import bot  # noqa: E402
+import roulette as roulette_engine  # noqa: E402
+
+WORK_FAIL_CHANCE = 0.05  # mirrors the first roll in work_cmd
+
+
+class Odds:
+    def __init__(self, test_mode: bool):
+        self.test_mode = test_mode
+        self.special_chance = bot._TEST_SPECIAL_CHANCE if test_mode else bot.SPECIAL_CHANCE
+        self.tip_chance = bot._TEST_TIP_BASE_CHANCE if test_mode else bot.TIP_BASE_CHANCE
+        denom = bot._TEST_DEV_CHANCE_DENOM if test_mode else bot.DEV_CHANCE_DENOM
+        saved = bot.DEV_CHANCE_DENOM
+        bot.DEV_CHANCE_DENOM = denom
+        try:
+            self.gates = np.array([bot._special_job_gate_chance(j["name"]) for j in bot.special_jobs])
+        finally:
+            bot.DEV_CHANCE_DENOM = saved
+
+
+def _weights(allowed: dict):
+    rarities = list(bot.RARITY_ORDER)
+    w = np.array([allowed.get(r, 0) for r in rarities], dtype=float)
+    return rarities, w / w.sum()
+
+
+def simulate_work(rng, allowed: dict, odds: Odds, n: int):
+    """Vectorised work_cmd: returns (earnings per call, job done mask, rarity index, is_special)."""
+    rarities, probs = _weights(allowed)
+    lo = np.array([bot.jobs[r]["payout"][0] for r in rarities], dtype=float)
+    hi = np.array([bot.jobs[r]["payout"][1] for r in rarities], dtype=float)
+    s_lo = np.array([j["payout"][0] for j in bot.special_jobs], dtype=float)
+    s_hi = np.array([j["payout"][1] for j in bot.special_jobs], dtype=float)
+    t_w = np.array([t["weight"] for t in bot.tip_tiers], dtype=float)
+    t_lo = np.array([t["range"][0] for t in bot.tip_tiers])
+    t_hi = np.array([t["range"][1] for t in bot.tip_tiers])
+
+    failed = rng.random(n) < WORK_FAIL_CHANCE
+    # a special that fails its gate falls through to a normal roll, same as work_cmd
+    special_idx = rng.integers(0, len(bot.special_jobs), n)
+    special = (~failed) & (rng.random(n) <= odds.special_chance) & (rng.random(n) < odds.gates[special_idx])
+
+    rarity = rng.choice(len(rarities), size=n, p=probs)
+    normal_pay = np.round(lo[rarity] + (hi[rarity] - lo[rarity]) * rng.random(n), 2)
+    special_pay = np.round(s_lo[special_idx] + (s_hi[special_idx] - s_lo[special_idx]) * rng.random(n), 2)
+    base = np.where(special, special_pay, normal_pay)
+
+    tipped = rng.random(n) <= odds.tip_chance
+    tier = rng.choice(len(t_w), size=n, p=t_w / t_w.sum())
+    mult = np.round(t_lo[tier] + (t_hi[tier] - t_lo[tier]) * rng.random(n), 2)
+    final = np.round(np.where(tipped, base * mult, base), 2)
+
+    earned = np.where(failed, 0.0, final)
+    return earned, ~failed, rarity, special
+
+
+def report_work(rng, odds: Odds, draws: int, works_per_hour: float):
+    tiers = [{"name": "TEST MODE", "required": 0, "allowed": bot._TEST_ALLOWED}] if odds.test_mode else bot.CAREER_PATH
+    print(f"\n/work per career tier ({draws:,} simulated calls each)")
+    print(f"{'tier':<22}{'$/call':>12}{'std':>12}{'$/job':>12}{'special %':>10}"
+          f"{'calls to next':>15}{'hours':>8}{'cum. money':>16}")
+    cum_money = 0.0
+    rows = []
+    for i, tier in enumerate(tiers):
+        earned, done, rarity, special = simulate_work(rng, tier["allowed"], odds, draws)
+        per_call = earned.mean()
+        per_job = earned[done].mean()
+        if i + 1 < len(tiers):
+            jobs_needed = tiers[i + 1]["required"] - tier["required"]
+            calls = jobs_needed / done.mean()
+            cum_money += calls * per_call
+            to_next, hours, cum = f"{calls:,.0f}", f"{calls / works_per_hour:,.1f}", f"${cum_money:,.0f}"
+        else:
+            to_next, hours, cum = "top", "-", "-"
+        print(f"{tier['name']:<22}{per_call:>12,.2f}{earned.std():>12,.2f}{per_job:>12,.2f}"
+              f"{special.mean() * 100:>9.3f}%{to_next:>15}{hours:>8}{cum:>16}")
+        rows.append((tier["name"], earned, rarity, special))
+
+    # per-rarity payout (tips included) at the top tier, where every rarity shows up
+    name, earned, rarity, special = rows[-1]
+    print(f"\nExpected payout per job by rarity at {name} (tips included)")
+    print(f"{'rarity':<12}{'share':>9}{'mean $':>14}{'std':>14}")
+    normal = earned > 0
+    for idx, r in enumerate(bot.RARITY_ORDER):
+        mask = normal & ~special & (rarity == idx)
+        if mask.any():
+            print(f"{r:<12}{mask.mean() * 100:>8.3f}%{earned[mask].mean():>14,.2f}{earned[mask].std():>14,.2f}")
+    if special.any():
+        print(f"{'special':<12}{special.mean() * 100:>8.3f}%{earned[special].mean():>14,.2f}{earned[special].std():>14,.2f}")
+
+
+def report_gambling(rng, draws: int):
+    print(f"\nGambling expected value per $1 wagered ({draws:,} simulated bets each)")
+    print(f"{'game / bet':<16}{'plain EV':>12}{'alcohol EV':>12}")
+    plain = np.where(rng.random(draws) < 0.5, 1.0, -1.0).mean()
+    boosted = np.where(rng.random(draws) < bot.COINFLIP_BOOST_WINPROB, 1.0, -1.0).mean()
+    print(f"{'coinflip':<16}{plain:>+12.4f}{boosted:>+12.4f}")
+
+    pockets = rng.integers(0, len(roulette_engine.POCKETS), draws)
+    salvage = rng.random(draws) < bot.ROULETTE_COLOR_SALVAGE
+    for bet in ["red", "black", "green", "odd", "even", "1-18", "19-36", "1st12", "2nd12", "3rd12", "7", "00"]:
+        row = np.array(roulette_engine.PAYOUTS[bet])
+        payout = row[pockets]
+        plain_ev = (payout - 1.0).mean()
+        if bet in roulette_engine.COLOR_BETS:
+            boosted_pay = np.where((payout == 0) & salvage, 2.0, payout)
+            boost_ev = f"{(boosted_pay - 1.0).mean():>+12.4f}"
+        else:
+            boost_ev = f"{'n/a':>12}"
+        print(f"{'roulette ' + bet:<16}{plain_ev:>+12.4f}{boost_ev}")
+
+    edge = bot.COINFLIP_BOOST_WINPROB * 2 - 1
+    breakeven = bot.ALCOHOL_PRICE / (bot.ALCOHOL_BOOST_USES * edge)
+    print(f"\nAlcohol (${bot.ALCOHOL_PRICE:,.0f}, {bot.ALCOHOL_BOOST_USES} uses) pays for itself on coinflips "
+          f"averaging ${breakeven:,.0f}+ per bet.")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--draws", type=int, default=2_000_000, help="simulated calls per tier / bet type")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--test-mode", action="store_true", help="use the /testmode odds and distribution")
+    ap.add_argument("--works-per-hour", type=float, default=120.0, help="pace used for the time-to-climb column")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    odds = Odds(args.test_mode)
+    report_work(rng, odds, args.draws, args.works_per_hour)
+    report_gambling(rng, args.draws)
+
+
+if __name__ == "__main__":
+    main()